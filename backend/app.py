@@ -1,15 +1,31 @@
 # backend/app.py
 import os
 import uuid
+import re
 import json
-from flask import Flask, request, jsonify, send_from_directory
-from werkzeug.utils import secure_filename
-from skimage import io
-from skimage.segmentation import slic
+import time
+import hashlib
 import numpy as np
-import cv2
-from PIL import Image        # <-- For TIFF → PNG conversion
-from helpers import segments_to_polygons, compute_superpixel_features
+from flask import Flask, request, jsonify, send_from_directory, send_file, stream_with_context, g
+from werkzeug.utils import secure_filename
+from tiling import TILE_SIZE, TILE_OVERLAP, MIN_TILE_SIZE
+from pipeline import segment_file, segment_files, throughput
+from parallel import get_executor
+from jobs import JobQueue
+from cache import SegmentCache, image_hash, segment_key
+from segstore import load_store, store_path, legacy_json_path, convert_legacy
+from labelstore import LabelStore
+from predict import Predictor
+from online import OnlineTrainer, RETRAIN_MIN_LABELS, PROPAGATE_USER_PREFIX
+from raster import open_raster, write_preview
+from uploads import ChunkedUploads, UploadError, UPLOAD_CHUNK_BYTES
+from pyramid import TILE_FOLDER, TILE_MIMETYPE, build_pyramid, load_info, pyramid_dir
+from export import (EXPORT_FOLDER, MASK_FORMATS, MASK_TILE, build_bundle, class_lut, class_names,
+                    mask_strips, png_stream, write_geotiff)
+from metrics import registry, StageProfile, rss_bytes
+from graph import FLOOD_MAX_DISTANCE, SPREAD_ALPHA, SPREAD_MIN_CONFIDENCE, flood_fill, spread_labels
+from wire import (WIRE_MIMETYPE, COMPRESS_MIN_BYTES, COMPRESS_MIMETYPES, accepted_encoding, compress,
+                  encode_geometry)
 from flask_cors import CORS
 
 # Config
@@ -17,13 +33,103 @@ UPLOAD_FOLDER = "uploads"
 SEG_FOLDER = "segments"
 LABEL_FOLDER = "labels"
 ALLOWED = {"png", "jpg", "jpeg", "tif", "tiff"}
+# polygons per page of /segments/<image_id>/viewport
+DEFAULT_PAGE_SIZE = 2000
+MAX_PAGE_SIZE = 10000
+# tiles never change for an image id, so browsers may keep them this long
+TILE_MAX_AGE = 7 * 24 * 3600
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(SEG_FOLDER, exist_ok=True)
 os.makedirs(LABEL_FOLDER, exist_ok=True)
+os.makedirs(TILE_FOLDER, exist_ok=True)
+os.makedirs(EXPORT_FOLDER, exist_ok=True)
 
 app = Flask(__name__, static_folder="../frontend/build", static_url_path="/")
-CORS(app, resources={r"/*": {"origins": "*"}})
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=["ETag", "X-Labels-Version", "X-Mask-Classes"])
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+jobs = JobQueue()
+seg_cache = SegmentCache()
+label_store = LabelStore(LABEL_FOLDER)
+# loaded once per worker process; None-safe when no model has been trained
+predictor = Predictor()
+trainer = OnlineTrainer(label_store, SEG_FOLDER, predictor)
+chunked_uploads = ChunkedUploads(UPLOAD_FOLDER)
+registry.describe("orthoviewer_requests_total", "counter", "HTTP requests by route, method and status.")
+registry.describe("orthoviewer_request_seconds", "histogram", "HTTP request handling time by route.")
+registry.describe("orthoviewer_segmented_pixels_total", "counter", "Image pixels segmented by segment jobs.")
+
+
+@app.before_request
+def start_timer():
+    g.request_t0 = time.perf_counter()
+
+
+@app.after_request
+def count_request(response):
+    # the route pattern, not the path, keeps the label set small
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    registry.inc("orthoviewer_requests_total", route=route, method=request.method, status=response.status_code)
+    registry.observe("orthoviewer_request_seconds", time.perf_counter() - g.request_t0, route=route)
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """gzip (brotli when installed) JSON, geometry and text bodies for clients that accept it."""
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or response.mimetype not in COMPRESS_MIMETYPES or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = accepted_encoding(request.accept_encodings)
+    data = response.get_data()
+    if encoding is None or len(data) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def wants_binary():
+    """?format=binary or an Accept of the geometry type: polygons as wire.encode_geometry."""
+    return request.args.get("format") == "binary" or WIRE_MIMETYPE in request.headers.get("Accept", "")
+
+
+def store_etag(store, *parts):
+    """
+    Validator of a response built from a store. Stores are replaced whole
+    when an image is re-segmented, so meta.json's mtime tells versions
+    apart; parts are whatever else shaped the response (model, query).
+    The negotiated format is part of it too: the Accept header alone can
+    switch between JSON and packed geometry (wants_binary).
+    Weak, since one representation goes out both compressed and not.
+    """
+    stamp = os.stat(os.path.join(store.path, "meta.json")).st_mtime_ns
+    fmt = "binary" if wants_binary() else "json"
+    text = json.dumps([store.path, stamp, store.info.get("cache_key"), fmt, *parts], default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def set_validator(resp, etag):
+    """ETag of a store response; it varies with Accept (see store_etag)."""
+    resp.set_etag(etag, weak=True)
+    resp.vary.add("Accept")
+
+
+def not_modified(etag):
+    """304 for a request whose If-None-Match already has etag, else None."""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    resp = app.response_class(status=304)
+    set_validator(resp, etag)
+    return resp
+
+
+def geometry_response(header, ids, offsets, vertices, features=None, feature_names=None, etag=None):
+    resp = app.response_class(encode_geometry(ids, offsets, vertices, header, features, feature_names),
+                              mimetype=WIRE_MIMETYPE)
+    if etag:
+        set_validator(resp, etag)
+    return resp
 
 
 def allowed(filename):
@@ -35,6 +141,39 @@ def health():
     return jsonify({"status": "ok"})
 
 
+def finish_upload(save_path, save_name, image_id, progress=None):
+    """
+    Post-process a stored upload: content hash (so identical uploads share
+    cached segmentations), the windowed raster segmentation reads from,
+    and for TIFFs a PNG preview the browser can show. The TIFF itself stays
+    the segmentation input. The viewer's tile pyramid is built in the
+    background. The body carries the per-stage `profile`.
+    """
+    stages = StageProfile(progress)
+    stages("hash")
+    image_hash(save_path)
+    stages("raster")
+    raster = open_raster(save_path)
+    queue_pyramid(image_id, save_path)
+    body = {"image_id": image_id, "filename": save_name, "path": save_path,
+            "image_shape": list(raster.shape), "preview": save_name, "tiles": f"/tiles/{image_id}"}
+    if save_name.lower().endswith((".tif", ".tiff")):
+        stages("preview")
+        body["preview"] = save_name + ".png"
+        write_preview(raster, os.path.join(UPLOAD_FOLDER, body["preview"]))
+    stages.close()
+    body["profile"] = stages.breakdown()
+    return body
+
+
+def upload_name(filename):
+    """(image_id, stored file name) for a new upload, or None if not allowed."""
+    if not filename or not allowed(filename):
+        return None
+    image_id = str(uuid.uuid4())
+    return image_id, f"{image_id}_{secure_filename(filename)}"
+
+
 @app.route("/upload", methods=["POST"])
 def upload():
     if "image" not in request.files:
@@ -43,30 +182,182 @@ def upload():
 
     if f.filename == "":
         return jsonify({"error": "empty filename"}), 400
-    if not allowed(f.filename):
+    names = upload_name(f.filename)
+    if names is None:
         return jsonify({"error": "bad ext"}), 400
 
-    filename = secure_filename(f.filename)
-    image_id = str(uuid.uuid4())
-    save_name = f"{image_id}_{filename}"
+    image_id, save_name = names
     save_path = os.path.join(UPLOAD_FOLDER, save_name)
-
-    # Save original
     f.save(save_path)
+    body = finish_upload(save_path, save_name, image_id)
+    if request.args.get("profile") != "1":
+        del body["profile"]
+    return jsonify(body)
 
-    # --- TIFF FIX: Convert TIFF → PNG for browser preview ---
-    if filename.lower().endswith((".tif", ".tiff")):
-        png_name = save_name + ".png"
-        png_path = os.path.join(UPLOAD_FOLDER, png_name)
 
-        img = Image.open(save_path)
-        img.save(png_path)
+@app.route("/upload/chunked", methods=["POST"])
+def upload_chunked_start():
+    """Start a resumable upload: {filename, size} -> {upload_id, offset, chunk_size}."""
+    data = request.json or {}
+    filename = data.get("filename")
+    try:
+        size = int(data.get("size"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "filename and size required"}), 400
+    if size <= 0 or upload_name(filename) is None:
+        return jsonify({"error": "bad filename or size"}), 400
+    return jsonify(dict(chunked_uploads.create(filename, size), chunk_size=UPLOAD_CHUNK_BYTES)), 201
+
+
+@app.route("/upload/chunked/<upload_id>", methods=["GET"])
+def upload_chunked_status(upload_id):
+    info = chunked_uploads.status(upload_id)
+    if info is None:
+        return jsonify({"error": "upload not found"}), 404
+    return jsonify(info)
+
+
+@app.route("/upload/chunked/<upload_id>", methods=["PUT"])
+def upload_chunked_put(upload_id):
+    """
+    Raw bytes for ?offset=N (the current offset). On 409 the body carries
+    the offset to resume from. The last chunk answers 202 with an
+    `upload` job that hashes and decodes the file and writes the preview;
+    its result is the /upload body. A retried last chunk gets the same job.
+    """
+    try:
+        offset = int(request.args.get("offset", -1))
+    except ValueError:
+        return jsonify({"error": "offset must be an int"}), 400
+    length = request.content_length
+    if length is None:
+        return jsonify({"error": "Content-Length required"}), 411
+    try:
+        info = chunked_uploads.write(upload_id, offset, request.stream, length)
+    except UploadError as e:
+        return jsonify({"error": str(e), "offset": e.offset}), e.status
+    if info["offset"] < info["size"]:
+        return jsonify(dict(info, done=False))
+
+    def complete(part, info):
+        image_id, save_name = upload_name(info["filename"])
+        os.replace(part, os.path.join(UPLOAD_FOLDER, save_name))
+        return {"image_id": image_id, "filename": save_name, "job_id": queue_upload(image_id, save_name).id}
+
+    record, created = chunked_uploads.finish(upload_id, complete)
+    # a finished job may have been evicted; the work is safe to repeat
+    job = jobs.get(record["job_id"]) or queue_upload(record["image_id"], record["filename"])
+    return job_response(job, created, done=True, image_id=record["image_id"], filename=record["filename"])
+
+
+def queue_upload(image_id, save_name):
+    save_path = os.path.join(UPLOAD_FOLDER, save_name)
+    return jobs.submit("upload", ("upload", image_id), finish_upload, save_path, save_name, image_id)[0]
+
+
+def segment_params(data):
+    # tile_size 0 (or less) picks tiling automatically; others are at least MIN_TILE_SIZE
+    tile_size = int(data.get("tile_size", 0))
+    tile_size = max(tile_size, MIN_TILE_SIZE) if tile_size > 0 else 0
+    return {
+        "n_segments": int(data.get("n_segments", 800)),
+        "compactness": float(data.get("compactness", 10.0)),
+        "tile_size": tile_size,
+        "tile_overlap": min(max(int(data.get("tile_overlap", TILE_OVERLAP)), 0), (tile_size or TILE_SIZE) // 2),
+    }
 
-        # Use PNG instead of TIFF going forward
-        save_name = png_name
-        save_path = png_path
 
-    return jsonify({"image_id": image_id, "filename": save_name, "path": save_path})
+def job_response(job, created, **extra):
+    body = job.to_dict()
+    body.update({"status_url": f"/jobs/{job.id}", "result_url": f"/jobs/{job.id}/result", "created_job": created},
+                **extra)
+    return jsonify(body), 202
+
+
+def run_segment_job(image_path, image_filename, params, key, progress):
+    t0 = time.perf_counter()
+    # stage timings / peak memory go to /metrics and are kept for ?profile=1
+    stages = StageProfile(progress)
+    out = segment_file(image_path, image_filename, SEG_FOLDER, params, executor=get_executor(),
+                       progress=stages, cache_key=key)
+    stages.close()
+    h, w = out["image_shape"][:2]
+    registry.inc("orthoviewer_segmented_pixels_total", h * w)
+    image_id = out["image_id"]
+    seg_cache.put(key, store_path(SEG_FOLDER, image_id))
+    return {"image_id": image_id, "n_segments": out["n_segments"], "profile": stages.breakdown(),
+            "throughput": throughput(1, h * w, time.perf_counter() - t0)}
+
+
+def segments_response(store, profile=None):
+    """
+    JSON segments document for a store, built on demand. The id-free body
+    is kept in the memory cache, so only the ids are serialized per request.
+    With ?polygons=0 only the summary is sent; clients then page polygons
+    in through /segments/<image_id>/viewport.
+    When a model is loaded, model suggestions ride along (?suggestions=0
+    leaves them out).
+    With ?format=binary the polygons and feature rows come packed
+    (wire.encode_geometry) and the rest of the document in its header.
+    Responses carry an ETag; an unchanged store and model answer 304.
+    With ?profile=1 the body carries a per-stage breakdown (seconds, peak
+    RSS): `profile` (stages already run, e.g. by the segment job) plus the
+    prediction and serialization done here.
+    """
+    extra = {"image_id": store.info["image_id"], "image_filename": store.info["image_filename"]}
+    stages = StageProfile()
+    predictor.refresh()
+    suggest = predictor.available and request.args.get("suggestions") != "0"
+    # a profile is measured per request, so those are never cached
+    etag = None
+    if request.args.get("profile") != "1":
+        etag = store_etag(store, predictor.version if suggest else None, sorted(request.args.items(multi=True)))
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            return unchanged
+    if suggest:
+        with stages.stage("predict"):
+            extra.update(model=predictor.version, suggestions=predictor.suggestions(store))
+    if request.args.get("profile") == "1":
+        extra["profile"] = list(profile or [])
+    summary = {k: store.info[k] for k in ("image_shape", "n_segments", "meta")}
+    if request.args.get("polygons") == "0":
+        if "profile" in extra:
+            extra["profile"] += stages.breakdown()
+        resp = jsonify(dict(summary, polygons=None, features=None, **extra))
+        if etag:
+            set_validator(resp, etag)
+        return resp
+    if wants_binary():
+        with stages.stage("serialize"):
+            ids = np.asarray(store.ids)
+            X = store.features
+            if "profile" in extra:
+                extra["profile"] += stages.breakdown()
+            return geometry_response(dict(summary, **extra), ids, store.offsets, store.vertices,
+                                     None if X is None else X[ids.astype(np.int64) - 1],
+                                     store.info.get("feature_names"), etag)
+    with stages.stage("serialize"):
+        key = store.info.get("cache_key")
+        body = seg_cache.get_body(key) if key else None
+        if body is None:
+            doc = store.to_dict()
+            del doc["image_id"], doc["image_filename"]
+            body = json.dumps(doc)
+            if key:
+                seg_cache.put_body(key, body)
+    if "profile" in extra:
+        extra["profile"] += stages.breakdown()
+    ids = json.dumps(extra)
+    resp = app.response_class(ids[:-1] + ", " + body[1:], mimetype="application/json")
+    if etag:
+        set_validator(resp, etag)
+    return resp
+
+
+def run_batch_job(items, params, progress):
+    results, stats = segment_files(items, SEG_FOLDER, params, executor=get_executor(), progress=progress)
+    return {"results": results, "throughput": stats}
 
 
 @app.route("/segment", methods=["POST"])
@@ -76,66 +367,340 @@ def segment():
     if not image_filename:
         return jsonify({"error": "image_filename required"}), 400
 
-    n_segments = int(data.get("n_segments", 800))
-    compactness = float(data.get("compactness", 10.0))
+    params = segment_params(data)
 
     image_path = os.path.join(UPLOAD_FOLDER, image_filename)
     if not os.path.exists(image_path):
         return jsonify({"error": "image not found"}), 404
 
-    img = io.imread(image_path)
-
-    # ensure RGB
-    if img.ndim == 2:
-        img = np.stack([img] * 3, axis=-1)
-    if img.shape[-1] > 3:
-        img = img[..., :3]
+    # cache hit: same image content + parameters, no decoding at all
+    image_id = image_filename.split("_")[0]
+    key = segment_key(image_hash(image_path), params)
+    store = load_store(SEG_FOLDER, image_id)
+    if store is None or store.info.get("cache_key") != key:
+        if seg_cache.materialize(key, store_path(SEG_FOLDER, image_id), image_id, image_filename):
+            store = load_store(SEG_FOLDER, image_id)
+        else:
+            store = None
+    if store is not None:
+        # same query args as /jobs/<id>/result, e.g. ?polygons=0 for the summary
+        return segments_response(store)
+
+    # one job per image: a second upload of the same bytes needs its own
+    # store, and joining another image's job would hand back that image's id
+    job, created = jobs.submit("segment", ("segment", image_id, key), run_segment_job, image_path, image_filename,
+                               params, key)
+    return job_response(job, created)
+
+
+@app.route("/segment_batch", methods=["POST"])
+def segment_batch():
+    data = request.json or {}
+    image_filenames = data.get("image_filenames")
+    if not image_filenames:
+        return jsonify({"error": "image_filenames required"}), 400
+
+    items = []
+    for image_filename in image_filenames:
+        image_path = os.path.join(UPLOAD_FOLDER, image_filename)
+        if not os.path.exists(image_path):
+            return jsonify({"error": f"image not found: {image_filename}"}), 404
+        items.append((image_path, image_filename))
+
+    params = segment_params(data)
+    key = ("segment_batch", tuple(image_filenames), json.dumps(params, sort_keys=True))
+    job, created = jobs.submit("segment_batch", key, run_batch_job, items, params)
+    return job_response(job, created)
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def get_job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    if job.status == "failed":
+        return jsonify({"error": job.error, "job": job.to_dict()}), 500
+    if job.status != "done":
+        return jsonify({"error": "job not finished", "job": job.to_dict()}), 409
+    if job.kind == "segment":
+        return get_segments(job.result["image_id"], profile=job.result.get("profile"))
+    return jsonify(job.result)
 
-    # --- HUGE IMAGE FIX: Downscale if too large ---
-    MAX_SIZE = 3000
-    h, w = img.shape[:2]
-    max_dim = max(h, w)
 
-    if max_dim > MAX_SIZE:
-        scale = MAX_SIZE / max_dim
-        new_w = int(w * scale)
-        new_h = int(h * scale)
-        print("Downscaling:", (h, w), "→", (new_h, new_w))
-        img = cv2.resize(img, (new_w, new_h))
+@app.route("/segments/<image_id>", methods=["GET"])
+def get_segments(image_id, profile=None):
+    store = load_store(SEG_FOLDER, image_id)
+    if store is not None:
+        return segments_response(store, profile)
 
-    img_float = img.astype(np.float32) / 255.0
+    # results written before the segstore format
+    seg_path = legacy_json_path(SEG_FOLDER, image_id)
+    if not os.path.exists(seg_path):
+        return jsonify({"error": "segments not found"}), 404
+    with open(seg_path, "r") as fh:
+        data = json.load(fh)
+    return jsonify(data)
 
-    segments = slic(img_float, n_segments=n_segments, compactness=compactness, start_label=1)
 
-    polygons, meta = segments_to_polygons(segments)
-    features = compute_superpixel_features(img, segments)
+def open_store(image_id):
+    """The segstore for image_id, converting a legacy JSON result first."""
+    store = load_store(SEG_FOLDER, image_id)
+    if store is None and os.path.exists(legacy_json_path(SEG_FOLDER, image_id)):
+        convert_legacy(SEG_FOLDER, image_id, UPLOAD_FOLDER)
+        store = load_store(SEG_FOLDER, image_id)
+    return store
 
-    image_id = image_filename.split("_")[0]
-    out = {
-        "image_id": image_id,
-        "image_filename": image_filename,
-        "image_shape": list(img.shape),
-        "n_segments": int(np.max(segments)),
-        "polygons": polygons,
-        "meta": meta,
-        "features": features
-    }
 
-    seg_path = os.path.join(SEG_FOLDER, f"{image_id}_segments.json")
-    with open(seg_path, "w") as fh:
-        json.dump(out, fh)
+@app.route("/segments/<image_id>/viewport", methods=["GET"])
+def get_segments_viewport(image_id):
+    store = open_store(image_id)
+    if store is None:
+        return jsonify({"error": "segments not found"}), 404
 
-    return jsonify(out)
+    height, width = store.info["image_shape"][:2]
+    try:
+        x0 = int(request.args.get("x0", 0))
+        y0 = int(request.args.get("y0", 0))
+        x1 = int(request.args.get("x1", width))
+        y1 = int(request.args.get("y1", height))
+        page = max(0, int(request.args.get("page", 0)))
+        page_size = min(MAX_PAGE_SIZE, max(1, int(request.args.get("page_size", DEFAULT_PAGE_SIZE))))
+        zoom = float(request.args.get("zoom", 1.0))
+    except ValueError:
+        return jsonify({"error": "x0, y0, x1, y1, page, page_size must be ints, zoom a float"}), 400
+    if zoom <= 0:
+        return jsonify({"error": "zoom must be positive"}), 400
+
+    etag = store_etag(store, sorted(request.args.items(multi=True)))
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+    if wants_binary():
+        doc, ids, offsets, vertices, X = store.viewport_arrays(x0, y0, x1, y1, page=page, page_size=page_size,
+                                                               zoom=zoom)
+        return geometry_response(doc, ids, offsets, vertices, X, store.info.get("feature_names"), etag)
+    resp = jsonify(store.viewport(x0, y0, x1, y1, page=page, page_size=page_size, zoom=zoom))
+    set_validator(resp, etag)
+    return resp
+
+
+@app.route("/segments/<image_id>/predictions", methods=["GET"])
+def get_predictions(image_id):
+    """Suggested label + confidence for every superpixel of a segmented image."""
+    predictor.refresh()
+    if not predictor.available:
+        return jsonify({"error": "no model loaded"}), 503
+    store = open_store(image_id)
+    if store is None:
+        return jsonify({"error": "segments not found"}), 404
+    t0 = time.perf_counter()
+    suggestions = predictor.suggestions(store)
+    if suggestions is None:
+        return jsonify({"error": "segment features do not match the model"}), 409
+    return jsonify({
+        "image_id": image_id,
+        "model": predictor.version,
+        "classes": predictor.class_names,
+        "suggestions": suggestions,
+        "predict_ms": round((time.perf_counter() - t0) * 1000, 2),
+    })
+
+
+@app.route("/segments/<image_id>/propagate", methods=["POST"])
+def propagate_labels(image_id):
+    """
+    Pre-label superpixels by spreading seed labels over the adjacency
+    graph stored with the segments. Body (all optional):
+      seeds: {superpixel_id: label}   default: the image's saved labels,
+        except earlier propagated ones
+      method: "flood" (default) grows each seed over edges whose Lab
+        distance is <= max_distance (at most max_steps hops); "spread"
+        is label spreading (alpha), keeping labels >= min_confidence
+      save: true writes the result as user "propagate_<method>" (never
+        trained on); superpixels with other saved labels are left alone
+    """
+    data = request.json or {}
+    method = data.get("method", "flood")
+    if method not in ("flood", "spread"):
+        return jsonify({"error": "method must be flood or spread"}), 400
+    store = open_store(image_id)
+    if store is None:
+        return jsonify({"error": "segments not found"}), 404
+    graph = store.graph()
+    if graph is None:
+        return jsonify({"error": "segments have no label raster; re-segment the image"}), 409
+
+    kept = {int(sid): e["label"] for sid, e in label_store.get_labels(image_id).items()
+            if sid.isdigit() and not e["user"].startswith(PROPAGATE_USER_PREFIX)}
+    try:
+        seeds = {int(sid): str(label) for sid, label in (data.get("seeds") or kept).items()}
+        max_distance = float(data.get("max_distance", FLOOD_MAX_DISTANCE))
+        max_steps = None if data.get("max_steps") is None else int(data["max_steps"])
+        alpha = float(data.get("alpha", SPREAD_ALPHA))
+        min_confidence = float(data.get("min_confidence", SPREAD_MIN_CONFIDENCE))
+    except (AttributeError, TypeError, ValueError):
+        return jsonify({"error": "seeds must be {superpixel_id: label}, other options numbers"}), 400
+    seeds = {sid: label for sid, label in seeds.items() if 0 < sid < graph.size}
+    if not seeds:
+        return jsonify({"error": "no seed labels"}), 400
+
+    t0 = time.perf_counter()
+    names = sorted(set(seeds.values()))
+    seed_ids = np.fromiter(seeds.keys(), dtype=np.int64, count=len(seeds))
+    seed_classes = np.array([names.index(label) for label in seeds.values()], dtype=np.int32)
+    if method == "flood":
+        classes = flood_fill(graph, seed_ids, seed_classes, max_distance, max_steps)
+        confidence = None
+        found = classes >= 0
+    else:
+        classes, confidence = spread_labels(graph, seed_ids, seed_classes, len(names), alpha)
+        found = (classes >= 0) & (confidence >= min_confidence)
+    # seeds and labels saved by hand stay as they are
+    found[seed_ids] = False
+    found[np.array([sid for sid in kept if sid < graph.size], dtype=np.int64)] = False
+    sids = np.flatnonzero(found)
+    labels = {int(sid): names[c] for sid, c in zip(sids, classes[sids])}
+    elapsed_ms = round((time.perf_counter() - t0) * 1000, 2)
+
+    written = 0
+    if data.get("save") and labels:
+        label_store.set_labels(image_id, labels.items(), user=PROPAGATE_USER_PREFIX + method)
+        written = len(labels)
+    body = {"image_id": image_id, "method": method, "n_seeds": len(seeds), "labels": labels,
+            "written": written, "propagate_ms": elapsed_ms}
+    if confidence is not None:
+        body["confidence"] = {sid: round(float(confidence[sid]), 4) for sid in labels}
+    return jsonify(body)
+
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(seg_cache.stats())
+
+
+registry.describe("orthoviewer_segment_cache_hits_total", "counter", "Segment cache hits on disk.")
+registry.describe("orthoviewer_segment_cache_memory_hits_total", "counter", "Rendered JSON served from memory.")
+registry.describe("orthoviewer_segment_cache_misses_total", "counter", "Segment cache misses.")
+registry.describe("orthoviewer_segment_cache_evictions_total", "counter", "Segment cache disk evictions.")
+registry.describe("orthoviewer_jobs", "gauge", "Jobs held by the queue, by kind and status.")
+registry.describe("orthoviewer_process_resident_memory_bytes", "gauge", "Resident memory of the app process.")
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus text format: requests, stage timings / peak memory, cache, jobs."""
+    stats = seg_cache.stats()
+    for name in ("hits", "memory_hits", "misses", "evictions"):
+        registry.set(f"orthoviewer_segment_cache_{name}_total", stats[name])
+    counts = jobs.counts()
+    for kind in {kind for kind, _ in counts}:
+        for status in ("queued", "running", "done", "failed"):
+            registry.set("orthoviewer_jobs", counts.get((kind, status), 0), kind=kind, status=status)
+    registry.set("orthoviewer_process_resident_memory_bytes", rss_bytes())
+    return app.response_class(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+def run_retrain_job(progress):
+    return trainer.update(progress=progress)
+
+
+def queue_retrain(force=False):
+    """Update the model in the background once enough new labels are saved."""
+    if force or trainer.pending() >= RETRAIN_MIN_LABELS:
+        return jobs.submit("retrain", ("retrain",), run_retrain_job)
+    return None, False
+
+
+@app.route("/model", methods=["GET"])
+def model_status():
+    predictor.refresh()
+    return jsonify({
+        "available": predictor.available,
+        "version": predictor.version,
+        "classes": predictor.class_names,
+        "online": trainer.status(),
+        "pending_labels": trainer.pending(),
+    })
+
+
+@app.route("/model/retrain", methods=["POST"])
+def model_retrain():
+    job, created = queue_retrain(force=True)
+    return job_response(job, created)
+
+
+def run_pyramid_job(image_path, image_id, progress):
+    info = build_pyramid(open_raster(image_path), pyramid_dir(TILE_FOLDER, image_id),
+                         content_hash=image_hash(image_path), progress=progress)
+    return {"image_id": image_id, "levels": info["levels"]}
+
+
+def queue_pyramid(image_id, image_path):
+    return jobs.submit("pyramid", ("pyramid", image_id), run_pyramid_job, image_path, image_id)
+
+
+def upload_path(image_id):
+    """Path of the original upload for image_id, or None."""
+    store = load_store(SEG_FOLDER, image_id)
+    if store is not None:
+        path = os.path.join(UPLOAD_FOLDER, store.info["image_filename"])
+        return path if os.path.exists(path) else None
+    # derived files (<upload>.png, .raster.npy, ...) have longer names
+    names = sorted((n for n in os.listdir(UPLOAD_FOLDER) if n.startswith(image_id + "_") and allowed(n)), key=len)
+    return os.path.join(UPLOAD_FOLDER, names[0]) if names else None
+
+
+# pyramid info.json per image id, once built
+tile_infos = {}
+
+
+def tile_info(image_id):
+    info = tile_infos.get(image_id)
+    if info is None:
+        info = load_info(pyramid_dir(TILE_FOLDER, image_id))
+        if info is not None:
+            tile_infos[image_id] = info
+    return info
+
+
+@app.route("/tiles/<image_id>", methods=["GET"])
+def get_tile_info(image_id):
+    """
+    Pyramid metadata: {width, height, tile_size, levels, format, url}, with
+    url a template for /tiles/<image_id>/<z>/<x>_<y>.<ext>. Level z is
+    width / 2**(levels - 1 - z) wide. While the pyramid is not built yet
+    this queues the build and answers 202 with the job.
+    """
+    info = tile_info(image_id)
+    if info is not None:
+        return jsonify(dict(info, image_id=image_id, url=f"/tiles/{image_id}/{{z}}/{{x}}_{{y}}.{info['ext']}"))
+    image_path = upload_path(image_id)
+    if image_path is None:
+        return jsonify({"error": "image not found"}), 404
+    job, created = queue_pyramid(image_id, image_path)
+    return job_response(job, created)
 
 
-@app.route("/segments/<image_id>", methods=["GET"])
-def get_segments(image_id):
-    seg_path = os.path.join(SEG_FOLDER, f"{image_id}_segments.json")
-    if not os.path.exists(seg_path):
-        return jsonify({"error": "segments not found"}), 404
-    with open(seg_path, "r") as fh:
-        data = json.load(fh)
-    return jsonify(data)
+@app.route("/tiles/<image_id>/<int:z>/<name>", methods=["GET"])
+def get_tile(image_id, z, name):
+    info = tile_info(image_id)
+    if info is None or not re.fullmatch(rf"\d+_\d+\.{info['ext']}", name):
+        return jsonify({"error": "tile not found"}), 404
+    # same upload content -> same tiles, so the ETag survives rebuilds
+    etag = f"{info['hash'] or image_id}-{z}-{name}"
+    resp = send_from_directory(pyramid_dir(TILE_FOLDER, image_id), f"{z}/{name}",
+                               mimetype=TILE_MIMETYPE[info["format"]], etag=etag, max_age=TILE_MAX_AGE)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
 
 
 @app.route("/save_label", methods=["POST"])
@@ -149,29 +714,155 @@ def save_label():
     if not image_id or spid is None or label is None:
         return jsonify({"error": "image_id, superpixel_id, label required"}), 400
 
-    label_file = os.path.join(LABEL_FOLDER, f"{image_id}_labels.json")
-    if os.path.exists(label_file):
-        with open(label_file, "r") as fh:
-            labels = json.load(fh)
-    else:
-        labels = {}
-
-    import time
-    labels[str(spid)] = {"label": label, "user": user, "ts": int(time.time())}
-    with open(label_file, "w") as fh:
-        json.dump(labels, fh)
+    label_store.set_label(image_id, spid, label, user=user)
+    queue_retrain()
 
     return jsonify({"status": "ok", "written": True})
 
 
+@app.route("/save_labels", methods=["POST"])
+def save_labels():
+    """
+    Label many superpixels in one write. Body:
+      image_id, user
+      labels: [{superpixel_id, label}, ...]      explicit pairs, and/or
+      label + rect [x0, y0, x1, y1] or polygon [[x, y], ...]
+        every superpixel whose centroid falls inside the selection
+        (image pixels) gets `label`
+    """
+    data = request.json or {}
+    image_id = data.get("image_id")
+    user = data.get("user", "anonymous")
+    if not image_id:
+        return jsonify({"error": "image_id required"}), 400
+
+    try:
+        items = [(int(e["superpixel_id"]), e["label"]) for e in data.get("labels", [])]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "labels must be a list of {superpixel_id, label}"}), 400
+    if not all(isinstance(label, str) and label for _, label in items):
+        return jsonify({"error": "each label must be a non-empty string"}), 400
+
+    rect = data.get("rect")
+    polygon = data.get("polygon")
+    if rect is not None or polygon is not None:
+        label = data.get("label")
+        if not isinstance(label, str) or not label:
+            return jsonify({"error": "label (a non-empty string) required with rect or polygon"}), 400
+        store = open_store(image_id)
+        if store is None:
+            return jsonify({"error": "segments not found"}), 404
+        try:
+            if polygon is not None:
+                if len(polygon) < 3:
+                    raise ValueError
+                seg_ids = store.select(polygon=[[float(x), float(y)] for x, y in polygon])
+            else:
+                x0, y0, x1, y1 = (float(v) for v in rect)
+                seg_ids = store.select(rect=[x0, y0, x1, y1])
+        except (TypeError, ValueError):
+            return jsonify({"error": "rect must be [x0, y0, x1, y1], polygon a list of >= 3 [x, y]"}), 400
+        items += [(int(sid), label) for sid in seg_ids]
+
+    if not items:
+        return jsonify({"status": "ok", "written": 0, "labels": {}})
+    label_store.set_labels(image_id, items, user=user)
+    queue_retrain()
+    return jsonify({"status": "ok", "written": len(items), "labels": {sid: label for sid, label in items}})
+
+
 @app.route("/labels/<image_id>", methods=["GET"])
 def get_labels(image_id):
-    label_file = os.path.join(LABEL_FOLDER, f"{image_id}_labels.json")
-    if not os.path.exists(label_file):
-        return jsonify({})
-    with open(label_file, "r") as fh:
-        labels = json.load(fh)
-    return jsonify(labels)
+    """
+    Saved labels {superpixel_id: {label, user, ts}}. With ?since=N only
+    the labels written after version N, as {version, since, labels}:
+    clients keep the version and poll with it. The X-Labels-Version
+    header (and the ETag) carry the image's label version either way.
+    """
+    since = request.args.get("since")
+    try:
+        labels, version = label_store.changes(image_id, int(since or 0))
+    except ValueError:
+        return jsonify({"error": "since must be an int"}), 400
+    resp = jsonify(labels if since is None else {"version": version, "since": int(since), "labels": labels})
+    resp.headers["X-Labels-Version"] = str(version)
+    resp.set_etag(f"{image_id}-{since}-{version}", weak=True)
+    return resp.make_conditional(request)
+
+
+@app.route("/export/<image_id>/mask", methods=["GET"])
+def export_mask(image_id):
+    """
+    Full-resolution class mask of the saved labels, ?format=png (default)
+    or tif (tiled GeoTIFF, georeferenced like a TIFF upload). Pixel values
+    are class indices in the order of the X-Mask-Classes header; 255 is
+    unlabeled.
+    """
+    fmt = request.args.get("format", "png")
+    if fmt not in MASK_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(MASK_FORMATS)}"}), 400
+    store = open_store(image_id)
+    if store is None:
+        return jsonify({"error": "segments not found"}), 404
+    if store.labels is None:
+        return jsonify({"error": "segments have no label raster; re-segment the image"}), 409
+    labels = label_store.get_labels(image_id)
+    classes = class_names([labels])
+    lut = class_lut(store, labels, classes)
+    height, width = store.info["image_shape"][:2]
+    headers = {"X-Mask-Classes": ",".join(classes),
+               "Content-Disposition": f"attachment; filename={image_id}_mask.{fmt}"}
+    if fmt == "png":
+        return app.response_class(stream_with_context(png_stream(mask_strips(store, lut), width, height, classes)),
+                                  mimetype="image/png", headers=headers)
+
+    # TIFF needs a seekable file; it is unlinked once open and freed after sending
+    image_path = os.path.join(UPLOAD_FOLDER, store.info["image_filename"])
+    path = os.path.join(EXPORT_FOLDER, f".{image_id}_mask.{uuid.uuid4().hex}.tif")
+    write_geotiff(mask_strips(store, lut, rows=MASK_TILE), width, height, classes, path,
+                  image_path if os.path.exists(image_path) else None)
+    fh = open(path, "rb")
+    os.remove(path)
+    resp = send_file(fh, mimetype="image/tiff", conditional=False, etag=False)
+    resp.headers.update(headers)
+    return resp
+
+
+def run_bundle_job(image_ids, fmt, progress):
+    name = f"dataset_{uuid.uuid4().hex}.zip"
+    meta = build_bundle(SEG_FOLDER, UPLOAD_FOLDER, label_store, image_ids, os.path.join(EXPORT_FOLDER, name), fmt,
+                        progress=progress)
+    return {"download": f"/exports/{name}", "classes": meta["classes"], "images": len(meta["images"]),
+            "labeled": sum(im["n_labeled"] for im in meta["images"])}
+
+
+@app.route("/export/bundle", methods=["POST"])
+def export_bundle():
+    """
+    Queue a dataset bundle: {image_ids, format: png|tif} -> job whose result
+    links a zip of masks, per-image feature/label matrices and metadata.json.
+    """
+    data = request.json or {}
+    image_ids = data.get("image_ids")
+    fmt = data.get("format", "png")
+    if not image_ids or not isinstance(image_ids, list):
+        return jsonify({"error": "image_ids required"}), 400
+    if fmt not in MASK_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(MASK_FORMATS)}"}), 400
+    for image_id in image_ids:
+        store = open_store(image_id)
+        if store is None:
+            return jsonify({"error": f"segments not found: {image_id}"}), 404
+        if store.labels is None:
+            return jsonify({"error": f"segments have no label raster: {image_id}"}), 409
+    job, created = jobs.submit("export_bundle", ("export_bundle", tuple(image_ids), fmt), run_bundle_job,
+                               image_ids, fmt)
+    return job_response(job, created)
+
+
+@app.route("/exports/<path:filename>")
+def serve_exports(filename):
+    return send_from_directory(EXPORT_FOLDER, filename, as_attachment=True)
 
 
 @app.route("/uploads/<path:filename>")
@@ -0,0 +1,61 @@
+# bench/graph.py
+# Usage example (from backend/):
+# python -m bench.graph --size 2000 --segments 4000 --seeds 40
+#
+# Builds the superpixel adjacency graph of a synthetic field (bench.suite)
+# and propagates seed labels (each seed's majority crop class) with flood
+# fill and label spreading: time, superpixels labeled and their accuracy.
+
+import argparse
+import numpy as np
+from helpers import compute_superpixels, compute_superpixel_features, region_adjacency
+from graph import FLOOD_MAX_DISTANCE, SPREAD_MIN_CONFIDENCE, RegionGraph, flood_fill, spread_labels
+from bench.segstore import best_of
+from bench.suite import CROP_CLASS, FieldImage
+
+
+def majority_class(segments, mask, size):
+    counts = np.stack([np.bincount(segments.ravel(), weights=(mask.ravel() == c), minlength=size)
+                       for c in range(int(CROP_CLASS.max()) + 1)])
+    return counts.argmax(axis=0)
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--size", type=int, default=2000)
+    p.add_argument("--segments", type=int, default=4000)
+    p.add_argument("--seeds", type=int, default=40)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--repeat", type=int, default=5)
+    args = p.parse_args()
+
+    field = FieldImage(args.size, args.size, seed=args.seed)
+    img = field.array()
+    segments = compute_superpixels(img, n_segments=args.segments)
+    _, X = compute_superpixel_features(img, segments)
+    truth = majority_class(segments, field.mask(0, args.size, 0, args.size), X.shape[0] + 1)
+
+    t_adj = best_of(lambda: region_adjacency(segments, X.shape[0] + 1), args.repeat)
+    edges = region_adjacency(segments, X.shape[0] + 1)
+    graph = RegionGraph.build(edges, X)
+    print(f"{X.shape[0]} superpixels, {len(edges)} edges; adjacency pass {t_adj * 1e3:.1f} ms "
+          f"({args.size}x{args.size} label map)")
+
+    rng = np.random.default_rng(args.seed)
+    seed_ids = rng.choice(np.arange(1, graph.size), args.seeds, replace=False)
+    seed_classes = truth[seed_ids]
+    n_classes = int(CROP_CLASS.max()) + 1
+
+    print(f"{'method':<8} {'ms':>8} {'labeled':>8} {'accuracy':>9}")
+    t = best_of(lambda: flood_fill(graph, seed_ids, seed_classes, FLOOD_MAX_DISTANCE), args.repeat)
+    classes = flood_fill(graph, seed_ids, seed_classes, FLOOD_MAX_DISTANCE)
+    found = classes >= 0
+    print(f"{'flood':<8} {t * 1e3:>8.2f} {found.sum():>8} {(classes[found] == truth[found]).mean():>9.3f}")
+    t = best_of(lambda: spread_labels(graph, seed_ids, seed_classes, n_classes), args.repeat)
+    classes, confidence = spread_labels(graph, seed_ids, seed_classes, n_classes)
+    found = (classes >= 0) & (confidence >= SPREAD_MIN_CONFIDENCE)
+    print(f"{'spread':<8} {t * 1e3:>8.2f} {found.sum():>8} {(classes[found] == truth[found]).mean():>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
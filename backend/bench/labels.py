@@ -0,0 +1,98 @@
+# bench/labels.py
+# Usage example (from backend/):
+# python -m bench.labels --writers 4 --writes 500 --batches 1,10,100,1000,10000
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import tempfile
+import time
+from labelstore import LabelStore
+
+IMAGE_ID = "bench"
+
+
+def json_writer(folder, worker, n):
+    # the old /save_label: read the whole file, set one key, rewrite it
+    label_file = os.path.join(folder, f"{IMAGE_ID}_labels.json")
+    for i in range(n):
+        try:
+            with open(label_file) as fh:
+                labels = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            labels = {}  # another writer is mid-rewrite
+        labels[f"{worker}-{i}"] = {"label": "tree", "user": str(worker), "ts": int(time.time())}
+        with open(label_file, "w") as fh:
+            json.dump(labels, fh)
+
+
+def store_writer(folder, worker, n):
+    store = LabelStore(folder)
+    for i in range(n):
+        store.set_label(IMAGE_ID, f"{worker}-{i}", "tree", user=str(worker))
+
+
+def json_count(folder):
+    try:
+        with open(os.path.join(folder, f"{IMAGE_ID}_labels.json")) as fh:
+            return len(json.load(fh))
+    except ValueError:
+        return 0
+
+
+def run(writer, count, writers, writes):
+    with tempfile.TemporaryDirectory() as folder:
+        if writer is store_writer:
+            LabelStore(folder)  # create the schema before the race starts
+        procs = [mp.Process(target=writer, args=(folder, w, writes)) for w in range(writers)]
+        t0 = time.perf_counter()
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - t0
+        return writers * writes / elapsed, count(folder)
+
+
+def batch_latency(size):
+    # one set_labels() transaction for the whole batch vs one per label
+    with tempfile.TemporaryDirectory() as folder:
+        store = LabelStore(folder)
+        items = [(i, "tree") for i in range(size)]
+        t0 = time.perf_counter()
+        store.set_labels(IMAGE_ID, items)
+        batch = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for spid, label in items:
+            store.set_label(IMAGE_ID, spid, label)
+        single = time.perf_counter() - t0
+        return batch, single
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--writers", type=int, default=4)
+    p.add_argument("--writes", type=int, default=500, help="labels saved per writer process")
+    p.add_argument("--batches", default="1,10,100,1000,10000", help="batch sizes for the latency table")
+    args = p.parse_args()
+
+    expected = args.writers * args.writes
+    print(f"{args.writers} writer processes x {args.writes} labels")
+    print(f"{'store':<10} {'writes/s':>10} {'kept':>8} {'lost':>8}")
+    for name, writer, count in [
+        ("json", json_writer, json_count),
+        ("sqlite", store_writer, lambda folder: len(LabelStore(folder).get_labels(IMAGE_ID))),
+    ]:
+        rate, kept = run(writer, count, args.writers, args.writes)
+        print(f"{name:<10} {rate:>10.0f} {kept:>8} {expected - kept:>8}")
+
+    print()
+    print(f"{'batch':>6} {'batch_ms':>9} {'per_label_ms':>13}")
+    for size in (int(b) for b in args.batches.split(",")):
+        batch, single = batch_latency(size)
+        print(f"{size:>6} {batch * 1000:>9.2f} {single * 1000:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
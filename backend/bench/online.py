@@ -0,0 +1,99 @@
+# bench/online.py
+# Usage example (from backend/):
+# python -m bench.online --size 768 --segments 600 --batch 30
+#
+# Online updates from label batches that each hold one class, on a
+# synthetic field (bench.suite): a lone first batch must not be served,
+# the second class must show up in the suggestions, and relabeled
+# superpixels must train with their new label only. Prints accuracy,
+# confidence and time per update; exits non-zero when a check fails.
+
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+from labelstore import LabelStore
+from online import OnlineTrainer
+from pipeline import segment_file
+from predict import Predictor
+from segstore import load_store
+from bench.graph import majority_class
+from bench.suite import FieldImage
+
+CLASS_NAMES = ["good", "moderate", "bad"]
+IMAGE_ID = "bench"
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--size", type=int, default=768)
+    p.add_argument("--segments", type=int, default=600)
+    p.add_argument("--batch", type=int, default=30, help="labels per one-class batch")
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+
+    field = FieldImage(args.size, args.size, seed=args.seed)
+    failures = []
+
+    def check(ok, text):
+        print(f"{'ok' if ok else 'FAIL':<4} {text}")
+        if not ok:
+            failures.append(text)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image_path = os.path.join(tmp, f"{IMAGE_ID}_field.png")
+        Image.fromarray(field.array()).save(image_path)
+        seg_folder = os.path.join(tmp, "segments")
+        os.makedirs(seg_folder)
+        segment_file(image_path, os.path.basename(image_path), seg_folder,
+                     {"n_segments": args.segments, "compactness": 10})
+        store = load_store(seg_folder, IMAGE_ID)
+        X = np.asarray(store.features)
+        segments = np.asarray(store.labels)
+        truth = majority_class(segments, field.mask(0, args.size, 0, args.size), len(X) + 1)[1:]
+        names = np.array(CLASS_NAMES, dtype=object)[truth]
+
+        labels = LabelStore(os.path.join(tmp, "labels"))
+        predictor = Predictor(os.path.join(tmp, "model_rf.joblib"), os.path.join(tmp, "model_online.joblib"))
+        trainer = OnlineTrainer(labels, seg_folder, predictor, base_path=os.path.join(tmp, "model_rf.joblib"),
+                                path=os.path.join(tmp, "model_online.joblib"))
+        rng = np.random.default_rng(args.seed)
+
+        def label_batch(name):
+            ids = rng.choice(np.flatnonzero(names == name), args.batch, replace=False) + 1
+            labels.set_labels(IMAGE_ID, [(int(sid), name) for sid in ids], user="bench")
+            t0 = time.perf_counter()
+            status = trainer.update()
+            print(f"update ({name}): {(time.perf_counter() - t0) * 1e3:.0f} ms, {status}")
+
+        # the two most common classes of the field, one batch each
+        found, counts = np.unique(names, return_counts=True)
+        first, second = found[np.argsort(-counts)[:2]]
+        label_batch(first)
+        check(not predictor.available, "a one-class model is not served")
+
+        label_batch(second)
+        best, confidence = predictor.predict_matrix(X)
+        suggested = np.array(predictor.class_names, dtype=object)[best]
+        both = np.isin(names, [first, second])
+        accuracy = float((suggested[both] == names[both]).mean())
+        print(f"classes {predictor.class_names}, accuracy on {first}/{second} {accuracy:.3f}, "
+              f"confidence {confidence.min():.2f}..{confidence.max():.2f}")
+        check(len(set(suggested)) > 1, "suggestions are not one class everywhere")
+        check(accuracy > float(max((names[both] == n).mean() for n in (first, second))),
+              "accuracy beats always suggesting the larger class")
+
+        # relabel every superpixel labeled `second` so far as "weed"
+        relabel = [int(sid) for sid, e in labels.get_labels(IMAGE_ID).items() if e["label"] == second]
+        labels.set_labels(IMAGE_ID, [(sid, "weed") for sid in relabel], user="bench")
+        trainer.update()
+        check(second not in predictor.class_names, "relabeled superpixels no longer train their old label")
+
+    if failures:
+        raise SystemExit(f"{len(failures)} check(s) failed")
+
+
+if __name__ == "__main__":
+    main()
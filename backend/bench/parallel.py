@@ -0,0 +1,53 @@
+# bench/parallel.py
+# Usage example (from backend/):
+# python -m bench.parallel --images 8 --size 1500 --workers 1 4 8 --tiled-size 6000
+
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from skimage import io
+from pipeline import segment_files, segment_image, throughput
+from parallel import get_executor
+from bench.polygons import synthetic_image
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--images", type=int, default=8)
+    p.add_argument("--size", type=int, default=1500)
+    p.add_argument("--n_segments", type=int, default=1000)
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    p.add_argument("--tiled-size", type=int, default=0, help="also time one tiled image of this size")
+    p.add_argument("--tile_size", type=int, default=2048)
+    args = p.parse_args()
+
+    params = {"n_segments": args.n_segments, "compactness": 10.0}
+    with tempfile.TemporaryDirectory() as tmp:
+        items = []
+        for i in range(args.images):
+            name = f"{i:08d}_synthetic.png"
+            path = os.path.join(tmp, name)
+            io.imsave(path, (synthetic_image(args.size, seed=i) * 255).astype(np.uint8), check_contrast=False)
+            items.append((path, name))
+
+        print(f"{args.images} images of {args.size}x{args.size}")
+        for workers in args.workers:
+            _, stats = segment_files(items, tmp, params, executor=get_executor(workers))
+            print(f"workers={workers:<3} {stats['images_per_sec']:>8.3f} images/s "
+                  f"{stats['megapixels_per_sec']:>8.3f} MP/s")
+
+        if args.tiled_size:
+            img = (synthetic_image(args.tiled_size) * 255).astype(np.uint8)
+            print(f"one {args.tiled_size}x{args.tiled_size} image, tiles of {args.tile_size}")
+            for workers in args.workers:
+                t0 = time.perf_counter()
+                segment_image(img, n_segments=args.n_segments, tile_size=args.tile_size,
+                              labels_path=os.path.join(tmp, "labels.npy"), executor=get_executor(workers))
+                stats = throughput(1, img.shape[0] * img.shape[1], time.perf_counter() - t0)
+                print(f"workers={workers:<3} {stats['megapixels_per_sec']:>8.3f} MP/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# bench/polygons.py
+# Usage example (from backend/):
+# python -m bench.polygons --size 2000 --segments 250 500 1000 2000
+
+import argparse
+import time
+import numpy as np
+import cv2
+from scipy import ndimage
+from skimage.segmentation import slic
+from helpers import segments_to_polygons
+
+
+def segments_to_polygons_per_label(segments):
+    """
+    Reference implementation: one full-frame mask + findContours per label.
+    Kept here only to measure against helpers.segments_to_polygons.
+    """
+    max_label = int(segments.max())
+    polygons = []
+    for label in range(1, max_label + 1):
+        mask = (segments == label).astype('uint8') * 255
+        if mask.sum() == 0:
+            continue
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            continue
+        contour = max(contours, key=lambda c: cv2.contourArea(c))
+        epsilon = 0.01 * cv2.arcLength(contour, True)
+        approx = cv2.approxPolyDP(contour, epsilon, True)
+        polygons.append({"id": int(label), "polygon": [[int(pt[0][0]), int(pt[0][1])] for pt in approx]})
+    return polygons, {"labels_found": max_label}
+
+
+def synthetic_image(size, seed=0):
+    rng = np.random.default_rng(seed)
+    img = rng.random((size, size, 3)).astype(np.float32)
+    return ndimage.gaussian_filter(img, sigma=(size / 100.0, size / 100.0, 0))
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - t0
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--size", type=int, default=2000)
+    p.add_argument("--segments", type=int, nargs="+", default=[250, 500, 1000, 2000])
+    p.add_argument("--compactness", type=float, default=10.0)
+    args = p.parse_args()
+
+    img = synthetic_image(args.size)
+    print(f"image {args.size}x{args.size}")
+    print(f"{'n_segments':>10} {'found':>6} {'per_label_s':>12} {'bbox_s':>8} {'speedup':>8} same")
+    for n in args.segments:
+        segments = slic(img, n_segments=n, compactness=args.compactness, start_label=1)
+        ref, t_ref = timed(segments_to_polygons_per_label, segments)
+        new, t_new = timed(segments_to_polygons, segments)
+        same = ref[0] == new[0]
+        print(f"{n:>10} {len(new[0]):>6} {t_ref:>12.3f} {t_new:>8.3f} {t_ref / t_new:>7.1f}x {same}")
+
+
+if __name__ == "__main__":
+    main()
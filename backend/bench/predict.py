@@ -0,0 +1,64 @@
+# bench/predict.py
+# Usage example (from backend/):
+# python -m bench.predict --rows 10000,100000
+
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from joblib import dump, load
+from sklearn.ensemble import RandomForestClassifier
+from helpers import FEATURE_NAMES
+from predict import Predictor
+
+
+def synthetic_features(n, seed=0):
+    # feature-matrix-like rows; the class depends on the colour columns
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, len(FEATURE_NAMES))).astype(np.float32)
+    y = (X[:, 3] > 0).astype(int) + (X[:, 4] > 0.5).astype(int)
+    return X, y
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--train_rows", type=int, default=20000)
+    p.add_argument("--trees", type=int, default=200, help="same as train.py")
+    p.add_argument("--rows", default="1000,10000,100000", help="superpixel counts to predict")
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args()
+
+    X, y = synthetic_features(args.train_rows)
+    clf = RandomForestClassifier(n_estimators=args.trees, n_jobs=-1, random_state=42).fit(X, y)
+    clf.class_names = ["good", "moderate", "bad"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "model_rf.joblib")
+        dump(clf, path)
+        print(f"model: {args.trees} trees, {os.path.getsize(path) / 1e6:.1f} MB")
+        for mmap_mode in (None, "r"):
+            t0 = time.perf_counter()
+            load(path, mmap_mode=mmap_mode)
+            print(f"load (mmap_mode={mmap_mode}): {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+        predictor = Predictor(path)
+        print(f"{'rows':>8} {'batch_ms':>9} {'ms_per_10k':>11} {'per_row_ms_per_10k':>19}")
+        for n in (int(r) for r in args.rows.split(",")):
+            Xq, _ = synthetic_features(n, seed=1)
+            best = None
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                predictor.predict_matrix(Xq)
+                elapsed = time.perf_counter() - t0
+                best = elapsed if best is None else min(best, elapsed)
+            # one predict_proba call per superpixel, extrapolated from 100 rows
+            t0 = time.perf_counter()
+            for row in Xq[:100]:
+                predictor.predict_matrix(row[None])
+            per_row = (time.perf_counter() - t0) / 100
+            print(f"{n:>8} {best * 1000:>9.1f} {best * 1000 * 10000 / n:>11.1f} {per_row * 1000 * 10000:>19.0f}")
+
+
+if __name__ == "__main__":
+    main()
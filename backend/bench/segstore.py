@@ -0,0 +1,69 @@
+# bench/segstore.py
+# Usage example (from backend/):
+# python -m bench.segstore --segments segments/
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from segstore import convert_legacy, load_store, legacy_json_path
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--segments", default="segments")
+    p.add_argument("--repeat", type=int, default=5)
+    args = p.parse_args()
+
+    ids = sorted(n[:-len("_segments.json")] for n in os.listdir(args.segments) if n.endswith("_segments.json"))
+    print(f"{'image_id':<12} {'polys':>6} {'json_kB':>8} {'store_kB':>9} "
+          f"{'json.load_ms':>12} {'open_ms':>8} {'to_dict_ms':>10}")
+    totals = [0, 0]
+    with tempfile.TemporaryDirectory() as tmp:
+        for image_id in ids:
+            src = legacy_json_path(args.segments, image_id)
+            with open(src) as fh:
+                n_polygons = len(json.load(fh)["polygons"])
+            with open(src) as fh, open(legacy_json_path(tmp, image_id), "w") as out:
+                out.write(fh.read())
+            convert_legacy(tmp, image_id)
+
+            json_size = os.path.getsize(src)
+            store_size = dir_size(os.path.join(tmp, image_id))
+            totals[0] += json_size
+            totals[1] += store_size
+
+            def json_load():
+                with open(src) as fh:
+                    json.load(fh)
+
+            def store_open():
+                store = load_store(tmp, image_id)
+                store.vertices, store.offsets, store.features
+
+            t_json = best_of(json_load, args.repeat)
+            t_open = best_of(store_open, args.repeat)
+            t_dict = best_of(lambda: load_store(tmp, image_id).to_dict(), args.repeat)
+            print(f"{image_id[:12]:<12} {n_polygons:>6} {json_size / 1024:>8.1f} {store_size / 1024:>9.1f} "
+                  f"{t_json * 1e3:>12.2f} {t_open * 1e3:>8.2f} {t_dict * 1e3:>10.2f}")
+    print(f"total: json {totals[0] / 1024:.1f} kB, store {totals[1] / 1024:.1f} kB "
+          f"({totals[1] / max(totals[0], 1):.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
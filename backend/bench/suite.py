@@ -0,0 +1,309 @@
+# bench/suite.py
+# Usage example (from backend/; 20k needs ~4 GB of scratch disk and a long while):
+# python -m bench.suite --sizes 1000 4000 20000 --segments 500 2000 --out bench_results.json
+# python -m bench.suite --sizes 1000 4000 --compare bench_results.json
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import tifffile
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARTS = ("helpers", "train", "endpoints")
+
+# synthetic fields: square parcels with one crop each, planted in rows
+PARCEL = 384
+TRACK = 4  # px of track between parcels
+TRACK_COLOR = (150, 145, 135)
+# healthy, stressed, bare soil, dry
+CROP_COLORS = np.array([[62, 122, 48], [120, 140, 60], [128, 96, 70], [176, 160, 96]], dtype=np.float32)
+# crop -> mask class for train.build_dataset (0 good, 1 moderate, 2 bad)
+CROP_CLASS = np.array([0, 1, 2, 1], dtype=np.uint8)
+TIFF_TILE = 512
+
+
+class FieldImage:
+    """
+    Deterministic field-like orthomosaic of any size, rendered block by
+    block: parcels with a crop color and row direction/spacing each, tracks
+    between them, slow in-field variation and pixel noise.
+    """
+
+    def __init__(self, height, width, seed=0):
+        rng = np.random.default_rng(seed)
+        ny, nx = -(-height // PARCEL), -(-width // PARCEL)
+        self.shape = (height, width, 3)
+        self.seed = seed
+        self.crop = rng.integers(0, len(CROP_COLORS), (ny, nx))
+        self.vertical = rng.random((ny, nx)) < 0.5
+        self.spacing = rng.uniform(8, 18, (ny, nx))
+        self.phase = rng.uniform(0, 2 * np.pi, 2)
+
+    def _grid(self, y0, y1, x0, x1):
+        yy = np.arange(y0, y1)[:, None]
+        xx = np.arange(x0, x1)[None, :]
+        return yy, xx, yy // PARCEL, xx // PARCEL
+
+    def block(self, y0, y1, x0, x1):
+        yy, xx, cy, cx = self._grid(y0, y1, x0, x1)
+        crop = self.crop[cy, cx]
+        along = np.where(self.vertical[cy, cx], xx, yy)
+        # stronger row contrast breaks SLIC up into stripe fragments
+        rows = 0.95 + 0.05 * np.sin(2 * np.pi * along / self.spacing[cy, cx])
+        wave = 1 + 0.08 * np.sin(yy / 97 + self.phase[0]) * np.cos(xx / 131 + self.phase[1])
+        img = CROP_COLORS[crop] * (rows * wave)[..., None]
+        img[(yy % PARCEL < TRACK) | (xx % PARCEL < TRACK)] = TRACK_COLOR
+        img += np.random.default_rng([self.seed, y0, x0]).normal(0, 3, img.shape)
+        return np.clip(img, 0, 255).astype(np.uint8)
+
+    def mask(self, y0, y1, x0, x1):
+        _, _, cy, cx = self._grid(y0, y1, x0, x1)
+        return CROP_CLASS[self.crop[cy, cx]]
+
+    def array(self):
+        """The whole image, rendered in strips to keep the float temporaries small."""
+        h, w = self.shape[:2]
+        out = np.empty(self.shape, dtype=np.uint8)
+        for y in range(0, h, TIFF_TILE):
+            out[y:y + TIFF_TILE] = self.block(y, min(h, y + TIFF_TILE), 0, w)
+        return out
+
+
+def write_tiff(field, path):
+    h, w = field.shape[:2]
+
+    def tiles():
+        for y in range(0, h, TIFF_TILE):
+            for x in range(0, w, TIFF_TILE):
+                tile = np.zeros((TIFF_TILE, TIFF_TILE, 3), dtype=np.uint8)
+                block = field.block(y, min(h, y + TIFF_TILE), x, min(w, x + TIFF_TILE))
+                tile[:block.shape[0], :block.shape[1]] = block
+                yield tile
+
+    tifffile.imwrite(path, tiles(), shape=field.shape, dtype=np.uint8, tile=(TIFF_TILE, TIFF_TILE),
+                     compression="zlib", photometric="rgb")
+
+
+# --- measured parts; each runs in a fresh child process (see run_child) ---
+
+def part_helpers(case, stages):
+    """slic / polygons / features through pipeline.segment_image, serially."""
+    from pipeline import segment_image
+    from raster import open_raster
+    img = open_raster(case["image"])
+    labels_path = os.path.join(case["workdir"], f"labels.{os.getpid()}.npy")
+    try:
+        segments, _, _, _, _ = segment_image(img, n_segments=case["n_segments"], compactness=10.0,
+                                             labels_path=labels_path, progress=stages)
+        stages.close()
+        return {"tiled": isinstance(segments, np.memmap), "found": int(np.max(segments))}
+    finally:
+        if os.path.exists(labels_path):
+            os.remove(labels_path)
+
+
+def part_train(case, stages):
+    """train.build_dataset on the image and its crop mask, no dataset cache."""
+    from PIL import Image
+    from train import build_dataset
+    h, w = case["size"], case["size"]
+    field = FieldImage(h, w, case["seed"])
+    root = os.path.join(case["workdir"], f"train_{os.getpid()}")
+    for sub, arr in (("images", field.array()), ("masks", field.mask(0, h, 0, w))):
+        os.makedirs(os.path.join(root, sub))
+        Image.fromarray(arr).save(os.path.join(root, sub, "field.png"))
+    with stages.stage("build_dataset"):
+        X, _ = build_dataset(os.path.join(root, "images"), os.path.join(root, "masks"),
+                             n_segments=case["n_segments"], n_classes=len(set(CROP_CLASS.tolist())),
+                             workers=1, cache_dir=None)
+    return {"rows": int(X.shape[0])}
+
+
+def part_endpoints(case, stages):
+    """Upload, segment, fetch and label through the Flask test client."""
+    import app
+    client = app.app.test_client()
+    extra = {}
+
+    def call(name, method, url, **kwargs):
+        with stages.stage(name):
+            res = getattr(client, method)(url, **kwargs)
+        if res.status_code >= 400:
+            raise RuntimeError(f"{method.upper()} {url}: {res.status_code} {res.get_data(as_text=True)[:200]}")
+        return res
+
+    size = os.path.getsize(case["image"])
+    with stages.stage("upload"):
+        start = client.post("/upload/chunked", json={"filename": "field.tif", "size": size}).json
+        url = f"/upload/chunked/{start['upload_id']}"
+        with open(case["image"], "rb") as fh:
+            offset = 0
+            while offset < size:
+                chunk = fh.read(start["chunk_size"])
+                uploaded = client.put(f"{url}?offset={offset}", data=chunk).json
+                offset += len(chunk)
+        # the last chunk queues the upload job (hash, raster, preview)
+        uploaded = client.get(uploaded["result_url"]).json
+    extra["upload_profile"] = uploaded["profile"]
+    image_id = uploaded["image_id"]
+
+    # JOB_WORKERS=0: the job runs inside the POST, so this is the whole pipeline
+    job = call("segment", "post", "/segment", json={"image_filename": uploaded["filename"],
+                                                    "n_segments": case["n_segments"]}).json
+    summary = client.get(f"{job['result_url']}?polygons=0&profile=1").json
+    extra["segment_profile"] = summary["profile"]
+    extra["found"] = summary["n_segments"]
+
+    body = call("segments", "get", f"/segments/{image_id}").get_data()
+    extra["segments_bytes"] = len(body)
+    call("segments_summary", "get", f"/segments/{image_id}?polygons=0")
+    call("viewport", "get", f"/segments/{image_id}/viewport?x0=0&y0=0&x1=1024&y1=1024")
+
+    n = min(case["label_requests"], summary["n_segments"])
+    times = []
+    with stages.stage("save_label"):
+        for sid in range(1, n + 1):
+            t0 = time.perf_counter()
+            client.post("/save_label", json={"image_id": image_id, "superpixel_id": sid, "label": "good"})
+            times.append(time.perf_counter() - t0)
+    extra["save_label"] = {"requests": n, "mean_ms": round(1000 * float(np.mean(times)), 3),
+                           "p95_ms": round(1000 * float(np.percentile(times, 95)), 3)}
+    batch = [{"superpixel_id": sid, "label": "bad"} for sid in range(1, summary["n_segments"] + 1)]
+    call("save_labels_all", "post", "/save_labels", json={"image_id": image_id, "labels": batch})
+    return extra
+
+
+def run_child(case):
+    from metrics import StageProfile
+    stages = StageProfile()
+    extra = globals()[f"part_{case['part']}"](case, stages)
+    print(json.dumps({"stages": stages.breakdown(), "extra": extra}))
+
+
+def child_env(workers):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([BACKEND] + [p for p in [env.get("PYTHONPATH")] if p])
+    env["JOB_WORKERS"] = "0"
+    env["SEGMENT_WORKERS"] = str(workers)
+    # keep online retraining out of the label timings
+    env["RETRAIN_MIN_LABELS"] = str(10 ** 9)
+    env["MODEL_PATH"] = env["ONLINE_MODEL_PATH"] = os.path.join("no", "model.joblib")
+    return env
+
+
+def run_case(case, workers):
+    # the app keeps its folders relative to the cwd: give every run its own
+    os.makedirs(case["workdir"])
+    try:
+        out = subprocess.run([sys.executable, "-m", "bench.suite", "--child", json.dumps(case)],
+                             cwd=case["workdir"], env=child_env(workers), capture_output=True, text=True)
+    finally:
+        shutil.rmtree(case["workdir"], ignore_errors=True)
+    if out.returncode != 0:
+        lines = out.stderr.strip().splitlines()
+        return {"error": lines[-1] if lines else f"exit {out.returncode}"}
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def run_meta(args):
+    import skimage
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "skimage": skimage.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "workers": args.workers,
+        "seed": args.seed,
+    }
+
+
+def compare(old_path, results):
+    with open(old_path) as fh:
+        old = {(r["size"], r["n_segments"], r["part"], r["name"]): r for r in json.load(fh)["results"]}
+    print(f"\ncompared with {old_path}")
+    print(f"{'size':>6} {'n_seg':>6} {'part':<10} {'name':<18} {'old_s':>9} {'new_s':>9} {'ratio':>7} "
+          f"{'old_MB':>8} {'new_MB':>8}")
+    for r in results:
+        o = old.get((r["size"], r["n_segments"], r["part"], r["name"]))
+        if o is None or "seconds" not in o or "seconds" not in r:
+            continue
+        ratio = r["seconds"] / o["seconds"] if o["seconds"] else float("nan")
+        print(f"{r['size']:>6} {r['n_segments']:>6} {r['part']:<10} {r['name']:<18} {o['seconds']:>9.3f} "
+              f"{r['seconds']:>9.3f} {ratio:>7.2f} {o['peak_rss_mb']:>8.0f} {r['peak_rss_mb']:>8.0f}")
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--sizes", type=int, nargs="+", default=[1000, 2000, 4000], help="image side in px")
+    p.add_argument("--segments", type=int, nargs="+", default=[500, 2000])
+    p.add_argument("--parts", nargs="+", choices=PARTS, default=list(PARTS))
+    p.add_argument("--workers", type=int, default=1, help="SEGMENT_WORKERS for the runs")
+    p.add_argument("--train-max-size", type=int, default=4000,
+                   help="train.py decodes whole images; larger sizes skip the train part")
+    p.add_argument("--label-requests", type=int, default=100, help="single /save_label calls per case")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--out", default="bench_results.json")
+    p.add_argument("--compare", help="earlier --out file to compare against")
+    p.add_argument("--child", help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    if args.child:
+        run_child(json.loads(args.child))
+        return
+
+    doc = {"meta": run_meta(args), "results": []}
+    print(f"{'size':>6} {'n_seg':>6} {'part':<10} {'name':<18} {'seconds':>9} {'peak_MB':>8}")
+    with tempfile.TemporaryDirectory(dir=".") as workdir:
+        workdir = os.path.abspath(workdir)
+        for size in args.sizes:
+            path = os.path.join(workdir, f"field_{size}.tif")
+            t0 = time.perf_counter()
+            write_tiff(FieldImage(size, size, args.seed), path)
+            print(f"{size:>6} {'':>6} {'generate':<10} {'':<18} {time.perf_counter() - t0:>9.3f}")
+            for n_segments in args.segments:
+                for part in args.parts:
+                    record = {"size": size, "n_segments": n_segments, "part": part}
+                    if part == "train" and size > args.train_max_size:
+                        doc["results"].append(dict(record, name="skipped", reason="over --train-max-size"))
+                        continue
+                    case = dict(record, image=path, workdir=os.path.join(workdir, f"run_{size}_{n_segments}_{part}"),
+                                seed=args.seed, label_requests=args.label_requests)
+                    out = run_case(case, args.workers)
+                    if "error" in out:
+                        print(f"{size:>6} {n_segments:>6} {part:<10} failed: {out['error']}")
+                        doc["results"].append(dict(record, name="failed", error=out["error"]))
+                        continue
+                    for stage in out["stages"]:
+                        doc["results"].append(dict(record, **stage))
+                        print(f"{size:>6} {n_segments:>6} {part:<10} {stage['name']:<18} "
+                              f"{stage['seconds']:>9.3f} {stage['peak_rss_mb']:>8.0f}")
+                    doc["results"].append(dict(record, name="details", **out["extra"]))
+            # the image and its raster are not needed for the next size
+            for name in os.listdir(workdir):
+                if name.startswith(f"field_{size}."):
+                    os.remove(os.path.join(workdir, name))
+
+    with open(args.out, "w") as fh:
+        json.dump(doc, fh, indent=2)
+    print(f"wrote {args.out}")
+    if args.compare:
+        compare(args.compare, doc["results"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# bench/tiling.py
+# Usage example (from backend/):
+# python -m bench.tiling --size 2000 --segments 2000 --tiles 512:64 1024:0
+#
+# Stitched (tiling.tiled_superpixels) against untiled SLIC on a synthetic
+# field (bench.suite): time, superpixel count, smallest area, labels under
+# 5% of the mean area and labels split into several regions. Exits non-zero
+# when a tiled map has split labels, gaps in its numbering, or a smallest
+# superpixel far below the untiled one.
+
+import argparse
+import time
+import numpy as np
+from skimage.measure import label as connected_components
+from helpers import compute_superpixels
+from tiling import tiled_superpixels
+from bench.suite import FieldImage
+
+# a tiled map's smallest superpixel must be at least this share of the untiled one's
+MIN_AREA_RATIO = 0.8
+
+
+def label_stats(segments):
+    areas = np.bincount(segments.ravel())[1:]
+    comps = connected_components(segments, background=0, connectivity=1)
+    pieces = np.unique(np.stack([segments.ravel(), comps.ravel()]), axis=1)
+    split = int((np.bincount(pieces[0])[1:] > 1).sum())
+    return {"labels": len(areas), "consecutive": bool((areas > 0).all()), "min_area": int(areas.min()),
+            "under_5pct": int((areas < 0.05 * areas.mean()).sum()), "split": split}
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--size", type=int, default=2000)
+    p.add_argument("--segments", type=int, default=2000)
+    p.add_argument("--tiles", nargs="+", default=["512:64", "1024:0"], help="tile_size:overlap")
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args()
+
+    img = FieldImage(args.size, args.size, seed=args.seed).array()
+    print(f"{'tiling':<10} {'s':>6} {'labels':>7} {'min_area':>9} {'<5%':>5} {'split':>6}")
+
+    def run(name, fn):
+        t0 = time.perf_counter()
+        stats = label_stats(fn())
+        print(f"{name:<10} {time.perf_counter() - t0:>6.2f} {stats['labels']:>7} {stats['min_area']:>9} "
+              f"{stats['under_5pct']:>5} {stats['split']:>6}")
+        return stats
+
+    untiled = run("untiled", lambda: compute_superpixels(img, n_segments=args.segments))
+    failures = []
+    for spec in args.tiles:
+        tile_size, overlap = (int(v) for v in spec.split(":"))
+        stats = run(spec, lambda: tiled_superpixels(img, n_segments=args.segments, tile_size=tile_size,
+                                                    overlap=overlap))
+        if stats["split"] or not stats["consecutive"]:
+            failures.append(f"{spec}: {stats['split']} split labels, consecutive={stats['consecutive']}")
+        if stats["min_area"] < MIN_AREA_RATIO * untiled["min_area"]:
+            failures.append(f"{spec}: smallest superpixel {stats['min_area']} px, untiled {untiled['min_area']} px")
+    for text in failures:
+        print("FAIL", text)
+    if failures:
+        raise SystemExit(f"{len(failures)} check(s) failed")
+
+
+if __name__ == "__main__":
+    main()
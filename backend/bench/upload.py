@@ -0,0 +1,116 @@
+# bench/upload.py
+# Usage example (from backend/; ~1 GB RGB TIFF, needs ~4 GB of scratch disk):
+# python -m bench.upload --megapixels 334
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import tifffile
+from bench.polygons import synthetic_image
+from tiling import TILE_SIZE, TILE_OVERLAP, tile_grid
+from helpers import FEATURE_STRIP_ROWS
+
+TIFF_TILE = 512
+
+
+def write_tiff(path, side):
+    # tiled, deflate-compressed like typical orthomosaic exports
+    base = (synthetic_image(TIFF_TILE * 4, seed=7) * 255).astype(np.uint8)
+
+    def tiles():
+        for ty in range(-(-side // TIFF_TILE)):
+            for tx in range(-(-side // TIFF_TILE)):
+                y, x = (ty % 4) * TIFF_TILE, (tx % 4) * TIFF_TILE
+                yield base[y:y + TIFF_TILE, x:x + TIFF_TILE]
+
+    tifffile.imwrite(path, tiles(), shape=(side, side, 3), dtype=np.uint8, tile=(TIFF_TILE, TIFF_TILE),
+                     compression="zlib", photometric="rgb")
+
+
+def legacy_upload(path):
+    # old /upload: PIL decodes the TIFF and re-encodes it as a PNG
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = None
+    Image.open(path).save(path + ".png")
+
+
+def legacy_decode(path):
+    # old /segment: skimage decodes the PNG (which, as in production, fails
+    # past PIL's decompression-bomb limit unless that is lifted)
+    from PIL import Image
+    from skimage import io
+    Image.MAX_IMAGE_PIXELS = None
+    io.imread(path + ".png")
+
+
+def raster_upload(path):
+    from raster import build_raster, open_raster, write_preview
+    build_raster(path)
+    write_preview(open_raster(path), path + ".preview.png")
+
+
+def raster_read(path):
+    # what tiled segmentation reads: overlapping tiles, then feature strips
+    from raster import open_raster
+    r = open_raster(path)
+    h, w = r.shape[:2]
+    for y0, y1, _, _ in tile_grid(h, TILE_SIZE, TILE_OVERLAP):
+        for x0, x1, _, _ in tile_grid(w, TILE_SIZE, TILE_OVERLAP):
+            np.asarray(r[y0:y1, x0:x1]).sum()
+    for y0 in range(0, h, FEATURE_STRIP_ROWS):
+        np.asarray(r[y0:y0 + FEATURE_STRIP_ROWS]).sum()
+
+
+STAGES = {
+    "legacy_upload": legacy_upload,
+    "legacy_decode": legacy_decode,
+    "raster_upload": raster_upload,
+    "raster_read": raster_read,
+}
+
+
+def run_stage(stage, path):
+    out = subprocess.run([sys.executable, "-m", "bench.upload", "--child", stage, path],
+                         capture_output=True, text=True)
+    if out.returncode != 0:
+        return None, out.stderr.strip().splitlines()[-1]
+    seconds, rss_kb = out.stdout.split()
+    return float(seconds), int(rss_kb)
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--megapixels", type=float, default=334, help="334 MP RGB is ~1 GB of pixels")
+    p.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    if args.child:
+        stage, path = args.child
+        t0 = time.perf_counter()
+        STAGES[stage](path)
+        # ru_maxrss is in KB on Linux
+        print(time.perf_counter() - t0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+        return
+
+    side = int((args.megapixels * 1e6) ** 0.5)
+    with tempfile.TemporaryDirectory(dir=".") as tmp:
+        path = os.path.join(tmp, "mosaic.tif")
+        write_tiff(path, side)
+        print(f"{side}x{side} RGB TIFF: {side * side * 3 / 1e9:.2f} GB of pixels, "
+              f"{os.path.getsize(path) / 1e6:.0f} MB on disk")
+        print(f"{'stage':<15} {'seconds':>8} {'peak_rss_MB':>12}")
+        for stage in STAGES:
+            seconds, rss_kb = run_stage(stage, path)
+            if seconds is None:
+                print(f"{stage:<15} failed: {rss_kb}")
+                continue
+            print(f"{stage:<15} {seconds:>8.1f} {rss_kb / 1024:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# bench/wire.py
+# Usage example (from backend/):
+# python -m bench.wire --segments segments/
+#
+# Bytes on the wire and decode time of a full segments document: the JSON
+# of /segments/<image_id> against ?format=binary, each raw and gzipped.
+# Decode is json.loads against wire.decode_geometry (to numpy arrays).
+
+import argparse
+import gzip
+import json
+import os
+import tempfile
+import numpy as np
+from segstore import convert_legacy, load_store, legacy_json_path
+from wire import COMPRESS_LEVEL, decode_geometry, encode_geometry
+from bench.segstore import best_of
+
+
+def documents(store):
+    doc = store.to_dict()
+    text = json.dumps(doc).encode()
+    ids = np.asarray(store.ids)
+    X = store.features
+    header = {k: doc[k] for k in ("image_id", "image_filename", "image_shape", "n_segments", "meta")}
+    packed = encode_geometry(ids, store.offsets, store.vertices, header,
+                             None if X is None else X[ids.astype(np.int64) - 1], store.info.get("feature_names"))
+    return text, packed
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--segments", default="segments")
+    p.add_argument("--repeat", type=int, default=5)
+    args = p.parse_args()
+
+    ids = sorted(n[:-len("_segments.json")] for n in os.listdir(args.segments) if n.endswith("_segments.json"))
+    print(f"{'image_id':<12} {'polys':>6} {'json_kB':>8} {'json.gz':>8} {'bin_kB':>7} {'bin.gz':>7} "
+          f"{'loads_ms':>9} {'decode_ms':>9} {'gzip_json_ms':>12} {'gzip_bin_ms':>11}")
+    totals = np.zeros(4)
+    with tempfile.TemporaryDirectory() as tmp:
+        for image_id in ids:
+            with open(legacy_json_path(args.segments, image_id)) as fh, \
+                    open(legacy_json_path(tmp, image_id), "w") as out:
+                out.write(fh.read())
+            convert_legacy(tmp, image_id)
+            store = load_store(tmp, image_id)
+            text, packed = documents(store)
+            sizes = [len(text), len(gzip.compress(text, COMPRESS_LEVEL)),
+                     len(packed), len(gzip.compress(packed, COMPRESS_LEVEL))]
+            totals += sizes
+
+            t_loads = best_of(lambda: json.loads(text), args.repeat)
+            t_decode = best_of(lambda: decode_geometry(packed), args.repeat)
+            t_gz_json = best_of(lambda: gzip.compress(text, COMPRESS_LEVEL), args.repeat)
+            t_gz_bin = best_of(lambda: gzip.compress(packed, COMPRESS_LEVEL), args.repeat)
+            print(f"{image_id[:12]:<12} {store.n_segments:>6} "
+                  + " ".join(f"{s / 1024:>{w}.1f}" for s, w in zip(sizes, (8, 8, 7, 7)))
+                  + f" {t_loads * 1e3:>9.2f} {t_decode * 1e3:>9.2f} {t_gz_json * 1e3:>12.2f} {t_gz_bin * 1e3:>11.2f}")
+    print(f"total: json {totals[0] / 1024:.1f} kB ({totals[1] / 1024:.1f} gzipped), "
+          f"binary {totals[2] / 1024:.1f} kB ({totals[3] / 1024:.1f} gzipped, "
+          f"{totals[3] / max(totals[1], 1):.2f}x of gzipped json)")
+
+
+if __name__ == "__main__":
+    main()
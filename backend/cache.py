@@ -0,0 +1,150 @@
+# backend/cache.py
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from segstore import link_store
+
+CACHE_FOLDER = "cache"
+# on-disk budget for cached segment stores
+CACHE_DISK_BYTES = int(os.environ.get("CACHE_DISK_BYTES", 2 * 1024 ** 3))
+# in-memory budget for rendered JSON responses
+CACHE_MEMORY_BYTES = int(os.environ.get("CACHE_MEMORY_BYTES", 256 * 1024 ** 2))
+
+HASH_CHUNK = 1024 * 1024
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def image_hash(image_path):
+    """
+    Content hash of an upload, from its .sha256 sidecar (written at upload
+    time) or computed from the raw bytes. The image is never decoded.
+    """
+    sidecar = image_path + ".sha256"
+    if os.path.exists(sidecar):
+        with open(sidecar) as fh:
+            return fh.read().strip()
+    digest = file_sha256(image_path)
+    # the upload job and a segment job may hash the same file at once
+    tmp = f"{sidecar}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as fh:
+        fh.write(digest)
+    os.replace(tmp, sidecar)
+    return digest
+
+
+def segment_key(content_hash, params):
+    """Cache key for one image content + segmentation parameters."""
+    blob = content_hash + json.dumps(params, sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+class SegmentCache:
+    """
+    Segment results keyed by segment_key(), LRU-evicted on both tiers:
+    - disk: segstore directories under folder/<key>/, hard-linked into
+      segments/<image_id>/ on a hit (mtime of meta.json is the LRU clock)
+    - memory: rendered JSON documents without the per-upload ids, so
+      repeated /segments requests skip building JSON from the store
+    """
+
+    def __init__(self, folder=CACHE_FOLDER, disk_bytes=CACHE_DISK_BYTES, memory_bytes=CACHE_MEMORY_BYTES):
+        self.folder = folder
+        self.disk_bytes = disk_bytes
+        self.memory_bytes = memory_bytes
+        os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> rendered JSON body
+        self._memory_used = 0
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key):
+        return os.path.join(self.folder, key)
+
+    def materialize(self, key, dest, image_id, image_filename):
+        """
+        On a disk hit, link the cached store to dest under the caller's ids
+        and return True; False on a miss.
+        """
+        src = self._path(key)
+        try:
+            os.utime(os.path.join(src, "meta.json"))
+            link_store(src, dest, image_id=image_id, image_filename=image_filename, cache_key=key)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def put(self, key, store_dir):
+        """Keep a freshly written store under key."""
+        link_store(store_dir, self._path(key), cache_key=key)
+        self._evict_disk()
+
+    def get_body(self, key):
+        """Rendered JSON (without image_id/image_filename) or None."""
+        with self._lock:
+            body = self._memory.get(key)
+            if body is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            return body
+
+    def put_body(self, key, body):
+        with self._lock:
+            if key in self._memory:
+                self._memory_used -= len(self._memory.pop(key))
+            if len(body) > self.memory_bytes:
+                return
+            self._memory[key] = body
+            self._memory_used += len(body)
+            while self._memory_used > self.memory_bytes:
+                _, old = self._memory.popitem(last=False)
+                self._memory_used -= len(old)
+
+    def _evict_disk(self):
+        entries = []
+        total = 0
+        for key in os.listdir(self.folder):
+            path = self._path(key)
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(os.path.join(path, "meta.json")), key, size))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            total += size
+        entries.sort()
+        for _, key, size in entries:
+            if total <= self.disk_bytes:
+                break
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            with self._lock:
+                if key in self._memory:
+                    self._memory_used -= len(self._memory.pop(key))
+                self.evictions += 1
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_used,
+            }
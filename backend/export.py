@@ -0,0 +1,226 @@
+# backend/export.py
+# Usage example (bundle every labeled image, from backend/):
+# python export.py --out exports/dataset.zip --format png
+import os
+import io
+import json
+import zlib
+import struct
+import zipfile
+import argparse
+import numpy as np
+import tifffile
+from helpers import FEATURE_STRIP_ROWS
+from segstore import load_store
+
+EXPORT_FOLDER = "exports"
+# class index order of exported masks; other label names follow, sorted
+DEFAULT_CLASSES = ["good", "moderate", "bad"]
+# mask value of superpixels without a label
+MASK_NODATA = 255
+# mask colors (palette), as the annotator draws them
+CLASS_COLORS = {"good": (120, 255, 154), "moderate": (255, 179, 71), "bad": (255, 99, 99)}
+MASK_TILE = 256
+MASK_FORMATS = ("png", "tif")
+# GeoTIFF georeferencing tags copied from the upload into the mask
+GEO_TAGS = (33550, 33922, 34264, 34735, 34736, 34737, 42112, 42113)
+
+
+class ExportError(Exception):
+    pass
+
+
+def class_names(label_sets):
+    """DEFAULT_CLASSES, then any other label names in label_sets, sorted."""
+    seen = {entry["label"] for labels in label_sets for entry in labels.values()}
+    return DEFAULT_CLASSES + sorted(seen - set(DEFAULT_CLASSES))
+
+
+def class_lut(store, labels, classes):
+    """
+    uint8 lookup table superpixel id -> class index (MASK_NODATA where
+    unlabeled), so a whole label raster strip becomes a mask with lut[strip].
+    """
+    ids = np.asarray(store.ids)
+    size = max(int(ids.max()) if len(ids) else 0, store.info["n_segments"]) + 1
+    lut = np.full(size, MASK_NODATA, dtype=np.uint8)
+    index = {name: i for i, name in enumerate(classes)}
+    sids = []
+    cls = []
+    for sid, entry in labels.items():
+        try:
+            sid = int(sid)
+        except ValueError:
+            continue
+        if 0 <= sid < size and entry["label"] in index:
+            sids.append(sid)
+            cls.append(index[entry["label"]])
+    lut[np.asarray(sids, dtype=np.int64)] = np.asarray(cls, dtype=np.uint8)
+    return lut
+
+
+def mask_strips(store, lut, rows=FEATURE_STRIP_ROWS):
+    """The class mask, rasterized strip by strip from the memmapped label raster."""
+    raster = store.labels
+    if raster is None:
+        raise ExportError("segments have no label raster (converted from JSON); re-segment the image")
+    for y0 in range(0, raster.shape[0], rows):
+        yield lut[raster[y0:y0 + rows]]
+
+
+def palette(classes):
+    colors = np.zeros((256, 3), dtype=np.uint8)
+    for i, name in enumerate(classes[:MASK_NODATA]):
+        colors[i] = CLASS_COLORS.get(name, (160, 160, 160))
+    return colors
+
+
+def _png_chunk(kind, data):
+    body = kind + data
+    return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+
+def png_stream(strips, width, height, classes):
+    """
+    Palette PNG of a class mask, yielded as bytes while the strips are
+    compressed, so the mask is never held whole. Pixel values are class
+    indices (as train.py expects); MASK_NODATA is transparent.
+    """
+    yield b"\x89PNG\r\n\x1a\n"
+    yield _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0))
+    yield _png_chunk(b"PLTE", palette(classes).tobytes())
+    yield _png_chunk(b"tRNS", b"\xff" * MASK_NODATA + b"\x00")
+    z = zlib.compressobj(6)
+    for strip in strips:
+        # filter byte 0 (none) in front of every row
+        rows = np.zeros((strip.shape[0], width + 1), dtype=np.uint8)
+        rows[:, 1:] = strip
+        data = z.compress(rows.tobytes())
+        if data:
+            yield _png_chunk(b"IDAT", data)
+    yield _png_chunk(b"IDAT", z.flush())
+    yield _png_chunk(b"IEND", b"")
+
+
+def geo_tags(image_path):
+    """Georeferencing tags of a TIFF upload as tifffile extratags ([] otherwise)."""
+    if not image_path or not image_path.lower().endswith((".tif", ".tiff")):
+        return []
+    with tifffile.TiffFile(image_path) as tif:
+        tags = tif.pages[0].tags
+        return [(t.code, t.dtype, t.count, t.value, True) for t in tags.values() if t.code in GEO_TAGS]
+
+
+def write_geotiff(strips, width, height, classes, dest, image_path=None):
+    """
+    Tiled, deflate-compressed palette TIFF of a class mask, with the
+    upload's georeferencing when it had any. strips must be MASK_TILE rows
+    high (mask_strips(..., rows=MASK_TILE)), so one row of tiles is in
+    memory at a time.
+    """
+    def tiles():
+        for strip in strips:
+            for x in range(0, width, MASK_TILE):
+                tile = np.full((MASK_TILE, MASK_TILE), MASK_NODATA, dtype=np.uint8)
+                part = strip[:, x:x + MASK_TILE]
+                tile[:part.shape[0], :part.shape[1]] = part
+                yield tile
+
+    colormap = palette(classes).T.astype(np.uint16) * 257
+    tifffile.imwrite(dest, tiles(), shape=(height, width), dtype=np.uint8, tile=(MASK_TILE, MASK_TILE),
+                     compression="zlib", photometric="palette", colormap=colormap,
+                     extratags=geo_tags(image_path))
+
+
+def labeled_features(store, lut):
+    """(superpixel ids, float32 features, class index or -1) of every superpixel."""
+    X = np.asarray(store.features, dtype=np.float32)
+    # feature row i is superpixel i + 1
+    ids = np.arange(1, X.shape[0] + 1, dtype=np.int32)
+    y = np.full(len(ids), -1, dtype=np.int16)
+    known = ids < len(lut)
+    y[known] = lut[ids[known]]
+    y[y == MASK_NODATA] = -1
+    return ids, X, y
+
+
+def build_bundle(seg_folder, upload_folder, label_store, image_ids, dest, fmt="png", progress=None):
+    """
+    One zip for a set of images:
+      masks/<image_id>.png|tif       class masks at full resolution
+      features/<image_id>.npz        ids, X (features), y (class index, -1 unlabeled)
+      metadata.json                  classes, feature names, per-image info
+    Written to a temporary name and moved into place when complete.
+    """
+    stores = {}
+    for image_id in image_ids:
+        store = load_store(seg_folder, image_id)
+        if store is None:
+            raise ExportError(f"segments not found: {image_id}")
+        stores[image_id] = store
+    labels = {image_id: label_store.get_labels(image_id) for image_id in image_ids}
+    classes = class_names(labels.values())
+
+    meta = {"classes": classes, "nodata": MASK_NODATA, "format": fmt, "images": []}
+    tmp = dest + ".tmp"
+    with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        for image_id, store in stores.items():
+            if progress is not None:
+                progress(f"image {len(meta['images']) + 1}/{len(stores)}")
+            lut = class_lut(store, labels[image_id], classes)
+            height, width = store.info["image_shape"][:2]
+            name = f"masks/{image_id}.{fmt}"
+            # masks are compressed already
+            if fmt == "png":
+                with zf.open(zipfile.ZipInfo(name), "w", force_zip64=True) as fh:
+                    for chunk in png_stream(mask_strips(store, lut), width, height, classes):
+                        fh.write(chunk)
+            else:
+                image_path = os.path.join(upload_folder, store.info["image_filename"])
+                part = f"{tmp}.{image_id}.tif"
+                write_geotiff(mask_strips(store, lut, rows=MASK_TILE), width, height, classes, part,
+                              image_path if os.path.exists(image_path) else None)
+                zf.write(part, name, compress_type=zipfile.ZIP_STORED)
+                os.remove(part)
+
+            ids, X, y = labeled_features(store, lut)
+            buf = io.BytesIO()
+            np.savez(buf, ids=ids, X=X, y=y)
+            zf.writestr(f"features/{image_id}.npz", buf.getvalue())
+            meta["images"].append({
+                "image_id": image_id,
+                "image_filename": store.info["image_filename"],
+                "image_shape": store.info["image_shape"],
+                "n_segments": store.info["n_segments"],
+                "n_labeled": int((y >= 0).sum()),
+                "mask": name,
+                "features": f"features/{image_id}.npz",
+            })
+        meta["feature_names"] = next((s.info.get("feature_names") for s in stores.values()), None)
+        zf.writestr("metadata.json", json.dumps(meta, indent=2))
+    os.replace(tmp, dest)
+    return meta
+
+
+def main():
+    from labelstore import LabelStore
+    p = argparse.ArgumentParser()
+    p.add_argument("--out", required=True)
+    p.add_argument("--format", choices=MASK_FORMATS, default="png")
+    p.add_argument("--segments", default="segments")
+    p.add_argument("--uploads", default="uploads")
+    p.add_argument("--labels", default="labels")
+    p.add_argument("image_ids", nargs="*", help="default: every segmented image with labels")
+    args = p.parse_args()
+
+    label_store = LabelStore(args.labels)
+    image_ids = args.image_ids or sorted(
+        image_id for image_id in {row[0] for row in label_store.labels_since(0)}
+        if load_store(args.segments, image_id) is not None)
+    meta = build_bundle(args.segments, args.uploads, label_store, image_ids, args.out, args.format,
+                        progress=print)
+    print(f"wrote {args.out}: {len(meta['images'])} images, classes {meta['classes']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# backend/graph.py
+import numpy as np
+from scipy import sparse
+from helpers import FEATURE_NAMES
+
+# flood fill crosses an edge when the mean colors differ by at most this (Lab)
+FLOOD_MAX_DISTANCE = 8.0
+# label spreading: share of each update that comes from the neighbours
+SPREAD_ALPHA = 0.9
+SPREAD_ITERATIONS = 50
+# spread labels whose share of a superpixel's label mass is lower are dropped
+SPREAD_MIN_CONFIDENCE = 0.6
+LAB_COLUMNS = [FEATURE_NAMES.index(name) for name in ("L_mean", "a_mean", "b_mean")]
+
+
+class RegionGraph:
+    """
+    Superpixel adjacency graph, stored CSR-style by superpixel id: the
+    neighbours of superpixel s are neighbors[offsets[s]:offsets[s + 1]]
+    and distances[...] the Lab distances between their mean colors.
+    Every edge is stored in both directions.
+    """
+
+    def __init__(self, offsets, neighbors, distances):
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.distances = distances
+
+    @classmethod
+    def build(cls, edges, feature_matrix):
+        """From helpers.region_adjacency edges and the feature matrix (row i = superpixel i + 1)."""
+        X = np.asarray(feature_matrix)
+        size = X.shape[0] + 1
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        edges = edges[edges[:, 1] < size]
+        lab = X[:, LAB_COLUMNS].astype(np.float64)
+        dist = np.linalg.norm(lab[edges[:, 0] - 1] - lab[edges[:, 1] - 1], axis=1)
+        src = np.concatenate([edges[:, 0], edges[:, 1]])
+        dst = np.concatenate([edges[:, 1], edges[:, 0]])
+        order = np.argsort(src, kind="stable")
+        offsets = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=size), out=offsets[1:])
+        return cls(offsets, dst[order].astype(np.int32), np.concatenate([dist, dist])[order].astype(np.float32))
+
+    @property
+    def size(self):
+        """Superpixel ids are < size."""
+        return len(self.offsets) - 1
+
+    def edges_of(self, nodes):
+        """(source, neighbour, distance) arrays of every edge leaving nodes."""
+        nodes = np.asarray(nodes, dtype=np.int64)
+        offsets = np.asarray(self.offsets)
+        starts = offsets[nodes]
+        counts = offsets[nodes + 1] - starts
+        idx = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+        return np.repeat(nodes, counts), np.asarray(self.neighbors)[idx], np.asarray(self.distances)[idx]
+
+    def affinity(self, sigma=None):
+        """Sparse symmetric weights exp(-d^2 / 2 sigma^2); sigma defaults to the median edge distance."""
+        dist = np.asarray(self.distances, dtype=np.float64)
+        if sigma is None:
+            sigma = float(np.median(dist)) if len(dist) else 1.0
+        weights = np.exp(-dist ** 2 / (2 * max(sigma, 1e-6) ** 2))
+        return sparse.csr_matrix((weights, np.asarray(self.neighbors), np.asarray(self.offsets)),
+                                 shape=(self.size, self.size))
+
+
+def flood_fill(graph, seed_ids, seed_classes, max_distance=FLOOD_MAX_DISTANCE, max_steps=None):
+    """
+    Grow every seed's class over edges no longer than max_distance, one
+    ring of neighbours per step for the whole frontier at once; a
+    superpixel reached from several sides takes the class over its
+    shortest edge. max_steps bounds the hops from a seed.
+    Returns a class per superpixel id (-1 where none reached).
+    """
+    classes = np.full(graph.size, -1, dtype=np.int32)
+    classes[seed_ids] = seed_classes
+    frontier = np.unique(np.asarray(seed_ids, dtype=np.int64))
+    step = 0
+    while len(frontier) and (max_steps is None or step < max_steps):
+        src, dst, dist = graph.edges_of(frontier)
+        ok = (dist <= max_distance) & (classes[dst] < 0)
+        src, dst, dist = src[ok], dst[ok], dist[ok]
+        order = np.argsort(dist, kind="stable")
+        frontier, first = np.unique(dst[order], return_index=True)
+        classes[frontier] = classes[src[order][first]]
+        step += 1
+    return classes
+
+
+def spread_labels(graph, seed_ids, seed_classes, n_classes, alpha=SPREAD_ALPHA,
+                  iterations=SPREAD_ITERATIONS, sigma=None):
+    """
+    Label spreading (Zhou et al., 2004) over the affinity graph:
+    F <- alpha * S F + (1 - alpha) Y with S the symmetrically normalized
+    affinity and Y the one-hot seeds. Returns (class per superpixel id,
+    confidence = the class's share of the label mass); -1 / 0 where no
+    label mass arrived. Seeds keep their class.
+    """
+    W = graph.affinity(sigma)
+    degree = np.asarray(W.sum(axis=1)).ravel()
+    scale = np.divide(1.0, np.sqrt(degree), out=np.zeros_like(degree), where=degree > 0)
+    S = sparse.diags(scale) @ W @ sparse.diags(scale)
+    Y = np.zeros((graph.size, n_classes))
+    Y[seed_ids, seed_classes] = 1.0
+    F = Y.copy()
+    for _ in range(iterations):
+        F = alpha * (S @ F) + (1 - alpha) * Y
+    mass = F.sum(axis=1)
+    reached = mass > 0
+    classes = np.where(reached, F.argmax(axis=1), -1).astype(np.int32)
+    confidence = np.divide(F.max(axis=1), mass, out=np.zeros_like(mass), where=reached)
+    classes[seed_ids] = seed_classes
+    confidence[seed_ids] = 1.0
+    return classes, confidence
@@ -1,25 +1,38 @@
 # backend/helpers.py
 import numpy as np
 import cv2
-from skimage.measure import regionprops
+from scipy import ndimage
 from skimage.color import rgb2lab
+from skimage.segmentation import slic
 
-def segments_to_polygons(segments):
+def segment_slices(segments):
     """
-    Convert integer segment map -> list of polygons per segment id.
-    Returns polygons: [{id: int, polygon: [[x,y],[x,y],...]], ...]
-    meta contains bounding box sizes.
+    Bounding box of every label in one pass (ndimage.find_objects).
+    Returns [(label, (row_slice, col_slice)), ...] for labels present.
     """
     max_label = int(segments.max())
+    if max_label < 1:
+        return []
+    slices = ndimage.find_objects(segments.astype(np.int32, copy=False), max_label=max_label)
+    return [(idx + 1, sl) for idx, sl in enumerate(slices) if sl is not None]
+
+
+def trace_polygons(segments, items):
+    """
+    Trace the outline of each (label, bbox) in items, inside its bbox only.
+    Returns [{id: int, polygon: [[x,y],...]}, ...] in the order of items.
+    """
     polygons = []
-    meta = {"labels_found": max_label}
-    h, w = segments.shape
-    for label in range(1, max_label + 1):
-        mask = (segments == label).astype('uint8') * 255
-        if mask.sum() == 0:
-            continue
+    for label, sl in items:
+        # pad by one pixel so contours touching the crop edge stay closed
+        crop = segments[sl] == label
+        mask = np.zeros((crop.shape[0] + 2, crop.shape[1] + 2), dtype=np.uint8)
+        mask[1:-1, 1:-1] = crop
+        mask *= 255
         # find contours using OpenCV: need single-channel uint8
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # offset shifts crop coordinates back into image coordinates
+        offset = (sl[1].start - 1, sl[0].start - 1)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
         if not contours:
             continue
         # choose the largest contour
@@ -28,35 +41,168 @@ def segments_to_polygons(segments):
         epsilon = 0.01 * cv2.arcLength(contour, True)
         approx = cv2.approxPolyDP(contour, epsilon, True)
         # convert to list of [x,y]
-        poly = [[int(pt[0][0]), int(pt[0][1])] for pt in approx]
+        poly = approx.reshape(-1, 2).tolist()
         polygons.append({"id": int(label), "polygon": poly})
+    return polygons
+
+
+def segments_to_polygons(segments):
+    """
+    Convert integer segment map -> list of polygons per segment id.
+    Returns polygons: [{id: int, polygon: [[x,y],[x,y],...]], ...]
+    meta contains bounding box sizes.
 
+    Bounding boxes for every label come from a single pass over the map
+    (ndimage.find_objects), and contours are traced only inside each
+    label's cropped box, so the cost scales with the image size rather
+    than with n_segments * image size.
+    """
+    meta = {"labels_found": int(segments.max())}
+    polygons = trace_polygons(segments, segment_slices(segments))
     return polygons, meta
 
 
-def compute_superpixel_features(img, segments):
+# columns of the dense feature matrix returned by compute_superpixel_features
+FEATURE_NAMES = [
+    "centroid_x", "centroid_y", "area",
+    "L_mean", "a_mean", "b_mean",
+    "L_var", "a_var", "b_var",
+]
+NDVI_FEATURE_NAMES = ["ndvi_mean", "ndvi_var"]
+
+# rows converted to Lab per step; bounds the temporary float buffers
+FEATURE_STRIP_ROWS = 512
+
+
+def compute_superpixels(img, n_segments=800, compactness=10.0):
     """
-    Compute very small set of features per superpixel:
-    - centroid (x,y)
-    - area (pixels)
-    - mean Lab color (L,a,b)
-    Returns dict keyed by segment id: { id: {centroid: [x,y], area: int, lab_mean: [L,a,b]} }
+    Run SLIC on an RGB image (uint8 or float 0..1). Labels start at 1.
     """
-    img_rgb = img
+    img_float = img.astype(np.float32) / 255.0 if img.dtype == np.uint8 else img.astype(np.float32)
+    return slic(img_float, n_segments=n_segments, compactness=compactness, start_label=1)
+
+
+def superpixel_feature_sums(img, segments, y0, y1, size, nir=None):
+    """
+    Per-label sums over rows y0:y1, as a (n_sums, size) float64 array:
+    count, row, col, L, a, b, L^2, a^2, b^2 (+ ndvi, ndvi^2 if nir is given).
+    Bands of img past the third (e.g. alpha) are ignored.
+    Sums from disjoint strips add up; see features_from_sums.
+    """
+    img_rgb = np.asarray(img[y0:y1])[..., :3]
+    nir_strip = np.asarray(nir[y0:y1]) if nir is not None else None
+    # NIR is taken to be on the same scale as the RGB input
+    nir_scale = 1.0
     if img_rgb.dtype != np.uint8:
+        nir_scale = 255.0
         # assume floats 0..1
         img_rgb = (img_rgb * 255).astype(np.uint8)
-    h, w = segments.shape
-    props = regionprops(segments)
-    lab = rgb2lab(img_rgb)
+    w = segments.shape[1]
+
+    n_sums = 9 + (2 if nir_strip is not None else 0)
+    sums = np.zeros((n_sums, size), dtype=np.float64)
+    lbl = np.asarray(segments[y0:y1]).ravel()
+    sums[0] = np.bincount(lbl, minlength=size)
+    rows = np.repeat(np.arange(y0, y1, dtype=np.float64), w)
+    sums[1] = np.bincount(lbl, weights=rows, minlength=size)
+    sums[2] = np.bincount(lbl, weights=np.tile(np.arange(w, dtype=np.float64), y1 - y0), minlength=size)
+    lab = rgb2lab(img_rgb).reshape(-1, 3)
+    for c in range(3):
+        sums[3 + c] = np.bincount(lbl, weights=lab[:, c], minlength=size)
+        sums[6 + c] = np.bincount(lbl, weights=lab[:, c] ** 2, minlength=size)
+    if nir_strip is not None:
+        red = img_rgb[..., 0].astype(np.float64).ravel()
+        ir = nir_strip.astype(np.float64).ravel() * nir_scale
+        denom = ir + red
+        ndvi = np.divide(ir - red, denom, out=np.zeros_like(denom), where=denom > 0)
+        sums[9] = np.bincount(lbl, weights=ndvi, minlength=size)
+        sums[10] = np.bincount(lbl, weights=ndvi ** 2, minlength=size)
+    return sums
+
+
+def features_from_sums(sums):
+    """
+    Turn accumulated superpixel_feature_sums into (features, matrix);
+    see compute_superpixel_features.
+    """
+    with_ndvi = sums.shape[0] > 9
+    area = sums[0]
+    safe = np.maximum(area, 1)
+    means = sums[1:] / safe
+    cy, cx = means[0], means[1]
+    lab_mean = means[2:5]
+    lab_var = np.maximum(means[5:8] - lab_mean ** 2, 0)
+    columns = [cx, cy, area, *lab_mean, *lab_var]
+    if with_ndvi:
+        ndvi_mean = means[8]
+        ndvi_var = np.maximum(means[9] - ndvi_mean ** 2, 0)
+        columns += [ndvi_mean, ndvi_var]
+    matrix = np.stack(columns, axis=1)[1:].astype(np.float32)
+
     features = {}
-    for p in props:
-        sid = int(p.label)
-        cy, cx = p.centroid
-        area = int(p.area)
-        mask = (segments == sid)
-        meanL = float(lab[..., 0][mask].mean()) if area > 0 else 0.0
-        meana = float(lab[..., 1][mask].mean()) if area > 0 else 0.0
-        meanb = float(lab[..., 2][mask].mean()) if area > 0 else 0.0
-        features[sid] = {"centroid": [float(cx), float(cy)], "area": area, "lab_mean": [meanL, meana, meanb]}
-    return features
+    for sid in np.flatnonzero(area[1:]) + 1:
+        sid = int(sid)
+        f = {
+            "centroid": [float(cx[sid]), float(cy[sid])],
+            "area": int(area[sid]),
+            "lab_mean": [float(v) for v in lab_mean[:, sid]],
+            "lab_var": [float(v) for v in lab_var[:, sid]],
+        }
+        if with_ndvi:
+            f["ndvi"] = [float(ndvi_mean[sid]), float(ndvi_var[sid])]
+        features[sid] = f
+    return features, matrix
+
+
+def compute_superpixel_features(img, segments, nir=None):
+    """
+    Compute a small set of features per superpixel:
+    - centroid (x,y)
+    - area (pixels)
+    - mean and variance of Lab color (L,a,b)
+    - mean and variance of NDVI, if a NIR band is passed as nir (a 4th
+      band of img is not taken for NIR: RGBA uploads carry alpha there)
+    Returns (features, matrix):
+      features: dict keyed by segment id:
+        { id: {centroid: [x,y], area: int, lab_mean: [L,a,b], lab_var: [L,a,b], ndvi: [mean,var]} }
+      matrix: float32 array (n_segments, n_features), row i is segment i+1,
+        columns are FEATURE_NAMES (+ NDVI_FEATURE_NAMES). Unused ids are zero rows.
+
+    Everything is accumulated with np.bincount over the flattened label map,
+    one strip of rows at a time, so no per-label masks are built.
+    """
+    h = segments.shape[0]
+    size = int(segments.max()) + 1
+    sums = None
+    for y0 in range(0, h, FEATURE_STRIP_ROWS):
+        y1 = min(y0 + FEATURE_STRIP_ROWS, h)
+        part = superpixel_feature_sums(img, segments, y0, y1, size, nir=nir)
+        sums = part if sums is None else sums + part
+    return features_from_sums(sums)
+
+
+def region_adjacency(segments, size=None, rows=FEATURE_STRIP_ROWS):
+    """
+    Pairs of labels that touch (4-connectivity) in a label map, as int32
+    (E, 2) with edges[:, 0] < edges[:, 1], sorted. One vectorized pass,
+    `rows` rows at a time (plus one row of overlap for the vertical pairs
+    across strips), so memory-mapped maps are never read whole.
+    size: an upper bound on the labels (default: max label + 1).
+    """
+    h = segments.shape[0]
+    size = int(segments.max()) + 1 if size is None else size
+    found = []
+    for y0 in range(0, h, rows):
+        y1 = min(y0 + rows, h)
+        strip = np.asarray(segments[y0:min(y1 + 1, h)])
+        keys = []
+        for a, b in ((strip[:y1 - y0, :-1], strip[:y1 - y0, 1:]), (strip[:-1], strip[1:])):
+            diff = a != b
+            lo = np.minimum(a[diff], b[diff]).astype(np.int64)
+            hi = np.maximum(a[diff], b[diff]).astype(np.int64)
+            keys.append(lo * size + hi)
+        found.append(np.unique(np.concatenate(keys)))
+    keys = np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+    edges = np.stack([keys // size, keys % size], axis=1).astype(np.int32)
+    # label 0 is not a superpixel
+    return edges[edges[:, 0] > 0]
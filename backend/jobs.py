@@ -0,0 +1,116 @@
+# backend/jobs.py
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# threads running jobs; 0 runs each job inline inside submit() (handy in tests)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# finished jobs kept around for status/result lookups
+MAX_FINISHED_JOBS = 1000
+
+
+class Job:
+    def __init__(self, kind, key):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.key = key
+        self.status = "queued"  # queued -> running -> done | failed
+        self.stage = None
+        self.stages = OrderedDict()  # name -> {"started": ts, "seconds": float}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    def progress(self, stage):
+        """Called by the pipeline when it enters a new stage."""
+        now = time.time()
+        self.end_stage(now)
+        self.stage = stage
+        self.stages[stage] = {"started": now, "seconds": None}
+
+    def end_stage(self, now):
+        if self.stage is not None and self.stages[self.stage]["seconds"] is None:
+            self.stages[self.stage]["seconds"] = round(now - self.stages[self.stage]["started"], 3)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "stages": [{"name": name, **info} for name, info in self.stages.items()],
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class JobQueue:
+    """
+    In-process job queue: a thread pool runs submitted callables, jobs are
+    looked up by id, and a submission whose key matches a job that is
+    still queued or running returns that job instead of starting another.
+
+    State lives in this process only; run the app with a single process
+    (threads are fine) so status polls reach the process that owns the job.
+    """
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._by_key = {}
+
+    def submit(self, kind, key, fn, *args, **kwargs):
+        """
+        Queue fn(*args, progress=job.progress, **kwargs). Returns (job, created).
+        """
+        with self._lock:
+            existing = self._jobs.get(self._by_key.get(key))
+            if existing is not None and existing.finished is None:
+                return existing, False
+            job = Job(kind, key)
+            self._jobs[job.id] = job
+            self._by_key[key] = job.id
+            self._evict()
+        if self._pool is None:
+            self._run(job, fn, args, kwargs)
+        else:
+            self._pool.submit(self._run, job, fn, args, kwargs)
+        return job, True
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def counts(self):
+        """{(kind, status): number of jobs} over the jobs still held."""
+        with self._lock:
+            out = {}
+            for job in self._jobs.values():
+                out[job.kind, job.status] = out.get((job.kind, job.status), 0) + 1
+            return out
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = "running"
+        try:
+            job.result = fn(*args, progress=job.progress, **kwargs)
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished = time.time()
+            job.end_stage(job.finished)
+
+    def _evict(self):
+        finished = [j for j in self._jobs.values() if j.finished is not None]
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job.id]
+            if self._by_key.get(job.key) == job.id:
+                del self._by_key[job.key]
@@ -0,0 +1,181 @@
+# backend/labelstore.py
+# Usage example (drop superseded label events):
+# python labelstore.py compact labels/
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+
+LABEL_DB = "labels.db"
+# how long a writer waits for another process's write lock (ms)
+BUSY_TIMEOUT_MS = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS label_events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_id TEXT NOT NULL,
+    superpixel_id TEXT NOT NULL,
+    label TEXT NOT NULL,
+    user TEXT NOT NULL,
+    ts INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS labels (
+    image_id TEXT NOT NULL,
+    superpixel_id TEXT NOT NULL,
+    label TEXT NOT NULL,
+    user TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (image_id, superpixel_id)
+);
+CREATE INDEX IF NOT EXISTS label_events_image ON label_events (image_id, seq);
+-- "changes since version N" polls
+CREATE INDEX IF NOT EXISTS labels_image_seq ON labels (image_id, seq);
+CREATE TABLE IF NOT EXISTS imported (image_id TEXT PRIMARY KEY);
+"""
+
+
+class LabelStore:
+    """
+    Superpixel labels in SQLite (WAL mode), safe to share between threads
+    and gunicorn worker processes.
+    Every write appends to label_events and, in the same transaction,
+    upserts the materialized `labels` snapshot that reads are served from.
+    compact() drops events superseded by a newer label for the same
+    superpixel. Legacy labels/<image_id>_labels.json files are imported
+    the first time an image is touched.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, LABEL_DB)
+        self._local = threading.local()
+        os.makedirs(folder, exist_ok=True)
+        self._db().executescript(SCHEMA)
+
+    def _db(self):
+        # one connection per thread (sqlite3 connections are not thread-safe)
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            self._local.db = db
+        return db
+
+    def _transaction(self):
+        return _Transaction(self._db())
+
+    def _import_legacy(self, db, image_id):
+        if db.execute("SELECT 1 FROM imported WHERE image_id = ?", (image_id,)).fetchone():
+            return
+        legacy = os.path.join(self.folder, f"{image_id}_labels.json")
+        if os.path.exists(legacy):
+            with open(legacy) as fh:
+                entries = json.load(fh)
+            rows = [(image_id, str(spid), e["label"], e.get("user", "anonymous"), int(e.get("ts", 0)))
+                    for spid, e in sorted(entries.items(), key=lambda kv: kv[1].get("ts", 0))]
+            self._append(db, rows)
+        db.execute("INSERT INTO imported (image_id) VALUES (?)", (image_id,))
+
+    def _append(self, db, rows):
+        # events first, then fold just those into the snapshot; within one
+        # batch the last label for a superpixel wins (ORDER BY seq)
+        start = db.execute("SELECT COALESCE(MAX(seq), 0) FROM label_events").fetchone()[0]
+        db.executemany(
+            "INSERT INTO label_events (image_id, superpixel_id, label, user, ts) VALUES (?, ?, ?, ?, ?)", rows)
+        db.execute(
+            "INSERT INTO labels (image_id, superpixel_id, label, user, ts, seq) "
+            "SELECT image_id, superpixel_id, label, user, ts, seq FROM label_events WHERE seq > ? ORDER BY seq "
+            "ON CONFLICT (image_id, superpixel_id) DO UPDATE SET "
+            "label = excluded.label, user = excluded.user, ts = excluded.ts, seq = excluded.seq",
+            (start,))
+        return db.execute("SELECT COALESCE(MAX(seq), 0) FROM label_events").fetchone()[0]
+
+    def set_labels(self, image_id, items, user="anonymous", ts=None):
+        """
+        Atomically record [(superpixel_id, label), ...] for one image.
+        Returns the sequence number of the last event written.
+        """
+        ts = int(time.time()) if ts is None else ts
+        rows = [(image_id, str(spid), label, user, ts) for spid, label in items]
+        with self._transaction() as db:
+            self._import_legacy(db, image_id)
+            return self._append(db, rows)
+
+    def set_label(self, image_id, superpixel_id, label, user="anonymous"):
+        return self.set_labels(image_id, [(superpixel_id, label)], user=user)
+
+    def get_labels(self, image_id):
+        """
+        Snapshot {superpixel_id: {label, user, ts}} for one image. Reads take
+        no lock: under WAL one SELECT sees a consistent committed state.
+        """
+        return self.changes(image_id)[0]
+
+    def changes(self, image_id, since=0):
+        """
+        ({superpixel_id: {label, user, ts}}, version): the image's labels
+        written after event `since` (all of them for 0), and the image's
+        version, the sequence number of its last label. Passing that version
+        back as `since` yields only what changed in between.
+        """
+        db = self._db()
+        if not db.execute("SELECT 1 FROM imported WHERE image_id = ?", (image_id,)).fetchone():
+            with self._transaction() as tx:
+                self._import_legacy(tx, image_id)
+        rows = db.execute(
+            "SELECT superpixel_id, label, user, ts, seq FROM labels WHERE image_id = ? AND seq > ?",
+            (image_id, since)).fetchall()
+        labels = {spid: {"label": label, "user": user, "ts": ts} for spid, label, user, ts, _ in rows}
+        return labels, max([since] + [row[4] for row in rows])
+
+    def labels_since(self, seq):
+        """
+        Current labels written after event `seq`, oldest first:
+        [(image_id, superpixel_id, label, seq, user), ...].
+        """
+        return self._db().execute(
+            "SELECT image_id, superpixel_id, label, seq, user FROM labels WHERE seq > ? ORDER BY seq",
+            (seq,)).fetchall()
+
+    def last_seq(self):
+        return self._db().execute("SELECT COALESCE(MAX(seq), 0) FROM labels").fetchone()[0]
+
+    def compact(self):
+        """Drop events that a later label for the same superpixel overrides."""
+        with self._transaction() as db:
+            removed = db.execute(
+                "DELETE FROM label_events WHERE seq NOT IN (SELECT seq FROM labels)").rowcount
+        # fold the write-ahead log back into the database file
+        self._db().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return removed
+
+
+class _Transaction:
+    """`with` block around one write transaction (BEGIN IMMEDIATE)."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+
+def main():
+    if len(sys.argv) != 3 or sys.argv[1] != "compact":
+        print("usage: python labelstore.py compact <labels folder>")
+        sys.exit(1)
+    removed = LabelStore(sys.argv[2]).compact()
+    print(f"removed {removed} superseded label events")
+
+
+if __name__ == "__main__":
+    main()
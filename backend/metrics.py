@@ -0,0 +1,205 @@
+# backend/metrics.py
+import os
+import time
+import resource
+import threading
+from collections import OrderedDict
+
+# upper bounds (seconds) of the duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# how often resident memory is sampled while a stage is running
+RSS_SAMPLE_SECONDS = float(os.environ.get("RSS_SAMPLE_SECONDS", 0.01))
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def rss_bytes():
+    """Current resident memory of this process."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        # no procfs: the high-water mark is the best there is (KB on Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Registry:
+    """
+    Counters, gauges and histograms keyed by (name, labels), rendered in the
+    Prometheus text format. Thread-safe; state lives in this process (like
+    the job queue, so serve the app from a single process).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = OrderedDict()  # name -> (type, help)
+        self._values = {}  # (name, labels) -> float
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+
+    def describe(self, name, kind, text):
+        self._help.setdefault(name, (kind, text))
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * (len(DURATION_BUCKETS) + 2)
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+            histograms = sorted((k, list(v)) for k, v in self._histograms.items())
+        lines = []
+        described = set()
+
+        def header(name):
+            if name not in described and name in self._help:
+                kind, text = self._help[name]
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+
+        for (name, labels), value in values:
+            header(name)
+            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        for (name, labels), h in histograms:
+            header(name)
+            for bound, count in zip(DURATION_BUCKETS, h):
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {h[-1]}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(h[-2])}")
+            lines.append(f"{name}_count{_labels(labels)} {h[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for k, v in labels:
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{k}="{v}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _RssSampler:
+    """
+    One background thread that, while any stage is open, samples resident
+    memory every RSS_SAMPLE_SECONDS and raises each open stage's peak.
+    Peaks are process-wide: stages running concurrently see each other.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._open = {}
+        self._thread = None
+
+    def start(self):
+        peak = [rss_bytes()]
+        with self._lock:
+            self._open[id(peak)] = peak
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return peak
+
+    def stop(self, peak):
+        with self._lock:
+            self._open.pop(id(peak), None)
+        peak[0] = max(peak[0], rss_bytes())
+        return peak[0]
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            rss = rss_bytes()
+            with self._lock:
+                if not self._open:
+                    self._thread = None
+                    return
+                for peak in self._open.values():
+                    peak[0] = max(peak[0], rss)
+
+
+registry = Registry()
+registry.describe("orthoviewer_stage_seconds", "histogram", "Time spent per pipeline stage.")
+registry.describe("orthoviewer_stage_peak_rss_bytes", "gauge",
+                  "Peak resident memory of the process during the last run of each stage.")
+_sampler = _RssSampler()
+
+
+class StageProfile:
+    """
+    A progress(stage) callback that times consecutive stages, the way the
+    pipeline reports them to a job: each call ends the running stage and
+    starts the next one. Every stage's seconds and peak RSS go to the
+    registry; breakdown() lists them for a per-request profile.
+    progress: an inner callback to forward stage changes to (a Job's).
+    """
+
+    def __init__(self, progress=None, metrics=registry):
+        self.progress = progress
+        self.metrics = metrics
+        self.stages = []
+        self._current = None
+
+    def __call__(self, stage):
+        self._end()
+        self._current = (stage, time.perf_counter(), _sampler.start())
+        if self.progress is not None:
+            self.progress(stage)
+
+    def _end(self):
+        if self._current is None:
+            return
+        stage, t0, peak = self._current
+        self._current = None
+        seconds = time.perf_counter() - t0
+        peak_rss = _sampler.stop(peak)
+        self.metrics.observe("orthoviewer_stage_seconds", seconds, stage=stage)
+        self.metrics.set("orthoviewer_stage_peak_rss_bytes", peak_rss, stage=stage)
+        self.stages.append({"name": stage, "seconds": round(seconds, 4), "peak_rss_mb": round(peak_rss / 2 ** 20, 1)})
+
+    def close(self):
+        """End the running stage."""
+        self._end()
+
+    def stage(self, name):
+        """Context manager timing one stage: `with profile.stage("serialize"): ...`."""
+        return _Stage(self, name)
+
+    def breakdown(self):
+        return list(self.stages)
+
+
+class _Stage:
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile(self.name)
+        return self.profile
+
+    def __exit__(self, *exc):
+        self.profile.close()
+        return False
@@ -0,0 +1,248 @@
+# backend/online.py
+import os
+import fcntl
+import threading
+import numpy as np
+import joblib
+from sklearn.ensemble import ExtraTreesClassifier
+from helpers import FEATURE_NAMES
+from segstore import load_store
+from predict import MODEL_PATH, ONLINE_MODEL_PATH
+
+# saved labels needed before a background update is queued
+RETRAIN_MIN_LABELS = int(os.environ.get("RETRAIN_MIN_LABELS", 20))
+# trees of the online member, refitted on every update
+ONLINE_TREES = 100
+# labels an update fits on: past this, every new label plus a random
+# replay sample of the older ones
+ONLINE_MAX_LABELS = int(os.environ.get("ONLINE_MAX_LABELS", 20000))
+# classes with fewer labels are left out of the online member; without two
+# classes left, no online model is published
+ONLINE_MIN_CLASS_LABELS = 5
+# share of the vote the online trees get next to the offline model
+ONLINE_WEIGHT = float(os.environ.get("ONLINE_WEIGHT", 0.5))
+# labels saved by accepting suggestions (user "model_<version>") or by
+# propagation over the superpixel graph ("propagate_<method>") are not trained on
+MODEL_USER_PREFIX = "model_"
+PROPAGATE_USER_PREFIX = "propagate_"
+
+
+def _no_progress(stage):
+    pass
+
+
+class Ensemble:
+    """
+    Tree ensembles voting together: the offline model from train.py plus
+    one member per batch of new labels. Online members are averaged by
+    tree count and get ONLINE_WEIGHT of the vote, so corrections show up
+    without outvoting the offline model everywhere. Members may know
+    different label subsets; their probabilities are aligned on the union
+    of labels (classes_, as label names).
+    Pickled, it holds only the online members and the offline model's
+    path and mtime; unpickling loads the offline model from that path
+    (memory-mapped), so the online file stays small.
+    """
+
+    def __init__(self, base=None, base_path=None):
+        self.members = []  # (model, label name of each model.classes_ entry, online?)
+        self.classes_ = np.array([], dtype=object)
+        self.n_features_in_ = len(FEATURE_NAMES)
+        self.version = 0
+        self.trained_seq = 0  # last label event folded into the model
+        self.base_path = base_path
+        self.base_mtime = None
+        if base is not None:
+            self._add_base(base)
+
+    def _add_base(self, base):
+        names = getattr(base, "class_names", None)
+        self.n_features_in_ = base.n_features_in_
+        classes = [names[int(c)] if names and int(c) < len(names) else str(c) for c in base.classes_]
+        self.add(classes, base, online=False)
+
+    def add(self, classes, model, online=True):
+        self.members.append((model, list(classes), online))
+        self.classes_ = np.array(sorted(set(self.classes_) | set(classes)), dtype=object)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["members"] = [m for m in self.members if m[2]]
+        return state
+
+    def __setstate__(self, state):
+        members = state.pop("members")
+        self.__dict__.update(state)
+        self.__dict__.setdefault("base_path", None)  # files written before the split still hold the base
+        self.members = []
+        self.classes_ = np.array([], dtype=object)
+        if self.base_path and os.path.exists(self.base_path):
+            self._add_base(joblib.load(self.base_path, mmap_mode="r"))
+        for model, classes, online in members:
+            self.add(classes, model, online)
+
+    def online_trees(self):
+        return sum(len(m.estimators_) for m, _, online in self.members if online)
+
+    def predict_proba(self, X):
+        index = {c: i for i, c in enumerate(self.classes_)}
+        parts = {}  # online? -> (tree-weighted proba sum, trees)
+        for model, classes, online in self.members:
+            trees = len(model.estimators_)
+            proba, total = parts.get(online, (np.zeros((len(X), len(self.classes_))), 0))
+            proba[:, [index[c] for c in classes]] += trees * model.predict_proba(X)
+            parts[online] = (proba, total + trees)
+        if len(parts) == 1:
+            proba, total = next(iter(parts.values()))
+            return proba / total
+        (base, base_trees), (new, new_trees) = parts[False], parts[True]
+        return (1 - ONLINE_WEIGHT) * base / base_trees + ONLINE_WEIGHT * new / new_trees
+
+
+def labeled_features(seg_folder, rows, n_features):
+    """
+    Feature rows of labeled superpixels from the segment stores.
+    rows: LabelStore.labels_since() rows; accepted model suggestions,
+    propagated labels and labels of images without a store (or unknown
+    superpixels), or whose store lacks feature columns (legacy results
+    converted without their image), are skipped.
+    Returns (X float32 (n, n_features), y label names (n,)).
+    """
+    by_image = {}
+    for image_id, spid, label, _, user in rows:
+        if user.startswith((MODEL_USER_PREFIX, PROPAGATE_USER_PREFIX)):
+            continue
+        by_image.setdefault(image_id, []).append((int(spid), label))
+    X_parts, y_parts = [], []
+    for image_id, items in by_image.items():
+        store = load_store(seg_folder, image_id)
+        if store is None or store.features is None or store.info.get("missing_features"):
+            continue
+        sids = np.array([sid for sid, _ in items])
+        ok = (sids >= 1) & (sids <= len(store.features))
+        X_parts.append(np.asarray(store.features[sids[ok] - 1][:, :n_features], dtype=np.float32))
+        y_parts.append(np.array([label for (_, label), keep in zip(items, ok) if keep], dtype=object))
+    if not X_parts:
+        return np.zeros((0, n_features), dtype=np.float32), np.zeros(0, dtype=object)
+    return np.vstack(X_parts), np.concatenate(y_parts)
+
+
+def replay_rows(rows, since, limit=ONLINE_MAX_LABELS, seed=0):
+    """
+    Training rows out of the current labels (LabelStore.labels_since(0),
+    oldest first): all of them up to limit, else every row written after
+    event `since` and a random sample of the older ones filling up to limit.
+    """
+    if len(rows) <= limit:
+        return rows
+    old = [row for row in rows if row[3] <= since]
+    new = [row for row in rows if row[3] > since][-limit:]
+    rng = np.random.default_rng(seed)
+    keep = rng.choice(len(old), min(len(old), limit - len(new)), replace=False)
+    return [old[i] for i in sorted(keep)] + new
+
+
+def trainable(y, min_count=ONLINE_MIN_CLASS_LABELS):
+    """Mask of the labels whose class has at least min_count of them."""
+    _, inverse, counts = np.unique(y, return_inverse=True, return_counts=True)
+    return (counts >= min_count)[inverse]
+
+
+class OnlineTrainer:
+    """
+    Folds saved labels into the served model: each update refits the one
+    online member (ExtraTrees) on the current labels, the newest ones plus
+    a bounded replay sample of the rest (replay_rows), so a batch holding
+    a single class cannot take over the vote and relabeled superpixels
+    train with their new label only. Each version is written to
+    ONLINE_MODEL_PATH (atomically) and swapped into the predictor;
+    other processes pick it up through Predictor.refresh(). Updates hold
+    an exclusive lock on <path>.lock and start from the file on disk, so
+    trainers in several processes build on each other's versions.
+    """
+
+    def __init__(self, label_store, seg_folder, predictor, base_path=MODEL_PATH, path=ONLINE_MODEL_PATH):
+        self.label_store = label_store
+        self.seg_folder = seg_folder
+        self.predictor = predictor
+        self.base_path = base_path
+        self.path = path
+        self._lock = threading.Lock()
+        self.model = None
+        self._loaded = None  # mtime of the file self.model was read from
+        self._reload()
+
+    def _reload(self):
+        """Re-read the online model if its file changed since it was loaded."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._loaded:
+            self.model = joblib.load(self.path)
+            self._loaded = mtime
+
+    def _base_mtime(self):
+        return os.path.getmtime(self.base_path) if os.path.exists(self.base_path) else None
+
+    def _fresh_model(self):
+        mtime = self._base_mtime()
+        model = Ensemble(joblib.load(self.base_path, mmap_mode="r") if mtime is not None else None,
+                         base_path=self.base_path)
+        model.base_mtime = mtime
+        return model
+
+    def trained_seq(self):
+        # the file is replaced atomically, so reading it needs no lock
+        self._reload()
+        return self.model.trained_seq if self.model is not None else 0
+
+    def pending(self):
+        """Label events saved since the model was last updated."""
+        return self.label_store.last_seq() - self.trained_seq()
+
+    def update(self, progress=_no_progress):
+        """Refit on the current labels and publish a new model version (no-op without new labels)."""
+        with self._lock, open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._reload()
+            previous = self.model or self._fresh_model()
+            if not self.label_store.labels_since(previous.trained_seq):
+                return self.status()
+            rows = self.label_store.labels_since(0)
+            model = self._fresh_model()
+            model.version = previous.version
+            model.trained_seq = rows[-1][3]
+            X, y = labeled_features(self.seg_folder, replay_rows(rows, previous.trained_seq, seed=previous.version),
+                                    model.n_features_in_)
+            keep = trainable(y)
+            if len(set(y[keep])) < 2:
+                # one class (or none) would vote for itself everywhere; the
+                # labels are refitted with the rest once a second class arrives
+                previous.trained_seq = model.trained_seq
+                self.model = previous
+                return dict(self.status(), skipped=f"needs {ONLINE_MIN_CLASS_LABELS} labels of 2 classes")
+            progress("fit")
+            trees = ExtraTreesClassifier(n_estimators=ONLINE_TREES, random_state=model.version)
+            trees.fit(X[keep], y[keep])
+            model.add(trees.classes_, trees)
+            model.version += 1
+
+            progress("publish")
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            joblib.dump(model, tmp)
+            os.replace(tmp, self.path)
+            self.model = model
+            self._loaded = os.stat(self.path).st_mtime_ns
+            self.predictor.load()
+            return dict(self.status(), trained_on=int(keep.sum()))
+
+    def status(self):
+        self._reload()
+        model = self.model
+        return {
+            "version": model.version if model is not None else 0,
+            "trained_seq": self.trained_seq(),
+            "online_trees": model.online_trees() if model is not None else 0,
+            "classes": list(model.classes_) if model is not None else [],
+        }
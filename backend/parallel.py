@@ -0,0 +1,175 @@
+# backend/parallel.py
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from helpers import (compute_superpixels, segment_slices, trace_polygons,
+                     superpixel_feature_sums, features_from_sums, FEATURE_STRIP_ROWS)
+from raster import Raster
+
+# worker processes used for segmentation; 1 keeps everything in-process
+SEGMENT_WORKERS = int(os.environ.get("SEGMENT_WORKERS", os.cpu_count() or 1))
+
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def get_executor(workers=None):
+    """
+    Shared process pool, created on first use (under a lock, so concurrent
+    requests never start two). Returns None when running with a single
+    worker, which callers treat as "do it serially".
+    """
+    global _executor, _executor_workers
+    workers = SEGMENT_WORKERS if workers is None else int(workers)
+    if workers <= 1:
+        return None
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                # queued work still runs; the old workers exit after it
+                _executor.shutdown(wait=False)
+            # workers must inherit the parent's tracker, or each one would
+            # "clean up" shared arrays it merely attached to when it exits
+            resource_tracker.ensure_running()
+            _executor = ProcessPoolExecutor(max_workers=workers)
+            _executor_workers = workers
+        return _executor
+
+
+def pool_size(executor):
+    """Worker count of a pool from get_executor(), used to size chunks of work."""
+    with _executor_lock:
+        return _executor_workers if executor is _executor else SEGMENT_WORKERS
+
+
+class SharedArray:
+    """
+    Copy of a numpy array in shared memory. Hand `spec` to workers, which
+    open it with attach(); the array itself is never pickled.
+    """
+
+    def __init__(self, arr):
+        arr = np.ascontiguousarray(arr)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        self.array = np.ndarray(arr.shape, dtype=arr.dtype, buffer=self.shm.buf)
+        self.array[...] = arr
+        self.spec = ("shm", self.shm.name, arr.shape, arr.dtype.str)
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@contextmanager
+def share(arr):
+    """
+    Yield a spec workers can attach to. Arrays already backed by a file
+    (np.memmap, e.g. the on-disk label map, or an upload's Raster) are
+    shared by path; anything else is copied into shared memory for the
+    duration of the block.
+    """
+    if isinstance(arr, Raster):
+        yield ("file", arr.filename, arr.offset, arr.shape, arr.dtype.str)
+        return
+    if isinstance(arr, np.memmap) and arr.filename:
+        arr.flush()
+        yield ("file", arr.filename, arr.offset, arr.shape, arr.dtype.str)
+        return
+    with SharedArray(arr) as shared:
+        yield shared.spec
+
+
+@contextmanager
+def attach(spec):
+    """Worker side of share(): a read-only view of the shared array."""
+    if spec[0] == "file":
+        _, filename, offset, shape, dtype = spec
+        yield np.memmap(filename, mode="r", dtype=dtype, shape=shape, offset=offset)
+        return
+    _, name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        yield np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    finally:
+        shm.close()
+
+
+def bounded_map(executor, fn, arg_lists, window):
+    """
+    Like executor.map, but keeps at most `window` tasks in flight, so
+    results that are consumed in order don't pile up in memory.
+    """
+    pending = deque()
+    for args in arg_lists:
+        pending.append(executor.submit(fn, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _tile_task(img_spec, task, compactness):
+    y0, y1, x0, x1, n_tile = task
+    with attach(img_spec) as img:
+        tile = np.array(img[y0:y1, x0:x1])
+    return compute_superpixels(tile, n_segments=n_tile, compactness=compactness).astype(np.int32)
+
+
+def _polygon_task(seg_spec, items):
+    with attach(seg_spec) as segments:
+        return trace_polygons(segments, items)
+
+
+def _feature_task(img_spec, seg_spec, y0, y1, size):
+    with attach(img_spec) as img, attach(seg_spec) as segments:
+        sums = None
+        for s0 in range(y0, y1, FEATURE_STRIP_ROWS):
+            part = superpixel_feature_sums(img, segments, s0, min(s0 + FEATURE_STRIP_ROWS, y1), size)
+            sums = part if sums is None else sums + part
+        return sums
+
+
+def tile_mapper(executor, img_spec):
+    """A tiling.tiled_superpixels map_tiles that runs tiles on the pool."""
+    window = 2 * pool_size(executor)
+
+    def map_tiles(img, tasks, compactness):
+        return bounded_map(executor, _tile_task, ((img_spec, t, compactness) for t in tasks), window)
+    return map_tiles
+
+
+def parallel_polygons(executor, segments, seg_spec):
+    """helpers.segments_to_polygons, with contour tracing split over the pool."""
+    meta = {"labels_found": int(segments.max())}
+    items = segment_slices(segments)
+    n_chunks = 4 * pool_size(executor)
+    step = max(1, -(-len(items) // n_chunks))
+    chunks = [items[i:i + step] for i in range(0, len(items), step)]
+    polygons = []
+    for part in executor.map(_polygon_task, [seg_spec] * len(chunks), chunks):
+        polygons.extend(part)
+    return polygons, meta
+
+
+def parallel_features(executor, img_spec, seg_spec, segments):
+    """helpers.compute_superpixel_features, with row bands summed on the pool."""
+    h = segments.shape[0]
+    size = int(segments.max()) + 1
+    step = max(FEATURE_STRIP_ROWS, -(-h // pool_size(executor)))
+    bands = [(y0, min(y0 + step, h)) for y0 in range(0, h, step)]
+    sums = None
+    for part in executor.map(_feature_task, *zip(*[(img_spec, seg_spec, y0, y1, size) for y0, y1 in bands])):
+        sums = part if sums is None else sums + part
+    return features_from_sums(sums)
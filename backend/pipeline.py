@@ -0,0 +1,170 @@
+# backend/pipeline.py
+import os
+import time
+import uuid
+import numpy as np
+from helpers import segments_to_polygons, compute_superpixel_features, compute_superpixels, region_adjacency
+from graph import RegionGraph
+from tiling import tiled_superpixels, TILE_SIZE, TILE_OVERLAP
+from parallel import share, tile_mapper, parallel_polygons, parallel_features
+from segstore import write_store, store_path
+from raster import open_raster
+
+# images larger than this (either side) are segmented in tiles at full resolution
+MAX_SIZE = 3000
+
+
+def _no_progress(stage):
+    pass
+
+
+def segment_image(img, n_segments=800, compactness=10.0, tile_size=0,
+                  tile_overlap=TILE_OVERLAP, labels_path=None, executor=None,
+                  progress=_no_progress):
+    """
+    SLIC + polygons + features for one RGB image (an array, or a
+    raster.Raster that tiles are read from lazily).
+    Images over MAX_SIZE (or tile_size, if given) are segmented in tiles;
+    the label map then goes to labels_path as an .npy memmap when given.
+    With an executor, tiles, contour tracing and feature sums run on the
+    process pool, sharing the image and label map instead of pickling them.
+    progress(stage) is called as each stage ("slic", "polygons", "features") starts.
+    Returns (segments, polygons, meta, features, feature_matrix).
+    """
+    h, w = img.shape[:2]
+    if tile_size <= 0 and max(h, w) > MAX_SIZE:
+        tile_size = TILE_SIZE
+    tiled = tile_size > 0 and max(h, w) > tile_size
+    if not tiled:
+        # small enough to hold whole
+        img = np.asarray(img)
+
+    if executor is None:
+        progress("slic")
+        if tiled:
+            segments = _label_map(labels_path, h, w)
+            segments = tiled_superpixels(img, n_segments=n_segments, compactness=compactness,
+                                         tile_size=tile_size, overlap=tile_overlap, out=segments)
+        else:
+            segments = compute_superpixels(img, n_segments=n_segments, compactness=compactness)
+        progress("polygons")
+        polygons, meta = segments_to_polygons(segments)
+        progress("features")
+        features, feature_matrix = compute_superpixel_features(img, segments)
+        return segments, polygons, meta, features, feature_matrix
+
+    with share(img) as img_spec:
+        progress("slic")
+        if tiled:
+            segments = _label_map(labels_path, h, w)
+            segments = tiled_superpixels(img, n_segments=n_segments, compactness=compactness,
+                                         tile_size=tile_size, overlap=tile_overlap, out=segments,
+                                         map_tiles=tile_mapper(executor, img_spec))
+        else:
+            segments = compute_superpixels(img, n_segments=n_segments, compactness=compactness)
+        with share(segments) as seg_spec:
+            progress("polygons")
+            polygons, meta = parallel_polygons(executor, segments, seg_spec)
+            progress("features")
+            features, feature_matrix = parallel_features(executor, img_spec, seg_spec, segments)
+    return segments, polygons, meta, features, feature_matrix
+
+
+def _label_map(labels_path, h, w):
+    # label map lives on disk so only the current tile is held in RAM
+    if labels_path is None:
+        return np.zeros((h, w), dtype=np.int32)
+    return np.lib.format.open_memmap(labels_path, mode="w+", dtype=np.int32, shape=(h, w))
+
+
+def segment_file(image_path, image_filename, seg_folder, params, executor=None,
+                 progress=_no_progress, cache_key=None):
+    """
+    Segment an uploaded image and write the segstore directory
+    segments/<image_id>/, superpixel adjacency graph included. Pixels come
+    from the upload's windowed raster (decoded once, see raster.py), so
+    large mosaics are read tile by tile.
+    params: n_segments, compactness, tile_size, tile_overlap.
+    Returns the segments document (polygons, meta, features, ...).
+    """
+    progress("decode")
+    img = open_raster(image_path)
+    image_id = image_filename.split("_")[0]
+    # tiled label maps are written straight to disk, then moved into the store
+    labels_path = os.path.join(seg_folder, f".{image_id}.{uuid.uuid4().hex}.labels.npy")
+    segments, polygons, meta, features, feature_matrix = segment_image(
+        img,
+        n_segments=params["n_segments"],
+        compactness=params["compactness"],
+        tile_size=params.get("tile_size", 0),
+        tile_overlap=params.get("tile_overlap", TILE_OVERLAP),
+        labels_path=labels_path,
+        executor=executor,
+        progress=progress,
+    )
+
+    out = {
+        "image_id": image_id,
+        "image_filename": image_filename,
+        "image_shape": list(img.shape),
+        "n_segments": int(np.max(segments)),
+        "polygons": polygons,
+        "meta": meta,
+        "features": features
+    }
+
+    progress("graph")
+    graph = RegionGraph.build(region_adjacency(segments, len(feature_matrix) + 1), feature_matrix)
+
+    progress("write")
+    if isinstance(segments, np.memmap):
+        segments.flush()
+        write_store(store_path(seg_folder, image_id), out, feature_matrix=feature_matrix,
+                    labels_file=labels_path, cache_key=cache_key, graph=graph)
+    else:
+        write_store(store_path(seg_folder, image_id), out, segments=segments,
+                    feature_matrix=feature_matrix, cache_key=cache_key, graph=graph)
+    return out
+
+
+def _segment_file_task(image_path, image_filename, seg_folder, params):
+    # runs inside a pool worker: whole pipeline serially, only a summary goes back
+    out = segment_file(image_path, image_filename, seg_folder, params)
+    h, w = out["image_shape"][:2]
+    return {"image_id": out["image_id"], "image_filename": image_filename,
+            "n_segments": out["n_segments"], "pixels": h * w}
+
+
+def segment_files(items, seg_folder, params, executor=None, progress=_no_progress):
+    """
+    Segment several uploaded images, one per pool worker.
+    items: [(image_path, image_filename), ...]
+    Returns (summaries, throughput).
+    """
+    t0 = time.perf_counter()
+    n = len(items)
+    results = []
+    progress(f"images done 0/{n}")
+    if executor is None:
+        for i, (path, name) in enumerate(items):
+            results.append(_segment_file_task(path, name, seg_folder, params))
+            progress(f"images done {i + 1}/{n}")
+    else:
+        futures = [executor.submit(_segment_file_task, path, name, seg_folder, params) for path, name in items]
+        for i, future in enumerate(futures):
+            results.append(future.result())
+            progress(f"images done {i + 1}/{n}")
+    elapsed = time.perf_counter() - t0
+    pixels = sum(r.pop("pixels") for r in results)
+    return results, throughput(len(results), pixels, elapsed)
+
+
+def throughput(n_images, pixels, seconds):
+    seconds = max(seconds, 1e-9)
+    return {
+        "images": n_images,
+        "megapixels": round(pixels / 1e6, 3),
+        "seconds": round(seconds, 3),
+        "images_per_sec": round(n_images / seconds, 3),
+        "megapixels_per_sec": round(pixels / 1e6 / seconds, 3),
+    }
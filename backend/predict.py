@@ -0,0 +1,128 @@
+# backend/predict.py
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import joblib
+
+# classifier written by train.py
+MODEL_PATH = os.environ.get("MODEL_PATH", "model_rf.joblib")
+# model updated from annotator labels (online.py); served instead when present
+ONLINE_MODEL_PATH = os.environ.get("ONLINE_MODEL_PATH", "model_online.joblib")
+# how often a process looks for a newer model file (seconds)
+RELOAD_CHECK_SECONDS = 2.0
+# a model file knowing fewer classes is not served (it would suggest its
+# one class everywhere); the next file in line is used instead
+MIN_MODEL_CLASSES = 2
+# predictions kept per (segment result, model version)
+PREDICTION_CACHE_ENTRIES = 64
+
+
+class Predictor:
+    """
+    Classifier loaded once per process. joblib memory-maps the model's
+    arrays (trees are stored uncompressed), so worker processes share
+    the pages instead of each holding a copy.
+    The online model is preferred over the offline one; refresh() swaps
+    in a newer file (written by another process) without a restart.
+    """
+
+    def __init__(self, path=MODEL_PATH, online_path=ONLINE_MODEL_PATH):
+        self.paths = [online_path, path]
+        self.model = None
+        self.version = None
+        self.class_names = []
+        self._loaded = None  # (path, mtime) of the model in use
+        self._seen = ()  # (path, mtime) of every model file at the last load
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self.load()
+
+    def _files(self):
+        files = []
+        for path in self.paths:
+            try:
+                files.append((path, os.path.getmtime(path)))
+            except FileNotFoundError:
+                continue
+        return tuple(files)
+
+    def load(self):
+        """(Re)load the preferred usable model file; returns False if there is none."""
+        files = self._files()
+        self._seen = files
+        for current in files:
+            model = joblib.load(current[0], mmap_mode="r")
+            if len(model.classes_) < MIN_MODEL_CLASSES:
+                print(f"Not serving {current[0]}: it knows {len(model.classes_)} class(es)")
+                continue
+            self.swap(model, current)
+            return True
+        return False
+
+    def swap(self, model, loaded=None):
+        """Serve `model` from now on; in-flight requests keep the old one."""
+        names = getattr(model, "class_names", None)
+        class_names = [names[int(c)] if names and int(c) < len(names) else str(c) for c in model.classes_]
+        version = getattr(model, "version", None)
+        with self._lock:
+            self.model = model
+            self.version = str(version) if version is not None else str(int(loaded[1]))
+            self.class_names = class_names
+            self._loaded = loaded
+            self._results.clear()
+
+    def refresh(self):
+        """Reload if a newer model file appeared (checked every RELOAD_CHECK_SECONDS)."""
+        now = time.monotonic()
+        if now - self._checked < RELOAD_CHECK_SECONDS:
+            return
+        self._checked = now
+        if self._files() != self._seen:
+            self.load()
+
+    @property
+    def available(self):
+        return self.model is not None
+
+    def predict_matrix(self, X, model=None):
+        """
+        One batched predict_proba over a feature matrix.
+        Returns (class index into class_names (n,), confidence float32 (n,)).
+        """
+        model = self.model if model is None else model
+        X = np.asarray(X, dtype=np.float32)[:, :model.n_features_in_]
+        proba = model.predict_proba(X)
+        best = proba.argmax(axis=1)
+        return best, proba[np.arange(len(best)), best].astype(np.float32)
+
+    def suggestions(self, store):
+        """
+        {segment id: {label, confidence}} for every segment of a store, or
+        None without a model or with fewer feature columns than it needs.
+        """
+        with self._lock:
+            model, version, class_names = self.model, self.version, self.class_names
+        X = store.features
+        if model is None or X is None or X.shape[1] < model.n_features_in_:
+            return None
+        key = (store.info.get("cache_key") or store.path, version)
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+
+        area = np.asarray(X[:, store.info["feature_names"].index("area")])
+        seg_ids = np.flatnonzero(area > 0) + 1
+        best, confidence = self.predict_matrix(X[seg_ids - 1], model)
+        result = {
+            int(sid): {"label": class_names[c], "confidence": round(float(p), 4)}
+            for sid, c, p in zip(seg_ids, best, confidence)
+        }
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > PREDICTION_CACHE_ENTRIES:
+                self._results.popitem(last=False)
+        return result
@@ -0,0 +1,134 @@
+# backend/pyramid.py
+import os
+import json
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image, features
+
+TILE_FOLDER = "tiles"
+# tile edge in pixels at every level
+TILE_PX = 256
+# "webp" or "jpeg"; WebP falls back to JPEG when Pillow is built without it
+TILE_FORMAT = os.environ.get("TILE_FORMAT", "webp").lower()
+if TILE_FORMAT == "webp" and not features.check("webp"):
+    TILE_FORMAT = "jpeg"
+TILE_QUALITY = 80
+# threads encoding the tiles of a band (Pillow releases the GIL while encoding)
+PYRAMID_THREADS = int(os.environ.get("PYRAMID_THREADS", os.cpu_count() or 1))
+TILE_EXT = {"webp": "webp", "jpeg": "jpg"}
+TILE_MIMETYPE = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+def pyramid_dir(folder, image_id):
+    return os.path.join(folder, image_id)
+
+
+def level_count(height, width, tile=TILE_PX):
+    """Levels from full size down to the first one that fits in one tile."""
+    n = 1
+    while max(height, width) > tile:
+        height, width = -(-height // 2), -(-width // 2)
+        n += 1
+    return n
+
+
+def _halve(block):
+    # 2x2 box filter; an odd last row / column is repeated
+    if block.shape[0] % 2:
+        block = np.concatenate([block, block[-1:]], axis=0)
+    if block.shape[1] % 2:
+        block = np.concatenate([block, block[:, -1:]], axis=1)
+    b = block.astype(np.uint16)
+    return ((b[0::2, 0::2] + b[1::2, 0::2] + b[0::2, 1::2] + b[1::2, 1::2] + 2) >> 2).astype(np.uint8)
+
+
+class _Level:
+    """
+    One pyramid level being written: rows arrive in order, every full band
+    of TILE_PX rows is cut into tiles and passed on, halved, to the next
+    (coarser) level. Only one band per level is ever held.
+    """
+
+    def __init__(self, dest, z, next_level, tile, pool):
+        self.dest = os.path.join(dest, str(z))
+        os.makedirs(self.dest, exist_ok=True)
+        self.next = next_level
+        self.tile = tile
+        self.pool = pool
+        self.row = 0  # tile row of the next band
+        self.buf = []
+        self.rows = 0
+
+    def push(self, block):
+        self.buf.append(block)
+        self.rows += block.shape[0]
+        while self.rows >= self.tile:
+            band = np.concatenate(self.buf, axis=0)
+            self._emit(band[:self.tile])
+            rest = band[self.tile:]
+            self.buf = [rest] if len(rest) else []
+            self.rows = len(rest)
+
+    def flush(self):
+        if self.rows:
+            self._emit(np.concatenate(self.buf, axis=0))
+            self.buf, self.rows = [], 0
+        if self.next is not None:
+            self.next.flush()
+
+    def _save(self, col):
+        x = col * self.tile
+        name = f"{col}_{self.row}.{TILE_EXT[TILE_FORMAT]}"
+        Image.fromarray(self.band[:, x:x + self.tile]).save(
+            os.path.join(self.dest, name), TILE_FORMAT.upper(), quality=TILE_QUALITY)
+
+    def _emit(self, band):
+        self.band = band
+        list(self.pool.map(self._save, range(-(-band.shape[1] // self.tile))))
+        self.band = None
+        self.row += 1
+        if self.next is not None:
+            self.next.push(_halve(band))
+
+
+def build_pyramid(raster, dest, content_hash=None, tile=TILE_PX, progress=None):
+    """
+    Write XYZ-style tiles for an (H, W, 3) raster to dest/<z>/<x>_<y>.<ext>,
+    z = 0 being the single coarsest tile and the last level full size.
+    The raster is read once, TILE_PX rows at a time, and each level is fed
+    from the one below it, so memory stays at about one band per level.
+    info.json is written last; its presence marks a complete pyramid.
+    """
+    h, w = raster.shape[:2]
+    n = level_count(h, w, tile)
+    tmp = f"{dest}.{uuid.uuid4().hex}.tmp"
+    if progress is not None:
+        progress("tiles")
+    with ThreadPoolExecutor(max_workers=PYRAMID_THREADS) as pool:
+        top = None
+        for z in range(n):
+            top = _Level(tmp, z, top, tile, pool)
+        for y0 in range(0, h, tile):
+            top.push(np.asarray(raster[y0:y0 + tile]))
+        top.flush()
+
+    info = {"width": w, "height": h, "tile_size": tile, "levels": n,
+            "format": TILE_FORMAT, "ext": TILE_EXT[TILE_FORMAT], "hash": content_hash}
+    with open(os.path.join(tmp, "info.json"), "w") as fh:
+        json.dump(info, fh)
+    # a rebuild replaces the whole pyramid at once
+    if os.path.isdir(dest):
+        shutil.rmtree(dest)
+    os.replace(tmp, dest)
+    return info
+
+
+def load_info(dest):
+    """Pyramid metadata, or None while it has not been built."""
+    try:
+        with open(os.path.join(dest, "info.json")) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
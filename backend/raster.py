@@ -0,0 +1,173 @@
+# backend/raster.py
+import os
+import uuid
+import numpy as np
+from skimage import io
+import tifffile
+from PIL import Image
+
+# decoded pixels of an upload live next to it in this file
+RASTER_SUFFIX = ".raster.npy"
+# browser previews of TIFF uploads are downsampled to at most this size
+PREVIEW_MAX_SIZE = 4096
+
+
+def raster_path(image_path):
+    return image_path + RASTER_SUFFIX
+
+
+def _to_rgb8(block):
+    # (..., C) block of any band count / integer depth -> (..., 3) uint8
+    if block.ndim == 2:
+        block = block[..., None]
+    if block.shape[-1] == 1:
+        block = np.repeat(block, 3, axis=-1)
+    block = block[..., :3]
+    if block.dtype == np.uint16:
+        block = (block >> 8).astype(np.uint8)
+    elif block.dtype != np.uint8:
+        block = np.clip(block, 0, 255).astype(np.uint8)
+    return block
+
+
+def _write_tiff(src, dest, offset, h, w):
+    """
+    Decode a TIFF one strip/tile at a time into the .npy file `dest`
+    (pixel data starting at `offset`).
+    Tiles are assembled into full-width row bands, and each band is written
+    with pwrite once complete, so at most a few bands are in memory.
+    """
+    fd = os.open(dest, os.O_WRONLY)
+    row_bytes = w * 3
+    bands = {}  # band start row -> [band buffer, bytes still missing]
+    try:
+        with tifffile.TiffFile(src) as tif:
+            page = tif.pages[0]
+            if page.planarconfig != 1:
+                # planar (band-separate) layouts: fall back to a full decode
+                os.pwrite(fd, _to_rgb8(np.moveaxis(page.asarray(), 0, -1)).tobytes(), offset)
+                return
+            for segment, (_, _, y, x, _), _ in page.segments():
+                if segment is None:
+                    continue
+                tile = _to_rgb8(segment[0][:h - y, :w - x])
+                if y not in bands:
+                    bands[y] = [np.zeros((tile.shape[0], w, 3), dtype=np.uint8), tile.shape[0] * row_bytes]
+                band = bands[y]
+                band[0][:, x:x + tile.shape[1]] = tile
+                band[1] -= tile.nbytes
+                if band[1] <= 0:
+                    os.pwrite(fd, band[0].tobytes(), offset + y * row_bytes)
+                    del bands[y]
+        # bands with missing (sparse) tiles stay zero where nothing was decoded
+        for y, (buf, _) in bands.items():
+            os.pwrite(fd, buf.tobytes(), offset + y * row_bytes)
+    finally:
+        os.close(fd)
+
+
+def _tiff_shape(src):
+    with tifffile.TiffFile(src) as tif:
+        page = tif.pages[0]
+        return page.imagelength, page.imagewidth
+
+
+def build_raster(image_path):
+    """
+    Decode an upload once into an (H, W, 3) uint8 .npy file. TIFFs are
+    decoded strip by strip (or tile by tile), so a mosaic never has to
+    fit in memory; other formats are small enough to decode whole.
+    """
+    dest = raster_path(image_path)
+    tmp = f"{dest}.{uuid.uuid4().hex}.tmp.npy"
+    if image_path.lower().endswith((".tif", ".tiff")):
+        h, w = _tiff_shape(image_path)
+        # .npy header, then a sparse file of the right size filled band by band
+        with open(tmp, "wb") as fh:
+            np.lib.format.write_array_header_1_0(
+                fh, {"descr": np.dtype(np.uint8).str, "fortran_order": False, "shape": (h, w, 3)})
+            offset = fh.tell()
+            fh.truncate(offset + h * w * 3)
+        _write_tiff(image_path, tmp, offset, h, w)
+    else:
+        np.save(tmp, _to_rgb8(io.imread(image_path)))
+    os.replace(tmp, dest)
+    return dest
+
+
+class Raster:
+    """
+    Read-only (H, W, 3) uint8 image in an .npy file, read by row window:
+    raster[y0:y1, x0:x1] reads just rows y0:y1 from disk (pread), so only
+    the window asked for is ever in memory. Process pool workers open the
+    same file as an np.memmap (see parallel.share).
+    """
+
+    def __init__(self, path):
+        self.filename = path
+        with open(path, "rb") as fh:
+            if np.lib.format.read_magic(fh) == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(fh)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(fh)
+            self.offset = fh.tell()
+        if fortran:
+            raise ValueError(f"{path}: Fortran-ordered rasters are not supported")
+        self.shape = shape
+        self.dtype = dtype
+        self.ndim = len(shape)
+        self._row_bytes = int(np.prod(shape[1:])) * dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _rows(self, fd, y0, y1):
+        n = max(0, y1 - y0)
+        out = np.empty((n,) + tuple(self.shape[1:]), dtype=self.dtype)
+        view = memoryview(out.reshape(-1).view(np.uint8))
+        start = self.offset + y0 * self._row_bytes
+        done = 0
+        while done < len(view):
+            # a single pread returns at most ~2 GB
+            got = os.preadv(fd, [view[done:]], start + done)
+            if got == 0:
+                raise EOFError(f"{self.filename}: truncated raster")
+            done += got
+        return out
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        rows, rest = key[0], key[1:]
+        fd = os.open(self.filename, os.O_RDONLY)
+        try:
+            if isinstance(rows, slice) and rows.step in (None, 1):
+                y0, y1, _ = rows.indices(self.shape[0])
+                block = self._rows(fd, y0, y1)
+            elif isinstance(rows, slice):
+                # strided rows (previews): index each row as it is read
+                return np.stack([self._rows(fd, y, y + 1)[0][rest] for y in range(*rows.indices(self.shape[0]))])
+            else:
+                y = int(rows) % self.shape[0]
+                return self._rows(fd, y, y + 1)[0][rest]
+        finally:
+            os.close(fd)
+        return block[(slice(None),) + rest]
+
+    def __array__(self, dtype=None, copy=None):
+        block = self[:]
+        return block if dtype is None else block.astype(dtype)
+
+
+def write_preview(raster, dest, max_size=PREVIEW_MAX_SIZE):
+    """PNG of the raster, subsampled (every k-th row/column) to fit max_size."""
+    step = max(1, -(-max(raster.shape[:2]) // max_size))
+    Image.fromarray(raster[::step, ::step]).save(dest)
+
+
+def open_raster(image_path):
+    """Windowed reader over an upload's pixels, decoding it on first use."""
+    path = raster_path(image_path)
+    if not os.path.exists(path):
+        build_raster(image_path)
+    return Raster(path)
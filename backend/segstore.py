@@ -0,0 +1,413 @@
+# backend/segstore.py
+# Usage example (convert the legacy JSON results in place):
+# python segstore.py convert segments/ uploads/
+import os
+import sys
+import json
+import uuid
+import shutil
+import numpy as np
+import cv2
+from helpers import FEATURE_NAMES, NDVI_FEATURE_NAMES, region_adjacency, compute_superpixel_features
+from graph import RegionGraph
+from spatial import GridIndex, GRID_CELL, polygon_bboxes, points_in_polygon, simplify
+from raster import open_raster
+
+STORE_VERSION = 1
+
+
+def store_path(seg_folder, image_id):
+    return os.path.join(seg_folder, image_id)
+
+
+def legacy_json_path(seg_folder, image_id):
+    return os.path.join(seg_folder, f"{image_id}_segments.json")
+
+
+def pack_polygons(polygons):
+    """
+    [{id, polygon: [[x,y],...]}, ...] -> (ids int32 (n,), offsets int64 (n+1,),
+    vertices int32 (V, 2)); polygon k is vertices[offsets[k]:offsets[k+1]].
+    """
+    ids = np.fromiter((p["id"] for p in polygons), dtype=np.int32, count=len(polygons))
+    counts = np.fromiter((len(p["polygon"]) for p in polygons), dtype=np.int64, count=len(polygons))
+    offsets = np.zeros(len(polygons) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    vertices = np.zeros((int(offsets[-1]), 2), dtype=np.int32)
+    for p, start, stop in zip(polygons, offsets[:-1], offsets[1:]):
+        vertices[start:stop] = p["polygon"]
+    return ids, offsets, vertices
+
+
+def write_store(dest, doc, segments=None, feature_matrix=None, labels_file=None, cache_key=None, graph=None,
+                missing_features=()):
+    """
+    Write one segmentation result as a store directory:
+      meta.json     image ids/shape, n_segments, meta, feature columns
+      labels.npy    label raster (uint16 when it fits, else int32)
+      ids.npy, offsets.npy, vertices.npy   flat polygon geometry
+      features.npy  float32 (n_segments, n_features), row i = segment i+1
+      bboxes.npy, grid_offsets.npy, grid_items.npy   polygon bbox grid index
+      graph_offsets.npy, graph_neighbors.npy, graph_distances.npy
+                    superpixel adjacency (graph.RegionGraph), when given
+    doc is the segments document (polygons, meta, ...) as /segment returns it.
+    labels_file: an already written .npy raster to move in instead of
+    saving `segments`. The directory is built aside and swapped in, so
+    readers never see a half-written store and files are never rewritten
+    in place (the cache hard-links them).
+    missing_features: feature columns the matrix only holds zeros for
+    (legacy results without their image); training skips such stores.
+    """
+    parent = os.path.dirname(os.path.abspath(dest))
+    tmp = os.path.join(parent, f".{os.path.basename(dest)}.{uuid.uuid4().hex}")
+    os.makedirs(tmp)
+    ids, offsets, vertices = pack_polygons(doc["polygons"])
+    np.save(os.path.join(tmp, "ids.npy"), ids)
+    np.save(os.path.join(tmp, "offsets.npy"), offsets)
+    np.save(os.path.join(tmp, "vertices.npy"), vertices)
+    height, width = doc["image_shape"][:2]
+    grid = GridIndex.build(polygon_bboxes(offsets, vertices), width, height)
+    np.save(os.path.join(tmp, "bboxes.npy"), grid.bboxes)
+    np.save(os.path.join(tmp, "grid_offsets.npy"), grid.cell_offsets)
+    np.save(os.path.join(tmp, "grid_items.npy"), grid.items)
+    if graph is not None:
+        np.save(os.path.join(tmp, "graph_offsets.npy"), graph.offsets)
+        np.save(os.path.join(tmp, "graph_neighbors.npy"), graph.neighbors)
+        np.save(os.path.join(tmp, "graph_distances.npy"), graph.distances)
+    if feature_matrix is not None:
+        np.save(os.path.join(tmp, "features.npy"), np.asarray(feature_matrix, dtype=np.float32))
+    if labels_file is not None:
+        os.replace(labels_file, os.path.join(tmp, "labels.npy"))
+    elif segments is not None:
+        dtype = np.uint16 if int(segments.max()) < np.iinfo(np.uint16).max else np.int32
+        np.save(os.path.join(tmp, "labels.npy"), segments.astype(dtype, copy=False))
+
+    n_features = None if feature_matrix is None else int(feature_matrix.shape[1])
+    feature_names = FEATURE_NAMES + (NDVI_FEATURE_NAMES if n_features and n_features > len(FEATURE_NAMES) else [])
+    meta = {
+        "version": STORE_VERSION,
+        "image_id": doc["image_id"],
+        "image_filename": doc["image_filename"],
+        "image_shape": doc["image_shape"],
+        "n_segments": doc["n_segments"],
+        "meta": doc["meta"],
+        "feature_names": feature_names,
+        "grid_cell": grid.cell,
+        "cache_key": cache_key,
+        "missing_features": list(missing_features),
+    }
+    with open(os.path.join(tmp, "meta.json"), "w") as fh:
+        json.dump(meta, fh)
+    swap_in(tmp, dest)
+
+
+def swap_in(tmp, dest):
+    """Replace directory dest with tmp (same filesystem)."""
+    old = None
+    if os.path.exists(dest):
+        old = f"{tmp}.old"
+        os.replace(dest, old)
+    os.replace(tmp, dest)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def link_store(src, dest, **meta_updates):
+    """
+    New store at dest sharing src's array files (hard links, copies across
+    filesystems) with meta.json fields overridden by meta_updates.
+    """
+    parent = os.path.dirname(os.path.abspath(dest))
+    os.makedirs(parent, exist_ok=True)
+    tmp = os.path.join(parent, f".{os.path.basename(dest)}.{uuid.uuid4().hex}")
+    os.makedirs(tmp)
+    for name in os.listdir(src):
+        if name == "meta.json":
+            continue
+        try:
+            os.link(os.path.join(src, name), os.path.join(tmp, name))
+        except OSError:
+            shutil.copyfile(os.path.join(src, name), os.path.join(tmp, name))
+    with open(os.path.join(src, "meta.json")) as fh:
+        meta = json.load(fh)
+    meta.update(meta_updates)
+    with open(os.path.join(tmp, "meta.json"), "w") as fh:
+        json.dump(meta, fh)
+    swap_in(tmp, dest)
+
+
+class SegmentStore:
+    """
+    Read side of a store directory. Arrays are memory-mapped on first
+    access; JSON-shaped polygons/features are only built when asked for.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as fh:
+            self.info = json.load(fh)
+        self._arrays = {}
+
+    def _array(self, name):
+        if name not in self._arrays:
+            file = os.path.join(self.path, f"{name}.npy")
+            self._arrays[name] = np.load(file, mmap_mode="r") if os.path.exists(file) else None
+        return self._arrays[name]
+
+    @property
+    def labels(self):
+        return self._array("labels")
+
+    @property
+    def ids(self):
+        return self._array("ids")
+
+    @property
+    def offsets(self):
+        return self._array("offsets")
+
+    @property
+    def vertices(self):
+        return self._array("vertices")
+
+    @property
+    def features(self):
+        return self._array("features")
+
+    def spatial_index(self):
+        """GridIndex over polygon bboxes (built in memory for stores without one)."""
+        if "grid" not in self._arrays:
+            height, width = self.info["image_shape"][:2]
+            bboxes = self._array("bboxes")
+            if bboxes is None:
+                self._arrays["grid"] = GridIndex.build(polygon_bboxes(self.offsets, self.vertices), width, height)
+            else:
+                self._arrays["grid"] = GridIndex(bboxes, self._array("grid_offsets"), self._array("grid_items"),
+                                                 width, height, self.info.get("grid_cell", GRID_CELL))
+        return self._arrays["grid"]
+
+    def _viewport_page(self, x0, y0, x1, y1, page, page_size):
+        hits = self.spatial_index().query(x0, y0, x1, y1)
+        rows = hits[page * page_size:(page + 1) * page_size]
+        more = (page + 1) * page_size < len(hits)
+        return rows, {
+            "image_id": self.info["image_id"],
+            "viewport": [x0, y0, x1, y1],
+            "total": int(len(hits)),
+            "page": page,
+            "page_size": page_size,
+            "next_page": page + 1 if more else None,
+        }
+
+    def graph(self):
+        """
+        RegionGraph of the superpixels (built in memory from the label
+        raster for stores written without one; None without a raster).
+        """
+        if "graph" not in self._arrays:
+            offsets = self._array("graph_offsets")
+            if offsets is not None:
+                graph = RegionGraph(offsets, self._array("graph_neighbors"), self._array("graph_distances"))
+            elif self.labels is not None and self.features is not None:
+                graph = RegionGraph.build(region_adjacency(self.labels, len(self.features) + 1), self.features)
+            else:
+                graph = None
+            self._arrays["graph"] = graph
+        return self._arrays["graph"]
+
+    def viewport(self, x0, y0, x1, y1, page=0, page_size=2000, zoom=1.0):
+        """
+        Polygons (and their features) whose bbox intersects the rectangle,
+        ordered by polygon index and paged. zoom < 1 simplifies outlines.
+        """
+        rows, doc = self._viewport_page(x0, y0, x1, y1, page, page_size)
+        ids = np.asarray(self.ids)
+        offsets = np.asarray(self.offsets)
+        vertices = np.asarray(self.vertices)
+        doc["polygons"] = [
+            {"id": int(ids[k]), "polygon": simplify(vertices[offsets[k]:offsets[k + 1]], zoom).tolist()}
+            for k in rows
+        ]
+        doc["features"] = self.features_dict(ids[rows])
+        return doc
+
+    def viewport_arrays(self, x0, y0, x1, y1, page=0, page_size=2000, zoom=1.0):
+        """
+        viewport() as arrays for wire.encode_geometry: (doc without polygons
+        and features, ids, offsets, vertices, feature rows or None).
+        """
+        rows, doc = self._viewport_page(x0, y0, x1, y1, page, page_size)
+        ids = np.asarray(self.ids)[rows]
+        offsets = np.asarray(self.offsets)
+        vertices = np.asarray(self.vertices)
+        polygons = [simplify(vertices[offsets[k]:offsets[k + 1]], zoom) for k in rows]
+        page_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in polygons], out=page_offsets[1:])
+        page_vertices = np.concatenate(polygons) if polygons else np.zeros((0, 2), dtype=np.int32)
+        X = self.features
+        return doc, ids, page_offsets, page_vertices, None if X is None else X[ids.astype(np.int64) - 1]
+
+    def select(self, rect=None, polygon=None):
+        """
+        Segment ids whose centroid lies inside rect [x0, y0, x1, y1] or
+        inside polygon [[x, y], ...] (image pixels). Candidates come from
+        the grid index over the selection's bbox.
+        """
+        if polygon is not None:
+            pts = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+            x0, y0 = np.floor(pts.min(axis=0))
+            x1, y1 = np.ceil(pts.max(axis=0)) + 1
+        else:
+            x0, y0, x1, y1 = rect
+        rows = self.spatial_index().query(int(x0), int(y0), int(x1), int(y1))
+        seg_ids = np.asarray(self.ids)[rows].astype(np.int64)
+        X = self.features
+        if X is None or len(seg_ids) == 0:
+            return seg_ids
+        names = self.info["feature_names"]
+        centroids = np.asarray(X[seg_ids - 1][:, [names.index("centroid_x"), names.index("centroid_y")]],
+                               dtype=np.float64)
+        if polygon is not None:
+            inside = points_in_polygon(centroids, polygon)
+        else:
+            inside = ((centroids[:, 0] >= x0) & (centroids[:, 0] < x1)
+                      & (centroids[:, 1] >= y0) & (centroids[:, 1] < y1))
+        return seg_ids[inside]
+
+    @property
+    def n_segments(self):
+        return self.info["n_segments"]
+
+    def polygon(self, k):
+        """Vertices (V, 2) of the k-th stored polygon."""
+        return self.vertices[self.offsets[k]:self.offsets[k + 1]]
+
+    def polygons(self, index=None):
+        """Polygons as [{id, polygon: [[x,y],...]}]; index selects a subset."""
+        ids = np.asarray(self.ids)
+        offsets = np.asarray(self.offsets)
+        vertices = np.asarray(self.vertices)
+        rows = range(len(ids)) if index is None else index
+        return [{"id": int(ids[k]), "polygon": vertices[offsets[k]:offsets[k + 1]].tolist()} for k in rows]
+
+    def features_dict(self, seg_ids=None):
+        """The per-segment feature dict of the JSON document, from the matrix."""
+        X = self.features
+        if X is None:
+            return {}
+        names = self.info["feature_names"]
+        if seg_ids is None:
+            seg_ids = np.flatnonzero(np.asarray(X[:, names.index("area")]) > 0) + 1
+        seg_ids = np.asarray(seg_ids, dtype=np.int64)
+        rows = np.asarray(X[seg_ids - 1], dtype=np.float64)
+        with_ndvi = "ndvi_mean" in names
+        features = {}
+        for sid, row in zip(seg_ids, rows):
+            f = {
+                "centroid": [float(row[0]), float(row[1])],
+                "area": int(row[2]),
+                "lab_mean": row[3:6].tolist(),
+                "lab_var": row[6:9].tolist(),
+            }
+            if with_ndvi:
+                f["ndvi"] = row[9:11].tolist()
+            features[int(sid)] = f
+        return features
+
+    def to_dict(self, image_id=None, image_filename=None):
+        """The legacy segments document (what /segment used to store as JSON)."""
+        return {
+            "image_id": image_id or self.info["image_id"],
+            "image_filename": image_filename or self.info["image_filename"],
+            "image_shape": self.info["image_shape"],
+            "n_segments": self.info["n_segments"],
+            "polygons": self.polygons(),
+            "meta": self.info["meta"],
+            "features": self.features_dict(),
+        }
+
+
+def load_store(seg_folder, image_id):
+    path = store_path(seg_folder, image_id)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    return SegmentStore(path)
+
+
+def features_to_matrix(features, n_segments):
+    """Rebuild the float32 feature matrix from a legacy features dict."""
+    with_ndvi = any("ndvi" in f for f in features.values())
+    X = np.zeros((n_segments, len(FEATURE_NAMES) + (2 if with_ndvi else 0)), dtype=np.float32)
+    for sid, f in features.items():
+        row = [*f["centroid"], f["area"], *f["lab_mean"], *f.get("lab_var", [0.0] * 3)]
+        if with_ndvi:
+            row += f.get("ndvi", [0.0, 0.0])
+        X[int(sid) - 1] = row
+    return X
+
+
+def fill_polygons(polygons, shape):
+    """Label raster (int32) with each polygon filled with its id, later ids on top."""
+    segments = np.zeros(shape[:2], dtype=np.int32)
+    for p in sorted(polygons, key=lambda p: p["id"]):
+        if p["polygon"]:
+            cv2.fillPoly(segments, [np.asarray(p["polygon"], dtype=np.int32)], int(p["id"]))
+    return segments
+
+
+def legacy_lab_var(doc, image_path, n_segments):
+    """
+    Lab variance (n_segments, 3) of a legacy result, which never stored it:
+    recomputed from the image with the (simplified) polygons filled back in
+    as the label map. Segments no polygon pixel is left for get the median
+    variance of the rest.
+    """
+    img = np.asarray(open_raster(image_path))
+    segments = fill_polygons(doc["polygons"], img.shape)
+    _, X = compute_superpixel_features(img, segments)
+    lab_var = np.zeros((n_segments, 3), dtype=np.float32)
+    n = min(len(X), n_segments)
+    lab_var[:n] = X[:n, 6:9]
+    filled = np.zeros(n_segments, dtype=bool)
+    filled[:n] = X[:n, 2] > 0
+    if filled.any():
+        lab_var[~filled] = np.median(lab_var[filled], axis=0)
+    return lab_var
+
+
+def convert_legacy(seg_folder, image_id, upload_folder=None):
+    """
+    Turn segments/<image_id>_segments.json into a store (no label raster).
+    Legacy results have no Lab variance; it is recomputed from the upload
+    in upload_folder when that is still there, else the store is marked
+    as missing it (meta missing_features).
+    """
+    with open(legacy_json_path(seg_folder, image_id)) as fh:
+        doc = json.load(fh)
+    n = max([doc["n_segments"]] + [int(k) for k in doc["features"]])
+    X = features_to_matrix(doc["features"], n)
+    missing = []
+    if not all("lab_var" in f for f in doc["features"].values()):
+        image_path = os.path.join(upload_folder, doc["image_filename"]) if upload_folder else None
+        if image_path and os.path.exists(image_path):
+            X[:, 6:9] = legacy_lab_var(doc, image_path, n)
+        else:
+            missing = FEATURE_NAMES[6:9]
+    write_store(store_path(seg_folder, image_id), doc, feature_matrix=X, missing_features=missing)
+
+
+def main():
+    if len(sys.argv) not in (3, 4) or sys.argv[1] != "convert":
+        print("usage: python segstore.py convert <segments folder> [uploads folder]")
+        sys.exit(1)
+    seg_folder = sys.argv[2]
+    upload_folder = sys.argv[3] if len(sys.argv) == 4 else None
+    for name in sorted(os.listdir(seg_folder)):
+        if name.endswith("_segments.json"):
+            image_id = name[:-len("_segments.json")]
+            convert_legacy(seg_folder, image_id, upload_folder)
+            print(f"converted {image_id}")
+
+
+if __name__ == "__main__":
+    main()
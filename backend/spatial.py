@@ -0,0 +1,113 @@
+# backend/spatial.py
+import numpy as np
+import cv2
+
+# grid cell size (image pixels) of the polygon bbox index
+GRID_CELL = 256
+# when zoomed out, polygons are simplified to about this many screen pixels
+SIMPLIFY_SCREEN_PX = 1.0
+
+
+def polygon_bboxes(offsets, vertices):
+    """
+    Inclusive bbox [x0, y0, x1, y1] of every packed polygon, as int32 (n, 4).
+    """
+    n = len(offsets) - 1
+    bboxes = np.zeros((n, 4), dtype=np.int32)
+    if n == 0 or len(vertices) == 0:
+        return bboxes
+    starts = np.asarray(offsets[:-1])
+    nonempty = np.asarray(offsets[1:]) > starts
+    starts = starts[nonempty]
+    bboxes[nonempty, :2] = np.minimum.reduceat(vertices, starts, axis=0)
+    bboxes[nonempty, 2:] = np.maximum.reduceat(vertices, starts, axis=0)
+    return bboxes
+
+
+class GridIndex:
+    """
+    Uniform grid over polygon bounding boxes, stored CSR-style: polygons
+    touching cell c are items[cell_offsets[c]:cell_offsets[c + 1]].
+    """
+
+    def __init__(self, bboxes, cell_offsets, items, width, height, cell=GRID_CELL):
+        self.bboxes = bboxes
+        self.cell_offsets = cell_offsets
+        self.items = items
+        self.width = width
+        self.height = height
+        self.cell = cell
+        self.cols = max(1, -(-width // cell))
+        self.rows = max(1, -(-height // cell))
+
+    @classmethod
+    def build(cls, bboxes, width, height, cell=GRID_CELL):
+        cols = max(1, -(-width // cell))
+        rows = max(1, -(-height // cell))
+        b = np.asarray(bboxes, dtype=np.int64)
+        cx0 = np.clip(b[:, 0] // cell, 0, cols - 1)
+        cy0 = np.clip(b[:, 1] // cell, 0, rows - 1)
+        nx = np.clip(b[:, 2] // cell, 0, cols - 1) - cx0 + 1
+        ny = np.clip(b[:, 3] // cell, 0, rows - 1) - cy0 + 1
+        per_poly = nx * ny
+        # one (polygon, cell) pair per covered cell, without a Python loop
+        poly = np.repeat(np.arange(len(b)), per_poly)
+        k = np.arange(int(per_poly.sum())) - np.repeat(np.cumsum(per_poly) - per_poly, per_poly)
+        nx_rep = np.repeat(nx, per_poly)
+        cell_id = (np.repeat(cy0, per_poly) + k // nx_rep) * cols + np.repeat(cx0, per_poly) + k % nx_rep
+        order = np.argsort(cell_id, kind="stable")
+        items = poly[order].astype(np.int32)
+        cell_offsets = np.zeros(rows * cols + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell_id, minlength=rows * cols), out=cell_offsets[1:])
+        return cls(np.asarray(bboxes, dtype=np.int32), cell_offsets, items, width, height, cell)
+
+    def query(self, x0, y0, x1, y1):
+        """
+        Indices (sorted) of polygons whose bbox intersects the rectangle
+        [x0, x1) x [y0, y1) in image pixels.
+        """
+        if x1 <= x0 or y1 <= y0:
+            return np.zeros(0, dtype=np.int32)
+        c0 = int(np.clip(x0 // self.cell, 0, self.cols - 1))
+        c1 = int(np.clip((x1 - 1) // self.cell, 0, self.cols - 1))
+        r0 = int(np.clip(y0 // self.cell, 0, self.rows - 1))
+        r1 = int(np.clip((y1 - 1) // self.cell, 0, self.rows - 1))
+        parts = []
+        for r in range(r0, r1 + 1):
+            # cells of one grid row are contiguous in the CSR arrays
+            start = self.cell_offsets[r * self.cols + c0]
+            stop = self.cell_offsets[r * self.cols + c1 + 1]
+            parts.append(np.asarray(self.items[start:stop]))
+        candidates = np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int32)
+        b = np.asarray(self.bboxes)[candidates]
+        hit = (b[:, 0] < x1) & (b[:, 2] >= x0) & (b[:, 1] < y1) & (b[:, 3] >= y0)
+        return candidates[hit]
+
+
+def simplify(vertices, zoom):
+    """
+    Drop detail below SIMPLIFY_SCREEN_PX screen pixels at this zoom
+    (screen px per image px). Unchanged at zoom >= 1.
+    """
+    if zoom >= 1 or len(vertices) <= 3:
+        return vertices
+    approx = cv2.approxPolyDP(np.ascontiguousarray(vertices, dtype=np.int32).reshape(-1, 1, 2),
+                              SIMPLIFY_SCREEN_PX / zoom, True).reshape(-1, 2)
+    return approx if len(approx) >= 3 else vertices
+
+
+def points_in_polygon(points, polygon):
+    """
+    Even-odd test of many points (n, 2) against one polygon [[x, y], ...],
+    vectorized over points; returns a bool array (n,).
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    poly = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+    x, y = points[:, 0], points[:, 1]
+    inside = np.zeros(len(points), dtype=bool)
+    for (ax, ay), (bx, by) in zip(poly, np.roll(poly, -1, axis=0)):
+        if ay == by:
+            continue
+        crosses = (ay > y) != (by > y)
+        inside ^= crosses & (x < ax + (y - ay) * (bx - ax) / (by - ay))
+    return inside
@@ -0,0 +1,270 @@
+# backend/tiling.py
+import numpy as np
+from skimage.measure import label as connected_components
+from helpers import compute_superpixels
+
+TILE_SIZE = 2048
+TILE_OVERLAP = 128
+# smallest tile a request may ask for; smaller ones mean a SLIC call per handful of pixels
+MIN_TILE_SIZE = 256
+# rows relabelled per step when finalizing the global label map
+RELABEL_STRIP_ROWS = 1024
+# stitched pieces smaller than this share of the mean superpixel area join a
+# neighbour (SLIC's min_size_factor does the same inside one tile)
+MIN_FRAGMENT_FACTOR = 0.5
+
+
+def tile_grid(length, tile_size, overlap):
+    """
+    Split [0, length) into overlapping windows.
+    Returns list of (start, stop, cut_start, cut_stop): the tile window and
+    the "core" part of it that ends up in the stitched map. Cores tile the
+    axis exactly; each seam sits in the middle of an overlap.
+    """
+    if length <= tile_size:
+        return [(0, length, 0, length)]
+    step = max(tile_size - overlap, 1)
+    starts = list(range(0, length - tile_size, step)) + [length - tile_size]
+    cuts = [0] + [s + (starts[i - 1] + tile_size - s) // 2 for i, s in enumerate(starts) if i > 0] + [length]
+    return [(s, s + tile_size, cuts[i], cuts[i + 1]) for i, s in enumerate(starts)]
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent = np.zeros(1, dtype=np.int64)
+
+    def grow(self, n):
+        old = self.parent.shape[0]
+        if n > old:
+            self.parent = np.concatenate([self.parent, np.arange(old, n, dtype=np.int64)])
+
+    def find(self, a):
+        root = a
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[a] != root:
+            self.parent[a], a = root, self.parent[a]
+        return root
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+    def roots(self):
+        # fully compress so parent[i] is the root of i
+        p = self.parent
+        while True:
+            nxt = p[p]
+            if np.array_equal(nxt, p):
+                return p
+            p = nxt
+
+
+def _match_seam(uf, prev, cur, cut, lo, hi):
+    """
+    prev, cur: global labels from two neighbouring tiles over their shared
+    overlap, seam running along axis 1 at row `cut`; only columns lo:hi
+    of the seam end up in the stitched map. Labels that touch across the
+    cut and are each other's best match in the overlap are the same
+    superpixel split by the seam, so merge them.
+    """
+    if cut <= 0 or cut >= prev.shape[0] or hi <= lo:
+        return
+    touching = set(zip(prev[cut - 1, lo:hi].tolist(), cur[cut, lo:hi].tolist()))
+    # (prev, cur) pairs counted as one int64 key each
+    base = int(cur.max()) + 1
+    keys, counts = np.unique(prev.astype(np.int64).ravel() * base + cur.ravel(), return_counts=True)
+    pairs = np.stack([keys // base, keys % base])
+    # best partner for each label on either side: the first of its group
+    # once sorted by label, then by overlap (largest first)
+    best = []
+    for side in (0, 1):
+        order = np.lexsort((-counts, pairs[side]))
+        labels, first = np.unique(pairs[side, order], return_index=True)
+        best.append(dict(zip(labels.tolist(), pairs[1 - side, order[first]].tolist())))
+    best_for_prev, best_for_cur = best
+    for a, b in touching:
+        if best_for_prev.get(a) == b and best_for_cur.get(b) == a:
+            uf.union(a, b)
+
+
+def _pair_counts(keys_list):
+    """Sum (unique keys, counts) chunks into one."""
+    if not keys_list:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    keys = np.concatenate([k for k, _ in keys_list])
+    counts = np.concatenate([c for _, c in keys_list])
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    return uniq, np.bincount(inverse, weights=counts).astype(np.int64)
+
+
+def split_fragments(out, rows=RELABEL_STRIP_ROWS):
+    """
+    Make every label of a stitched map one 4-connected region of at least
+    MIN_FRAGMENT_FACTOR of the mean superpixel area. Clipping tiles to
+    their cores can leave pieces of a superpixel that no longer touch, or
+    a whole superpixel that is only a sliver along a seam. Every piece
+    below that size joins the neighbour it shares the longest border
+    with; of the larger pieces of a label the largest keeps it and the
+    others get new labels.
+    Works strip by strip in place (out may be a memmap); labels stay 1..n.
+    """
+    h = out.shape[0]
+    n_labels = int(max((int(out[s:s + rows].max()) for s in range(0, h, rows)), default=0))
+    uf = _UnionFind()
+    comp_label = [np.zeros(1, dtype=np.int64)]  # component -> label
+    n_comp = 0
+    prev = None  # last row of the previous strip: (labels, components)
+    for s in range(0, h, rows):
+        strip = np.asarray(out[s:s + rows])
+        comps = connected_components(strip, background=-1, connectivity=1).astype(np.int64)
+        k = int(comps.max())
+        labels = np.zeros(k + 1, dtype=np.int64)
+        labels[comps] = strip
+        comp_label.append(labels[1:])
+        comps[comps > 0] += n_comp
+        uf.grow(n_comp + k + 1)
+        if prev is not None:
+            # a component goes on in the next strip where the label does
+            same = prev[0] == strip[0]
+            base = n_comp + k + 1
+            keys = np.unique(prev[1][same] * base + comps[0][same])
+            for a, b in zip((keys // base).tolist(), (keys % base).tolist()):
+                uf.union(a, b)
+        prev = (strip[-1].copy(), comps[-1].copy())
+        out[s:s + rows] = comps
+        n_comp += k
+    roots = uf.roots()
+    comp_label = np.concatenate(comp_label)
+
+    sizes = np.zeros(n_comp + 1, dtype=np.int64)
+    for s in range(0, h, rows):
+        sizes += np.bincount(roots[out[s:s + rows]].ravel(), minlength=n_comp + 1)
+    # the largest piece of each label keeps it
+    pieces = np.flatnonzero((roots == np.arange(n_comp + 1)) & (sizes > 0))
+    order = pieces[np.lexsort((-sizes[pieces], comp_label[pieces]))]
+    _, first = np.unique(comp_label[order], return_index=True)
+    final = np.zeros(n_comp + 1, dtype=np.int64)
+    final[order[first]] = comp_label[order[first]]
+    fragments = np.setdiff1d(pieces, order[first])
+    min_px = MIN_FRAGMENT_FACTOR * out.shape[0] * out.shape[1] / max(n_labels, 1)
+    small = pieces[sizes[pieces] < min_px]
+
+    if len(fragments) or len(small):
+        is_small = np.zeros(n_comp + 1, dtype=bool)
+        is_small[small] = True
+        # border length between each small piece and its other neighbours
+        found = []
+        last = None
+        for s in range(0, h, rows):
+            r = roots[out[s:s + rows]]
+            block = r if last is None else np.concatenate([last[None], r])
+            for a, b in ((block[:, :-1], block[:, 1:]), (block[:-1], block[1:])):
+                for x, y in ((a, b), (b, a)):
+                    hit = is_small[x] & ~is_small[y]
+                    found.append(np.unique(x[hit] * (n_comp + 1) + y[hit], return_counts=True))
+            last = r[-1]
+        keys, counts = _pair_counts(found)
+        order = np.lexsort((-counts, keys // (n_comp + 1)))
+        owners, first = np.unique(keys[order] // (n_comp + 1), return_index=True)
+        neighbour = keys[order][first] % (n_comp + 1)
+
+        # large pieces, and small ones enclosed by small ones; the largest
+        # piece of a label already has it
+        kept = np.setdiff1d(fragments, owners)
+        final[kept] = n_labels + 1 + np.arange(len(kept))
+        final[owners] = final[neighbour]
+
+    # labels whose every piece joined a neighbour are gone: renumber 1..n
+    used = np.unique(final[pieces])
+    renumber = np.zeros(int(used.max(initial=0)) + 1, dtype=np.int64)
+    renumber[used] = np.arange(1, len(used) + 1)
+    lut = renumber[final][roots]
+    for s in range(0, h, rows):
+        out[s:s + rows] = lut[out[s:s + rows]]
+    return out
+
+
+def serial_map_tiles(img, tasks, compactness):
+    """
+    Default tile mapper: SLIC each (y0, y1, x0, x1, n_segments) task in
+    order, in this process. parallel.tile_mapper is the process-pool one.
+    """
+    for y0, y1, x0, x1, n_tile in tasks:
+        yield compute_superpixels(np.asarray(img[y0:y1, x0:x1]), n_segments=n_tile, compactness=compactness)
+
+
+def tiled_superpixels(img, n_segments=800, compactness=10.0,
+                      tile_size=TILE_SIZE, overlap=TILE_OVERLAP, out=None,
+                      map_tiles=serial_map_tiles):
+    """
+    SLIC over overlapping tiles, stitched into one global label space.
+    img: (H, W, C) array; anything sliceable works (np.memmap, lazy reader).
+    out: optional (H, W) int32 array to write labels into (e.g. an
+         np.memmap), so the full label map never has to live in RAM.
+    map_tiles: callable(img, tasks, compactness) yielding each task's local
+         labels in task order; lets tiles be segmented in other processes.
+    n_segments is the target for the whole image, spread by tile area.
+    Returns the label map, labels start at 1, are consecutive and each
+    one is a single connected region (see split_fragments).
+
+    Only the tiles in flight, plus one overlap-wide strip per seam, are
+    held in memory at a time.
+    """
+    h, w = img.shape[:2]
+    overlap = max(0, min(int(overlap), tile_size // 2))
+    if out is None:
+        out = np.zeros((h, w), dtype=np.int32)
+
+    rows = tile_grid(h, tile_size, overlap)
+    cols = tile_grid(w, tile_size, overlap)
+    tasks = [
+        (y0, y1, x0, x1, max(1, int(round(n_segments * (y1 - y0) * (x1 - x0) / float(h * w)))))
+        for (y0, y1, _, _) in rows for (x0, x1, _, _) in cols
+    ]
+    results = iter(map_tiles(img, tasks, compactness))
+    uf = _UnionFind()
+    next_label = 1
+    above = {}  # column index -> (y0, labels of the tile above where it overlaps this row)
+
+    for i, (y0, y1, cy0, cy1) in enumerate(rows):
+        next_y0 = rows[i + 1][0] if i + 1 < len(rows) else y1
+        left = None  # (x0, labels of the tile to the left where it overlaps this one)
+        below = {}
+        for j, (x0, x1, cx0, cx1) in enumerate(cols):
+            next_x0 = cols[j + 1][0] if j + 1 < len(cols) else x1
+            local = next(results)
+            n_local = int(local.max())
+            local = local.astype(np.int64) + (next_label - 1)
+            next_label += n_local
+            uf.grow(next_label)
+
+            # merge superpixels split by the seams with the tiles above and left
+            if j in above:
+                prev_y0, strip = above[j]
+                _match_seam(uf, strip, local[prev_y0 - y0:prev_y0 - y0 + strip.shape[0]],
+                            cy0 - prev_y0, cx0 - x0, cx1 - x0)
+            if left is not None:
+                prev_x0, strip = left
+                _match_seam(uf, strip.T, local[:, prev_x0 - x0:prev_x0 - x0 + strip.shape[1]].T,
+                            cx0 - prev_x0, cy0 - y0, cy1 - y0)
+
+            out[cy0:cy1, cx0:cx1] = local[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+            # copies: a view would keep the whole tile alive with the strip
+            below[j] = (next_y0, local[next_y0 - y0:].astype(np.int32))
+            left = (next_x0, local[:, next_x0 - x0:].astype(np.int32))
+        above = below
+
+    # collapse merged labels, then renumber the survivors 1..n
+    roots = uf.roots()
+    present = np.zeros(next_label, dtype=bool)
+    for s in range(0, h, RELABEL_STRIP_ROWS):
+        present[roots[np.unique(out[s:s + RELABEL_STRIP_ROWS])]] = True
+    present[0] = False
+    renumber = np.zeros(next_label, dtype=np.int32)
+    renumber[present] = np.arange(1, int(present.sum()) + 1, dtype=np.int32)
+    lut = renumber[roots]
+    for s in range(0, h, RELABEL_STRIP_ROWS):
+        out[s:s + RELABEL_STRIP_ROWS] = lut[out[s:s + RELABEL_STRIP_ROWS]]
+    return split_fragments(out)
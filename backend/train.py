@@ -1,8 +1,11 @@
 # train.py
 # Usage example:
 # python train.py --images_dir ./images --masks_dir ./masks --out model_rf.joblib
+# (per-image datasets are cached in .dataset_cache/; retraining skips segmentation)
 
 import os
+import json
+import hashlib
 import argparse
 import numpy as np
 from joblib import dump
@@ -10,7 +13,13 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 from tqdm import tqdm
 from PIL import Image
-from orthoviewer.backend.helpers import compute_superpixels, extract_features_for_labels
+from helpers import compute_superpixels, compute_superpixel_features, FEATURE_NAMES, FEATURE_STRIP_ROWS
+from parallel import get_executor
+from cache import file_sha256
+from export import DEFAULT_CLASSES, MASK_NODATA
+
+# per-image (features, labels) matrices, keyed by image/mask content + params
+DATASET_CACHE = ".dataset_cache"
 
 def load_image(path):
     img = Image.open(path).convert("RGB")
@@ -18,53 +27,113 @@ def load_image(path):
 
 def load_mask(path):
     """
-    Expect label mask where pixel values are {0,1,2} representing classes.
+    Expect label mask where pixel values are class indices 0..n_classes-1
+    (MASK_NODATA where unlabeled, as export.py writes them).
     Masks must align exactly with orthomosaic.
     """
     m = Image.open(path)
     return np.array(m)
 
-def build_dataset(images_dir, masks_dir, n_segments=2000, compactness=10):
-    X_list = []
-    y_list = []
-    file_pairs = []
-    for fname in os.listdir(images_dir):
+def superpixel_majority(labels_map, mask, n_classes, n_superpixels, nodata=None):
+    """
+    Majority class of every superpixel 1..n_superpixels from a class mask,
+    counted with one np.bincount over label * n_classes + class (in row
+    strips, to bound the temporaries). Mask values outside
+    [0, n_classes) and nodata are ignored.
+    Returns (classes (n_superpixels,), has_votes bool (n_superpixels,)).
+    """
+    size = (n_superpixels + 1) * n_classes
+    counts = np.zeros(size, dtype=np.int64)
+    for y0 in range(0, labels_map.shape[0], FEATURE_STRIP_ROWS):
+        sp = labels_map[y0:y0 + FEATURE_STRIP_ROWS].reshape(-1).astype(np.int64)
+        cls = mask[y0:y0 + FEATURE_STRIP_ROWS].reshape(-1).astype(np.int64)
+        keep = (cls >= 0) & (cls < n_classes)
+        if nodata is not None:
+            keep &= cls != nodata
+        counts += np.bincount(sp[keep] * n_classes + cls[keep], minlength=size)
+    counts = counts.reshape(n_superpixels + 1, n_classes)[1:]
+    return counts.argmax(axis=1), counts.sum(axis=1) > 0
+
+def dataset_key(img_path, mask_path, n_segments, compactness, n_classes, nodata):
+    blob = json.dumps([file_sha256(img_path), file_sha256(mask_path), n_segments,
+                       float(compactness), n_classes, nodata, FEATURE_NAMES])
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+def image_dataset(img_path, mask_path, n_segments, compactness, n_classes=None, nodata=MASK_NODATA,
+                  cache_dir=DATASET_CACHE):
+    """
+    Features and majority-vote labels of one image/mask pair, read from
+    cache_dir when this pair was already segmented with the same params.
+    n_classes=None takes the mask's largest value other than nodata + 1;
+    nodata pixels (unlabeled) do not vote.
+    Returns (X, y), or a string saying why the pair was skipped.
+    """
+    cache_file = None
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, dataset_key(img_path, mask_path, n_segments, compactness, n_classes,
+                                                          nodata) + ".npz")
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as cached:
+                return cached["X"], cached["y"]
+
+    img = load_image(img_path)
+    mask = load_mask(mask_path)
+    if img.shape[:2] != mask.shape[:2]:
+        return "shape mismatch between image and mask"
+    if mask.ndim == 3:
+        mask = mask[..., 0]
+
+    labeled = mask != nodata if nodata is not None else np.ones(mask.shape, dtype=bool)
+    if not labeled.any():
+        return "mask has no labeled pixels"
+
+    labels_map = compute_superpixels(img, n_segments=n_segments, compactness=compactness)
+    # same feature matrix /segment produces; row i is superpixel i+1
+    _, features = compute_superpixel_features(img, labels_map)
+    if n_classes is None:
+        n_classes = int(mask[labeled].max()) + 1
+    sp_labels, valid = superpixel_majority(labels_map, mask, n_classes, features.shape[0], nodata)
+    X, y = features[valid], sp_labels[valid]
+
+    if cache_file:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{cache_file}.{os.getpid()}.tmp.npz"
+        np.savez(tmp, X=X, y=y)
+        os.replace(tmp, cache_file)
+    return X, y
+
+def build_dataset(images_dir, masks_dir, n_segments=2000, compactness=10, n_classes=None, nodata=MASK_NODATA,
+                  workers=None, cache_dir=DATASET_CACHE):
+    """
+    Stack per-image datasets of every image in images_dir that has a mask
+    of the same name in masks_dir. Pairs are processed on a process pool
+    (workers=1 runs them in-process).
+    """
+    pairs = []
+    for fname in sorted(os.listdir(images_dir)):
         img_path = os.path.join(images_dir, fname)
         mask_path = os.path.join(masks_dir, fname)  # assume same filename for mask
         if not os.path.exists(mask_path):
             print(f"Skipping {fname}: no mask at {mask_path}")
             continue
-        img = load_image(img_path)
-        mask = load_mask(mask_path)
-        if img.shape[:2] != mask.shape[:2]:
-            print(f"Skipping {fname}: shape mismatch between image and mask")
-            continue
+        pairs.append((fname, img_path, mask_path))
 
-        labels_map = compute_superpixels(img, n_segments=n_segments, compactness=compactness)
-        features, sp_ids = extract_features_for_labels(img, labels_map)
-
-        # build label per superpixel as majority vote from mask
-        # flatten
-        flat_sp = labels_map.reshape(-1)
-        flat_mask = mask.reshape(-1)
-        num_sp = sp_ids.max() + 1
-        counts = np.zeros((num_sp, 3), dtype=np.int32)  # assuming 3 classes
-        for i in range(flat_sp.shape[0]):
-            l = flat_sp[i]
-            lab = int(flat_mask[i])
-            if lab < 0 or lab > 2:
-                continue
-            counts[l, lab] += 1
-        # majority
-        sp_labels = counts.argmax(axis=1)
-        # filter empty superpixels (if any have count 0)
-        valid = (counts.sum(axis=1) > 0)
-        features_valid = features[valid]
-        labels_valid = sp_labels[valid]
-
-        X_list.append(features_valid)
-        y_list.append(labels_valid)
-        file_pairs.append((img_path, mask_path))
+    args = (n_segments, compactness, n_classes, nodata, cache_dir)
+    executor = get_executor(workers)
+    if executor is None:
+        results = (image_dataset(img_path, mask_path, *args) for _, img_path, mask_path in pairs)
+    else:
+        results = executor.map(image_dataset, [p[1] for p in pairs], [p[2] for p in pairs],
+                               *[[a] * len(pairs) for a in args])
+
+    X_list = []
+    y_list = []
+    for result, (fname, _, _) in zip(tqdm(results, total=len(pairs)), pairs):
+        if isinstance(result, str):
+            print(f"Skipping {fname}: {result}")
+            continue
+        X_list.append(result[0])
+        y_list.append(result[1])
 
     if len(X_list) == 0:
         raise ValueError("No training data found. Check paths and masks.")
@@ -80,13 +149,35 @@ def main():
     p.add_argument("--out", default="model_rf.joblib")
     p.add_argument("--n_segments", type=int, default=2000)
     p.add_argument("--compactness", type=float, default=10.0)
+    p.add_argument("--n_classes", type=int, default=None, help="default: largest mask value other than --nodata + 1")
+    p.add_argument("--nodata", type=int, default=MASK_NODATA, help="mask value of unlabeled pixels (-1: none)")
+    p.add_argument("--class_names", default=None,
+                   help="annotator label of mask value 0, 1, ... (used for suggestions; "
+                        "an export bundle lists them in metadata.json). "
+                        f"Default: {','.join(DEFAULT_CLASSES)}, required for any other number of classes")
     p.add_argument("--test_size", type=float, default=0.2)
+    p.add_argument("--workers", type=int, default=None, help="dataset builder processes (default: SEGMENT_WORKERS)")
+    p.add_argument("--cache_dir", default=DATASET_CACHE, help="per-image dataset cache ('' disables it)")
     args = p.parse_args()
+    nodata = args.nodata if args.nodata >= 0 else None
+    class_names = args.class_names.split(",") if args.class_names else None
+    if args.n_classes is not None and class_names is None and args.n_classes != len(DEFAULT_CLASSES):
+        p.error(f"--class_names is required with --n_classes {args.n_classes}")
 
     print("Building dataset...")
-    X, y = build_dataset(args.images_dir, args.masks_dir, n_segments=args.n_segments, compactness=args.compactness)
+    X, y = build_dataset(args.images_dir, args.masks_dir, n_segments=args.n_segments, compactness=args.compactness,
+                         n_classes=args.n_classes, nodata=nodata, workers=args.workers, cache_dir=args.cache_dir)
     print(f"Dataset size: X={X.shape}, y={y.shape}")
 
+    # mask values the model can predict, so every one of them needs a name
+    n_classes = args.n_classes or int(y.max()) + 1
+    if class_names is None:
+        if n_classes != len(DEFAULT_CLASSES):
+            p.error(f"the masks have {n_classes} classes; name them with --class_names")
+        class_names = list(DEFAULT_CLASSES)
+    elif len(class_names) < n_classes:
+        p.error(f"--class_names names {len(class_names)} classes, the masks have {n_classes}")
+
     X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=args.test_size, random_state=42, stratify=y)
     print("Training RandomForest...")
     clf = RandomForestClassifier(n_estimators=200, n_jobs=-1, random_state=42)
@@ -95,6 +186,8 @@ def main():
     acc = clf.score(X_val, y_val)
     print(f"Validation accuracy: {acc:.4f}")
 
+    # the app names its suggestions with these; saved uncompressed so it can be memory-mapped
+    clf.class_names = class_names
     dump(clf, args.out)
     print(f"Model saved to {args.out}")
 
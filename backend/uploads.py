@@ -0,0 +1,124 @@
+# backend/uploads.py
+import os
+import json
+import uuid
+import fcntl
+
+# chunk size suggested to clients
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+# request bodies are copied to disk in blocks of this size
+COPY_BLOCK_BYTES = 1024 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class ChunkedUploads:
+    """
+    Resumable uploads: the client declares the total size, then sends the
+    bytes in any number of PUTs, each starting at the current offset. Data
+    is streamed straight into folder/.partial/<upload_id>.part, so neither
+    the request nor the file is ever held in memory; after a dropped
+    connection the client asks for the offset and continues from there.
+    Finishing happens once per upload (see finish); the record it leaves
+    answers retries of the last PUT.
+    """
+
+    def __init__(self, folder):
+        self.folder = os.path.join(folder, ".partial")
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _paths(self, upload_id):
+        base = os.path.join(self.folder, upload_id)
+        return base + ".part", base + ".json"
+
+    def create(self, filename, size):
+        upload_id = uuid.uuid4().hex
+        part, meta = self._paths(upload_id)
+        open(part, "wb").close()
+        with open(meta, "w") as fh:
+            json.dump({"filename": filename, "size": size}, fh)
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        """
+        {upload_id, filename, size, offset} or None for an unknown id; a
+        finished upload also has `finished`, the record finish() kept.
+        """
+        if not all(c in "0123456789abcdef" for c in upload_id):
+            return None
+        part, meta = self._paths(upload_id)
+        try:
+            with open(meta) as fh:
+                info = json.load(fh)
+                if "finished" not in info and not os.path.exists(part):
+                    # being finished: wait for finish() to write its record
+                    fcntl.flock(fh, fcntl.LOCK_SH)
+                    fh.seek(0)
+                    info = json.load(fh)
+            offset = info["size"] if "finished" in info else os.path.getsize(part)
+        except FileNotFoundError:
+            return None
+        return dict(info, upload_id=upload_id, offset=offset)
+
+    def write(self, upload_id, offset, stream, length):
+        """
+        Append `length` bytes read from `stream` at `offset`, which must be
+        the current end of the upload. Returns the new status.
+        """
+        info = self.status(upload_id)
+        if info is None:
+            raise UploadError("upload not found", 404)
+        part, _ = self._paths(upload_id)
+        try:
+            fh = open(part, "r+b")
+        except FileNotFoundError:
+            # finished meanwhile by a retry of the last chunk
+            info = self.status(upload_id)
+            if info is None or "finished" not in info:
+                raise UploadError("upload not found", 404)
+            return info
+        with fh:
+            # one writer per upload; a concurrent retry waits, then sees the new offset
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            current = os.fstat(fh.fileno()).st_size
+            if offset + length == current == info["size"]:
+                # a retry of the last chunk, already written
+                return self.status(upload_id)
+            if offset != current:
+                raise UploadError("offset mismatch", 409, offset=current)
+            if current + length > info["size"]:
+                raise UploadError("chunk runs past the declared size", 400, offset=current)
+            fh.seek(current)
+            remaining = length
+            while remaining > 0:
+                block = stream.read(min(COPY_BLOCK_BYTES, remaining))
+                if not block:
+                    break
+                fh.write(block)
+                remaining -= len(block)
+            fh.flush()
+        return self.status(upload_id)
+
+    def finish(self, upload_id, complete):
+        """
+        Hand a complete upload over, once: complete(part_path, info) moves
+        the file away and returns a JSON-able record, kept as the upload's
+        `finished`. Concurrent and later calls (a retried last PUT) wait for
+        the first one and get its record. Returns (record, created).
+        """
+        _, meta = self._paths(upload_id)
+        with open(meta, "r+") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            info = json.load(fh)
+            if "finished" in info:
+                return info["finished"], False
+            info["finished"] = complete(self._paths(upload_id)[0], info)
+            fh.seek(0)
+            fh.truncate()
+            json.dump(info, fh)
+            return info["finished"], True
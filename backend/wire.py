@@ -0,0 +1,125 @@
+# backend/wire.py
+import os
+import gzip
+import json
+import struct
+import numpy as np
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+# compact polygon geometry (?format=binary on the segments endpoints):
+#   magic | header length (uint32) | header JSON | arrays
+# the header JSON is padded to 4 bytes and the arrays follow, each
+# little-endian and 4-byte aligned, so a browser can view them in place as
+# typed arrays. The header lists each array as name -> [dtype, byte offset
+# from the end of the header, item count] next to the non-geometry fields
+# of the JSON document.
+WIRE_MAGIC = b"OVG1"
+WIRE_MIMETYPE = "application/vnd.orthoviewer.geometry"
+# responses smaller than this are sent as they are
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 6))
+COMPRESS_MIMETYPES = ("application/json", WIRE_MIMETYPE, "text/plain")
+INT16 = np.iinfo(np.int16)
+
+
+def _pad(n):
+    return -n % 4
+
+
+def encode_geometry(ids, offsets, vertices, header=None, features=None, feature_names=None):
+    """
+    Polygons (ids, offsets, vertices as in a segstore) as one bytes buffer.
+    Each polygon keeps its first vertex absolute (int32 "starts"); the
+    rest are (dx, dy) steps from the previous vertex ("deltas", int16, or
+    int32 when a step does not fit). Outlines are simplified
+    (approxPolyDP), so steps run from a few pixels to a few tens (longer
+    along the image border); int16 keeps each at half the size of absolute
+    int32 vertices. features: optional float32 rows, one per polygon.
+    """
+    ids = np.asarray(ids, dtype="<i4")
+    offsets = np.asarray(offsets, dtype=np.int64)
+    vertices = np.asarray(vertices, dtype=np.int64).reshape(-1, 2)
+    counts = np.diff(offsets)
+    n = len(ids)
+
+    first = offsets[:-1][counts > 0]
+    starts = np.zeros((n, 2), dtype="<i4")
+    starts[counts > 0] = vertices[first]
+    steps = np.diff(vertices, axis=0)
+    keep = np.ones(len(vertices), dtype=bool)
+    keep[first] = False
+    deltas = steps[keep[1:]] if len(vertices) else steps
+    wide = len(deltas) and (deltas.min() < INT16.min or deltas.max() > INT16.max)
+    deltas = deltas.astype("<i4" if wide else "<i2")
+
+    arrays = [("ids", ids), ("counts", counts.astype("<u4")), ("starts", starts), ("deltas", deltas)]
+    if features is not None:
+        arrays.append(("features", np.asarray(features, dtype="<f4").reshape(n, -1)))
+    head = dict(header or {}, n=n, n_vertices=len(vertices))
+    if feature_names is not None:
+        head["feature_names"] = list(feature_names)
+
+    layout = {}
+    pos = 0
+    for name, a in arrays:
+        layout[name] = [a.dtype.str, pos, int(a.size)]
+        pos += a.nbytes + _pad(a.nbytes)
+    text = json.dumps(dict(head, arrays=layout)).encode()
+    parts = [WIRE_MAGIC, struct.pack("<I", len(text)), text, b"\0" * _pad(len(text))]
+    for _, a in arrays:
+        data = np.ascontiguousarray(a).tobytes()
+        parts += [data, b"\0" * _pad(len(data))]
+    return b"".join(parts)
+
+
+def decode_geometry(buf):
+    """
+    Inverse of encode_geometry: (header, ids, offsets, vertices, features).
+    Vertices come back int32 (V, 2); features is None when not sent.
+    """
+    if buf[:4] != WIRE_MAGIC:
+        raise ValueError("not an encoded geometry buffer")
+    (size,) = struct.unpack_from("<I", buf, 4)
+    header = json.loads(bytes(buf[8:8 + size]))
+    base = 8 + size + _pad(size)
+    arrays = {name: np.frombuffer(buf, dtype=np.dtype(dtype), count=count, offset=base + offset)
+              for name, (dtype, offset, count) in header.pop("arrays").items()}
+    n = header["n"]
+    counts = arrays["counts"].astype(np.int64)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    # steps with a zero at each polygon start; a running sum then gives
+    # every vertex relative to its polygon's first one
+    steps = np.zeros((int(offsets[-1]), 2), dtype=np.int64)
+    first = offsets[:-1][counts > 0]
+    rest = np.ones(len(steps), dtype=bool)
+    rest[first] = False
+    steps[rest] = arrays["deltas"].reshape(-1, 2)
+    run = np.cumsum(steps, axis=0)
+    owner = np.repeat(np.arange(n), counts)
+    starts = arrays["starts"].reshape(n, 2)
+    vertices = (starts[owner] + run - run[offsets[:-1][owner]]).astype(np.int32)
+    features = arrays.get("features")
+    if features is not None:
+        features = features.reshape(n, -1)
+    return header, arrays["ids"], offsets, vertices, features
+
+
+def accepted_encoding(accept_encodings):
+    """'br' or 'gzip' out of a request's Accept-Encoding, or None."""
+    if brotli is not None and accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=min(COMPRESS_LEVEL, 11))
+    return gzip.compress(data, compresslevel=COMPRESS_LEVEL, mtime=0)
@@ -3,6 +3,57 @@ import axios from "axios";
 import SuperpixelAnnotator from "./SuperpixelAnnotator";
 import "./App.css";
 
+// POST /segment (and the last upload chunk) queue a job; poll it until
+// the result is ready
+async function waitForJob(job) {
+  for (;;) {
+    const res = await axios.get(`http://127.0.0.1:5000${job.status_url}`);
+    if (res.data.status === "done") break;
+    if (res.data.status === "failed") throw new Error(res.data.error);
+    await new Promise((r) => setTimeout(r, 1000));
+  }
+  // polygons are paged in per viewport by the annotator
+  const result = await axios.get(`http://127.0.0.1:5000${job.result_url}?polygons=0`);
+  return result.data;
+}
+
+// TIFF uploads are shown through their PNG preview
+function previewFilename(filename) {
+  return /\.tiff?$/i.test(filename) ? `${filename}.png` : filename;
+}
+
+// resumable upload: the file goes up in chunks; after a failed chunk,
+// ask the server how much it has and continue from there. The last chunk
+// returns a job that decodes the file and writes its preview.
+const CHUNK_RETRIES = 3;
+
+async function uploadChunked(file) {
+  const start = await axios.post("http://127.0.0.1:5000/upload/chunked", {
+    filename: file.name,
+    size: file.size
+  });
+  const { upload_id, chunk_size } = start.data;
+  const url = `http://127.0.0.1:5000/upload/chunked/${upload_id}`;
+  let offset = 0;
+  let retries = 0;
+  for (;;) {
+    try {
+      const res = await axios.put(
+        `${url}?offset=${offset}`,
+        file.slice(offset, offset + chunk_size),
+        { headers: { "Content-Type": "application/octet-stream" } }
+      );
+      if (res.data.done) return res.data;
+      offset = res.data.offset;
+      retries = 0;
+    } catch (err) {
+      if (++retries > CHUNK_RETRIES) throw err;
+      const status = await axios.get(url);
+      offset = status.data.offset;
+    }
+  }
+}
+
 export default function App() {
   const [file, setFile] = useState(null);
   const [segmentsMeta, setSegmentsMeta] = useState(null);
@@ -18,25 +69,20 @@ export default function App() {
   async function upload() {
     if (!file) return alert("Please select a file");
 
-    const fd = new FormData();
-    fd.append("image", file);
-
     // 1. UPLOAD TO BACKEND
-    const res = await axios.post(
-      "http://127.0.0.1:5000/upload",
-      fd,
-      { headers: { "Content-Type": "multipart/form-data" } }
-    );
+    const uploaded = await waitForJob(await uploadChunked(file));
 
-    const savedFilename = res.data.filename;
-    const imageID = res.data.image_id;
+    const savedFilename = uploaded.filename;
+    const imageID = uploaded.image_id;
 
     // Image served from backend URL
-    setImageUrl(`http://127.0.0.1:5000/uploads/${savedFilename}`);
+    setImageUrl(`http://127.0.0.1:5000/uploads/${uploaded.preview}`);
 
     // 2. RUN SEGMENTATION
+    // polygons=0: a cached result comes back as the same summary the job
+    // result gives; the annotator pages polygons in per viewport
     const segRes = await axios.post(
-      "http://127.0.0.1:5000/segment",
+      "http://127.0.0.1:5000/segment?polygons=0",
       {
         image_filename: savedFilename,
         n_segments: nSegments,
@@ -44,16 +90,23 @@ export default function App() {
       }
     );
 
-    setSegmentsMeta(segRes.data);
+    // 200: cached result right away, 202: a job to wait for
+    setSegmentsMeta(
+      segRes.status === 200 ? segRes.data : await waitForJob(segRes.data)
+    );
   }
 
   async function loadSegmentsById(image_id) {
-    const res = await axios.get(`http://127.0.0.1:5000/segments/${image_id}`);
+    const res = await axios.get(
+      `http://127.0.0.1:5000/segments/${image_id}?polygons=0`
+    );
 
     setSegmentsMeta(res.data);
 
     // Load image preview
-    setImageUrl(`http://127.0.0.1:5000/uploads/${res.data.image_filename}`);
+    setImageUrl(
+      `http://127.0.0.1:5000/uploads/${previewFilename(res.data.image_filename)}`
+    );
   }
 
   async function handleLoad() {
@@ -1,10 +1,14 @@
 import React, { useRef, useState, useEffect } from "react";
 import axios from "axios";
+import { decodeGeometry } from "./wire";
 
 /*
  Props:
-  - imageUrl: "http://127.0.0.1:5000/uploads/<filename>"
-  - segmentsMeta: object returned by /segment (polygons, features, image_shape)
+  - imageUrl: "http://127.0.0.1:5000/uploads/<filename>", shown only if
+    the tile pyramid (/tiles/<image_id>) is unavailable
+  - segmentsMeta: object returned by /segment (image_id, image_shape,
+    model suggestions if a model is loaded); polygons are fetched per
+    visible region from /segments/<id>/viewport (packed, see wire.js)
 */
 
 const LABEL_COLORS = {
@@ -13,52 +17,341 @@ const LABEL_COLORS = {
   bad: "rgba(255, 99, 99, 0.45)"
 };
 
+// suggestions at or above this confidence are taken by "Accept suggestions"
+const ACCEPT_CONFIDENCE = 0.8;
+
+const MAX_ZOOM = 32;
+
+// how often labels saved by others are fetched (only the changes)
+const LABEL_POLL_MS = 5000;
+
+// polygons are kept while their bounding box is within this share of the
+// visible region's size around it; the rest are dropped on the next load
+const VIEW_MARGIN = 0.5;
+
+// [x0, y0, x1, y1] of a polygon's vertices
+function polygonBounds(polygon) {
+  let x0 = Infinity;
+  let y0 = Infinity;
+  let x1 = -Infinity;
+  let y1 = -Infinity;
+  polygon.forEach(([x, y]) => {
+    x0 = Math.min(x0, x);
+    y0 = Math.min(y0, y);
+    x1 = Math.max(x1, x);
+    y1 = Math.max(y1, y);
+  });
+  return [x0, y0, x1, y1];
+}
+
+// the polygons whose bounds meet region grown by VIEW_MARGIN on every side
+function polygonsNear(polygons, region) {
+  const mx = (region.x1 - region.x0) * VIEW_MARGIN;
+  const my = (region.y1 - region.y0) * VIEW_MARGIN;
+  const kept = {};
+  Object.values(polygons).forEach((p) => {
+    const [x0, y0, x1, y1] = p.bounds;
+    if (x1 >= region.x0 - mx && x0 <= region.x1 + mx && y1 >= region.y0 - my && y0 <= region.y1 + my)
+      kept[p.id] = p;
+  });
+  return kept;
+}
+
+// image pixels covered by one tile of level z
+function tileSpan(info, z) {
+  return info.tile_size * 2 ** (info.levels - 1 - z);
+}
+
+// the coarsest level that still has a pixel per screen pixel
+function tileLevel(info, scale) {
+  const k = Math.floor(Math.log2(1 / (scale * window.devicePixelRatio)));
+  return info.levels - 1 - Math.min(Math.max(k, 0), info.levels - 1);
+}
+
+// tiles of level z meeting the visible region, positioned in % of the image
+function visibleTiles(info, z, view) {
+  const span = tileSpan(info, z);
+  const tiles = [];
+  const cols = Math.ceil(info.width / span);
+  const rows = Math.ceil(info.height / span);
+  const lastCol = Math.min(Math.floor((view.x1 - 1) / span), cols - 1);
+  const lastRow = Math.min(Math.floor((view.y1 - 1) / span), rows - 1);
+  for (let y = Math.floor(view.y0 / span); y <= lastRow; y++) {
+    for (let x = Math.floor(view.x0 / span); x <= lastCol; x++) {
+      tiles.push({
+        z,
+        x,
+        y,
+        left: ((x * span) / info.width) * 100,
+        top: ((y * span) / info.height) * 100,
+        width: (Math.min(span, info.width - x * span) / info.width) * 100,
+        height: (Math.min(span, info.height - y * span) / info.height) * 100
+      });
+    }
+  }
+  return tiles;
+}
+
 export default function SuperpixelAnnotator({ imageUrl, segmentsMeta }) {
   const svgRef = useRef(null);
-  const imgRef = useRef(null);
+  const frameRef = useRef(null);
+  const scrollRef = useRef(null);
 
   const [labels, setLabels] = useState({});
   const [hoverId, setHoverId] = useState(null);
-  const [imageSize, setImageSize] = useState([0, 0]);
+  const [polygons, setPolygons] = useState({});
+  const viewportTimer = useRef(null);
+  const viewportSeq = useRef(0);
+  const pendingLabels = useRef([]);
+  const labelsVersion = useRef(0);
+  const labelTimer = useRef(null);
+  const [selection, setSelection] = useState(null);
+  const [tileInfo, setTileInfo] = useState(null);
+  const [view, setView] = useState(null);
+  const [zoom, setZoom] = useState(1);
 
   // NEW: Selected label mode (default good)
   const [currentLabel, setCurrentLabel] = useState("good");
 
+  // since=0 is every label; later polls send the last version seen and
+  // get back only what changed after it
+  async function loadLabels(full) {
+    const since = full ? 0 : labelsVersion.current;
+    const res = await axios.get(
+      `http://127.0.0.1:5000/labels/${segmentsMeta.image_id}`,
+      { params: { since } }
+    );
+    labelsVersion.current = res.data.version;
+    if (full) setLabels(res.data.labels);
+    else if (Object.keys(res.data.labels).length)
+      setLabels((prev) => ({ ...prev, ...res.data.labels }));
+  }
+
   useEffect(() => {
-    async function loadLabels() {
-      try {
-        const res = await axios.get(
-          `http://127.0.0.1:5000/labels/${segmentsMeta.image_id}`
-        );
-        setLabels(res.data || {});
-      } catch (e) {}
-    }
-    loadLabels();
+    labelsVersion.current = 0;
+    loadLabels(true).catch(() => {});
+    const timer = setInterval(() => loadLabels(false).catch(() => {}), LABEL_POLL_MS);
+    return () => clearInterval(timer);
+    // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [segmentsMeta.image_id]);
 
   useEffect(() => {
     setHoverId(null);
+    setPolygons({});
   }, [segmentsMeta]);
 
-  function onImgLoad(e) {
-    setImageSize([e.target.naturalWidth, e.target.naturalHeight]);
+  // the pyramid is built after upload; a 202 is its build job to wait for
+  useEffect(() => {
+    let cancelled = false;
+    async function loadTiles() {
+      const url = `http://127.0.0.1:5000/tiles/${segmentsMeta.image_id}`;
+      try {
+        let res = await axios.get(url);
+        while (res.status === 202 && !cancelled) {
+          await new Promise((r) => setTimeout(r, 1000));
+          const job = await axios.get(`http://127.0.0.1:5000${res.data.status_url}`);
+          if (job.data.status === "failed") throw new Error(job.data.error);
+          if (job.data.status === "done") res = await axios.get(url);
+        }
+        if (!cancelled) setTileInfo(res.data);
+      } catch {
+        if (!cancelled) setTileInfo(false);
+      }
+    }
+    setTileInfo(null);
+    loadTiles();
+    return () => {
+      cancelled = true;
+    };
+  }, [segmentsMeta.image_id]);
+
+  function tileUrl(t) {
+    return (
+      "http://127.0.0.1:5000" +
+      tileInfo.url.replace("{z}", t.z).replace("{x}", t.x).replace("{y}", t.y)
+    );
+  }
+
+  // on-screen part of the image, in full-size pixels
+  function visibleRegion() {
+    const frame = frameRef.current;
+    const box = scrollRef.current;
+    if (!frame || !box) return null;
+    const rect = frame.getBoundingClientRect();
+    const clip = box.getBoundingClientRect();
+    const scale = rect.width / segmentsMeta.image_shape[1];
+    const left = Math.max(rect.left, clip.left, 0);
+    const top = Math.max(rect.top, clip.top, 0);
+    const right = Math.min(rect.right, clip.right, window.innerWidth);
+    const bottom = Math.min(rect.bottom, clip.bottom, window.innerHeight);
+    if (!scale || right <= left || bottom <= top) return null;
+    return {
+      x0: Math.floor((left - rect.left) / scale),
+      y0: Math.floor((top - rect.top) / scale),
+      x1: Math.ceil((right - rect.left) / scale),
+      y1: Math.ceil((bottom - rect.top) / scale),
+      scale
+    };
+  }
+
+  // fetch polygons (and pick tiles) for the part of the image on screen;
+  // polygons far from it are dropped, so panning does not pile them up
+  async function loadViewport() {
+    const region = visibleRegion();
+    if (!region) return;
+    setView(region);
+    const seq = ++viewportSeq.current;
+
+    const { scale, ...bounds } = region;
+    const params = { ...bounds, zoom: scale };
+    let page = 0;
+    while (page !== null) {
+      const res = await axios.get(
+        `http://127.0.0.1:5000/segments/${segmentsMeta.image_id}/viewport`,
+        { params: { ...params, page, format: "binary" }, responseType: "arraybuffer" }
+      );
+      // a newer view took over; its load prunes and fills in
+      if (seq !== viewportSeq.current) return;
+      const { header, polygons: loaded } = decodeGeometry(res.data);
+      const first = page === 0;
+      setPolygons((prev) => {
+        const next = first ? polygonsNear(prev, bounds) : { ...prev };
+        loaded.forEach((p) => {
+          next[p.id] = { ...p, bounds: polygonBounds(p.polygon) };
+        });
+        return next;
+      });
+      page = header.next_page;
+    }
+  }
+
+  function scheduleViewport() {
+    clearTimeout(viewportTimer.current);
+    viewportTimer.current = setTimeout(loadViewport, 150);
+  }
+
+  useEffect(() => {
+    window.addEventListener("scroll", scheduleViewport);
+    window.addEventListener("resize", scheduleViewport);
+    scheduleViewport();
+    return () => {
+      window.removeEventListener("scroll", scheduleViewport);
+      window.removeEventListener("resize", scheduleViewport);
+      clearTimeout(viewportTimer.current);
+    };
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [segmentsMeta.image_id, zoom]);
+
+  function mergeLabels(saved) {
+    setLabels((prev) => {
+      const next = { ...prev };
+      Object.entries(saved).forEach(([id, label]) => {
+        next[id] = { label, ts: Date.now() };
+      });
+      return next;
+    });
+  }
+
+  // clicks are queued and saved together in one /save_labels request
+  function flushLabels() {
+    const batch = pendingLabels.current;
+    pendingLabels.current = [];
+    if (batch.length === 0) return Promise.resolve();
+    return axios
+      .post("http://127.0.0.1:5000/save_labels", {
+        image_id: segmentsMeta.image_id,
+        labels: batch,
+        user: "web_user"
+      })
+      .catch((err) => console.error("label save failed", err));
   }
 
   function applyLabel(id, label) {
-    const newLabels = { ...labels };
-    newLabels[id] = { label, ts: Date.now() };
-    setLabels(newLabels);
+    mergeLabels({ [id]: label });
+    pendingLabels.current.push({ superpixel_id: id, label });
+    clearTimeout(labelTimer.current);
+    labelTimer.current = setTimeout(flushLabels, 300);
+  }
+
+  useEffect(() => {
+    return () => {
+      clearTimeout(labelTimer.current);
+      flushLabels();
+    };
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [segmentsMeta.image_id]);
+
+  // shift + drag labels every superpixel whose centroid is in the rectangle
+  function toImageCoords(e) {
+    const rect = frameRef.current.getBoundingClientRect();
+    const scale = rect.width / segmentsMeta.image_shape[1];
+    return [(e.clientX - rect.left) / scale, (e.clientY - rect.top) / scale];
+  }
+
+  function onSelectStart(e) {
+    if (!e.shiftKey || !frameRef.current) return;
+    e.preventDefault();
+    const [x, y] = toImageCoords(e);
+    setSelection({ x0: x, y0: y, x1: x, y1: y });
+  }
+
+  function onSelectMove(e) {
+    if (!selection) return;
+    const [x, y] = toImageCoords(e);
+    setSelection({ ...selection, x1: x, y1: y });
+  }
 
+  function onSelectEnd() {
+    if (!selection) return;
+    const rect = [
+      Math.min(selection.x0, selection.x1),
+      Math.min(selection.y0, selection.y1),
+      Math.max(selection.x0, selection.x1),
+      Math.max(selection.y0, selection.y1)
+    ];
+    setSelection(null);
+    if (rect[2] - rect[0] < 1 || rect[3] - rect[1] < 1) return;
     axios
-      .post("http://127.0.0.1:5000/save_label", {
+      .post("http://127.0.0.1:5000/save_labels", {
         image_id: segmentsMeta.image_id,
-        superpixel_id: id,
-        label: label,
+        label: currentLabel,
+        rect,
         user: "web_user"
       })
+      .then((res) => mergeLabels(res.data.labels || {}))
+      .catch((err) => console.error("label save failed", err));
+  }
+
+  function acceptSuggestions() {
+    const suggestions = segmentsMeta.suggestions || {};
+    const batch = Object.entries(suggestions)
+      .filter(([id, s]) => !labels[id] && s.confidence >= ACCEPT_CONFIDENCE)
+      .map(([id, s]) => ({ superpixel_id: Number(id), label: s.label }));
+    if (batch.length === 0) return;
+    axios
+      .post("http://127.0.0.1:5000/save_labels", {
+        image_id: segmentsMeta.image_id,
+        labels: batch,
+        user: "model_" + segmentsMeta.model
+      })
+      .then((res) => mergeLabels(res.data.labels || {}))
       .catch((err) => console.error("label save failed", err));
   }
 
+  // grow the saved labels over neighbouring superpixels of similar color
+  function propagateLabels() {
+    clearTimeout(labelTimer.current);
+    flushLabels()
+      .then(() =>
+        axios.post(`http://127.0.0.1:5000/segments/${segmentsMeta.image_id}/propagate`, {
+          method: "flood",
+          save: true
+        })
+      )
+      .then((res) => mergeLabels(res.data.labels || {}))
+      .catch((err) => console.error("label propagation failed", err));
+  }
+
   function polygonPoints(polygon) {
     return polygon.map((p) => p.join(",")).join(" ");
   }
@@ -126,60 +419,144 @@ export default function SuperpixelAnnotator({ imageUrl, segmentsMeta }) {
         <span style={{ marginLeft: 12, color: "#b388ff" }}>
           Selected: <strong>{currentLabel.toUpperCase()}</strong>
         </span>
+        <span style={{ marginLeft: 12, color: "#888" }}>
+          Shift + drag to label a region
+        </span>
+
+        <button
+          style={{ marginLeft: 12 }}
+          disabled={zoom <= 1}
+          onClick={() => setZoom(Math.max(1, zoom / 2))}
+        >
+          −
+        </button>
+        <span style={{ margin: "0 6px", color: "#ddd" }}>{zoom}×</span>
+        <button
+          disabled={zoom >= MAX_ZOOM}
+          onClick={() => setZoom(Math.min(MAX_ZOOM, zoom * 2))}
+        >
+          +
+        </button>
       </div>
 
-      {/* IMAGE + POLYGONS */}
-      <div style={{ position: "relative", display: "inline-block" }}>
-        <img
-          ref={imgRef}
-          src={imageUrl}
-          alt="orthomosaic"
-          onLoad={onImgLoad}
-          style={{ display: "block", maxWidth: "100%", height: "auto" }}
-        />
-
-        <svg
-          ref={svgRef}
-          viewBox={`0 0 ${segmentsMeta.image_shape[1]} ${segmentsMeta.image_shape[0]}`}
-          preserveAspectRatio="xMinYMin meet"
+      {/* IMAGE TILES + POLYGONS */}
+      <div
+        ref={scrollRef}
+        onScroll={scheduleViewport}
+        style={{ overflow: "auto", maxHeight: "80vh" }}
+      >
+        <div
+          ref={frameRef}
           style={{
-            position: "absolute",
-            left: 0,
-            top: 0,
-            width: "100%",
-            height: "100%",
-            pointerEvents: "none"
+            position: "relative",
+            width: `${zoom * 100}%`,
+            aspectRatio: `${segmentsMeta.image_shape[1]} / ${segmentsMeta.image_shape[0]}`,
+            background: "#111"
           }}
+          onMouseDown={onSelectStart}
+          onMouseMove={onSelectMove}
+          onMouseUp={onSelectEnd}
         >
-          {segmentsMeta.polygons.map((s) => {
-            const id = s.id;
-            const labelObj = labels[id];
-            const fill = labelObj
-              ? LABEL_COLORS[labelObj.label]
-              : "rgba(0,0,0,0)";
-            const stroke =
-              hoverId === id
-                ? "rgba(255,255,255,0.6)"
-                : "rgba(0,0,0,0.25)";
-
-            return (
-              <polygon
-                key={id}
-                points={polygonPoints(s.polygon)}
-                fill={fill}
-                stroke={stroke}
-                strokeWidth={0.7}
-                style={{ cursor: "pointer", pointerEvents: "all" }}
-                onClick={(e) => {
-                  e.stopPropagation();
-                  applyLabel(id, currentLabel);
-                }}
-                onMouseEnter={() => setHoverId(id)}
-                onMouseLeave={() => setHoverId(null)}
+          {tileInfo === false && (
+            <img
+              src={imageUrl}
+              alt="orthomosaic"
+              style={{ display: "block", width: "100%", height: "100%" }}
+            />
+          )}
+          {tileInfo && (
+            // the single coarsest tile stays underneath while finer ones load
+            <img
+              src={tileUrl({ z: 0, x: 0, y: 0 })}
+              alt=""
+              draggable={false}
+              style={{ position: "absolute", left: 0, top: 0, width: "100%", height: "100%" }}
+            />
+          )}
+          {tileInfo &&
+            view &&
+            visibleTiles(tileInfo, tileLevel(tileInfo, view.scale), view)
+              .filter((t) => t.z > 0)
+              .map((t) => (
+                <img
+                  key={`${t.z}/${t.x}_${t.y}`}
+                  src={tileUrl(t)}
+                  alt=""
+                  draggable={false}
+                  style={{
+                    position: "absolute",
+                    left: `${t.left}%`,
+                    top: `${t.top}%`,
+                    width: `${t.width}%`,
+                    height: `${t.height}%`
+                  }}
+                />
+              ))}
+
+          <svg
+            ref={svgRef}
+            viewBox={`0 0 ${segmentsMeta.image_shape[1]} ${segmentsMeta.image_shape[0]}`}
+            preserveAspectRatio="xMinYMin meet"
+            style={{
+              position: "absolute",
+              left: 0,
+              top: 0,
+              width: "100%",
+              height: "100%",
+              pointerEvents: "none"
+            }}
+          >
+            {Object.values(polygons).map((s) => {
+              const id = s.id;
+              const labelObj = labels[id];
+              // unlabeled superpixels show the model's suggestion, fainter
+              const suggestion =
+                !labelObj && segmentsMeta.suggestions
+                  ? segmentsMeta.suggestions[id]
+                  : null;
+              const fill = labelObj
+                ? LABEL_COLORS[labelObj.label]
+                : suggestion
+                ? LABEL_COLORS[suggestion.label] || "rgba(0,0,0,0)"
+                : "rgba(0,0,0,0)";
+              const stroke =
+                hoverId === id
+                  ? "rgba(255,255,255,0.6)"
+                  : "rgba(0,0,0,0.25)";
+
+              return (
+                <polygon
+                  key={id}
+                  points={polygonPoints(s.polygon)}
+                  fill={fill}
+                  fillOpacity={suggestion ? 0.4 : 1}
+                  stroke={stroke}
+                  strokeWidth={0.7}
+                  style={{ cursor: "pointer", pointerEvents: "all" }}
+                  onClick={(e) => {
+                    e.stopPropagation();
+                    if (e.shiftKey) return;
+                    applyLabel(id, currentLabel);
+                  }}
+                  onMouseEnter={() => setHoverId(id)}
+                  onMouseLeave={() => setHoverId(null)}
+                />
+              );
+            })}
+            {selection && (
+              <rect
+                x={Math.min(selection.x0, selection.x1)}
+                y={Math.min(selection.y0, selection.y1)}
+                width={Math.abs(selection.x1 - selection.x0)}
+                height={Math.abs(selection.y1 - selection.y0)}
+                fill="rgba(179, 136, 255, 0.15)"
+                stroke="#b388ff"
+                strokeDasharray="6 4"
+                vectorEffect="non-scaling-stroke"
               />
-            );
-          })}
-        </svg>
+            )}
+          </svg>
+        </div>
       </div>
 
       {/* LABEL MANAGEMENT BUTTONS */}
@@ -201,17 +578,36 @@ export default function SuperpixelAnnotator({ imageUrl, segmentsMeta }) {
           Download labels JSON
         </button>
 
+        {/* full-resolution class masks, rasterized on the server */}
+        <a
+          href={`http://127.0.0.1:5000/export/${segmentsMeta.image_id}/mask?format=png`}
+          download
+        >
+          <button style={{ marginLeft: 8 }}>Mask PNG</button>
+        </a>
+        <a
+          href={`http://127.0.0.1:5000/export/${segmentsMeta.image_id}/mask?format=tif`}
+          download
+        >
+          <button style={{ marginLeft: 8 }}>Mask GeoTIFF</button>
+        </a>
+
         <button
           style={{ marginLeft: 8 }}
-          onClick={async () => {
-            const res = await axios.get(
-              `http://127.0.0.1:5000/labels/${segmentsMeta.image_id}`
-            );
-            setLabels(res.data || {});
-          }}
+          onClick={() => loadLabels(true)}
         >
           Reload labels
         </button>
+
+        <button style={{ marginLeft: 8 }} onClick={propagateLabels}>
+          Propagate labels
+        </button>
+
+        {segmentsMeta.suggestions && (
+          <button style={{ marginLeft: 8 }} onClick={acceptSuggestions}>
+            Accept suggestions (confidence ≥ {ACCEPT_CONFIDENCE})
+          </button>
+        )}
       </div>
     </div>
   );
@@ -0,0 +1,43 @@
+// Decoder for ?format=binary segment geometry (backend/wire.py):
+//   "OVG1" | header length (uint32 LE) | header JSON | arrays
+// header.arrays maps name -> [dtype, byte offset after the header, count];
+// each array is 4-byte aligned, so it is read in place as a typed array.
+
+const TYPED = {
+  "<i2": Int16Array,
+  "<i4": Int32Array,
+  "<u4": Uint32Array,
+  "<f4": Float32Array
+};
+
+export function decodeGeometry(buffer) {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== "OVG1") throw new Error("not an encoded geometry buffer");
+  const size = view.getUint32(4, true);
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, size)));
+  const base = 8 + size + ((4 - (size % 4)) % 4);
+  const arrays = {};
+  Object.entries(header.arrays).forEach(([name, [dtype, offset, count]]) => {
+    arrays[name] = new TYPED[dtype](buffer, base + offset, count);
+  });
+
+  // first vertex of each polygon is absolute, the rest are steps
+  const { ids, counts, starts, deltas } = arrays;
+  const polygons = new Array(header.n);
+  let d = 0;
+  for (let k = 0; k < header.n; k++) {
+    const polygon = new Array(counts[k]);
+    let x = starts[2 * k];
+    let y = starts[2 * k + 1];
+    for (let i = 0; i < counts[k]; i++) {
+      if (i > 0) {
+        x += deltas[d++];
+        y += deltas[d++];
+      }
+      polygon[i] = [x, y];
+    }
+    polygons[k] = { id: ids[k], polygon };
+  }
+  return { header, polygons, features: arrays.features };
+}